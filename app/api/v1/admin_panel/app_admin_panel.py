@@ -30,7 +30,8 @@ from models.clinic import Clinic
 from models.type_research import TypeResearch
 from models.user import User
 from models.device_type import DeviceType
-from service import common, service_device
+from service import common, service_device, service_users
+from service.service_executor import cpu_executor
 
 router = APIRouter(
     prefix='/api/v1/admin_panel',
@@ -61,6 +62,18 @@ async def admin_panel_list(session: AsyncSession = Depends(get_session)):
         raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, details=f"ERROR: {error}")
     elif not result:
         return []
-    result['devices'] = [*device_status.items]
+    result['devices'] = device_status
     return result
 
+
+
+@router.get(
+    '/cpu_executor',
+    summary="Пул CPU-нагруженных операций",
+    description="Состояние пула CPU-нагруженных операций и метрики по типам задач: количество, ошибки, "
+                "суммарное и максимальное время выполнения",
+    response_description="Метрики пула",
+    dependencies=[Depends(service_users.check_admin_status)]
+)
+async def cpu_executor_metrics() -> dict:
+    return cpu_executor.metrics()
@@ -1,15 +1,17 @@
 from uuid import UUID
 from http import HTTPStatus
-import json
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from fastapi_pagination import Page, Params, paginate
 
 from models.desyncdata import DesyncDatas, DesyncDatasCreate, DesyncDatasBaseWithoutData
-from service import common, service_desync_datas_base
+from service import common, service_desync_datas_base, service_research_series, service_research_export
 from db.postgres import get_session, AsyncSession
 from service import service_users
 from config.logs_config import logger_app_desyncdata_admin
-from service.common import cache_data, get_cached_data, custom_serializer
+from service.service_cache import cached
+from models.cursor_page import CursorParams, CursorPage
+from models.research_series import SeriesParams, ResearchSeries
 
 router = APIRouter(
     prefix='/api/v1/admin_panel/desync_datas',
@@ -20,11 +22,12 @@ router = APIRouter(
 
 @router.get(
     '/',
-    response_model=Page[DesyncDatasBaseWithoutData] | list,
+    response_model=CursorPage[DesyncDatasBaseWithoutData] | Page[DesyncDatasBaseWithoutData] | list,
     summary="История исследований",
     description="История проведенных исследований",
     response_description="Список проведенных исследований"
 )
+@cached(DesyncDatas)
 async def desync_users(user_uuid: str | None = None,
                        device_uuid: str | None = None,
                        type_research_uuid: str | None = None,
@@ -33,6 +36,7 @@ async def desync_users(user_uuid: str | None = None,
                        patient_uuid: str | None = None,
                        research_uuid_part: str | None = None,
                        params: Params = Depends(),
+                       cursor_params: CursorParams = Depends(),
                        session: AsyncSession = Depends(get_session)
                        ) -> list[DesyncDatasBaseWithoutData] | list:
 
@@ -41,18 +45,15 @@ async def desync_users(user_uuid: str | None = None,
     type_research_uuid = common.validate_uuid(type_research_uuid)
     patient_uuid = common.validate_uuid(patient_uuid)
 
-    cache_key = f"admin_research_history_{user_uuid}_{device_uuid}_{type_research_uuid}_{date_from}_{date_to}_{patient_uuid}"
-
-    cached_results = await get_cached_data(cache_key)
-    if cached_results:
-        try:
-            # Преобразуем кэшированные результаты в нужный формат
-            unique_results = {item['uuid']: item for item in cached_results}.values()
-            return paginate(list(unique_results), params)
-        except Exception as e:
-            logger_app_desyncdata_admin.error(f"Ошибка при работе с кэшированными данными: {e}")
-            raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
-                                detail="Ошибка при работе с кэшированными данными")
+    if cursor_params.limit:
+        page, err = await service_desync_datas_base.view_history_page(user_uuid, session, device_uuid,
+                                                                      type_research_uuid, date_from, date_to,
+                                                                      patient_uuid, research_uuid_part, cursor_params)
+        if err:
+            logger_app_desyncdata_admin.error(f"Проверьте правильность введенных данных. ERROR: {err}")
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                                detail=f"Проверьте правильность введенных данных. ERROR: {err}")
+        return page
 
     results, err = await service_desync_datas_base.view_history(user_uuid, session, device_uuid, type_research_uuid,
                                                                 date_from, date_to, patient_uuid, research_uuid_part)
@@ -63,23 +64,7 @@ async def desync_users(user_uuid: str | None = None,
     elif not results:
         return []
 
-    # Преобразуем объекты модели в словари перед сериализацией
-    try:
-        results_dicts = [item.dict() for item in results]  # Если это Pydantic-модель, используйте .dict()
-        json_results = json.dumps(results_dicts, default=custom_serializer)
-    except Exception as e:
-        logger_app_desyncdata_admin.error(f"Ошибка при сериализации данных: {e}")
-        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
-                            detail="Ошибка при сериализации данных перед кэшированием")
-
-    try:
-        unique_results = {item['uuid']: item for item in results_dicts}.values()
-        # Убираем await если функция не является асинхронной
-        cache_data(cache_key, list(unique_results))  # Убедитесь, что cache_data не является coroutine
-    except Exception as e:
-        logger_app_desyncdata_admin.error(f"Ошибка при кэшировании данных: {e}")
-        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail="Ошибка при кэшировании данных")
-
+    unique_results = {item.uuid: item for item in results}.values()
     return paginate(list(unique_results), params)
 
 
@@ -94,7 +79,8 @@ async def desync_details(
         desync_uuid: UUID,
         session: AsyncSession = Depends(get_session)
 ) -> DesyncDatas | list:
-    result, err = await common.get_model_details(model_uuid=desync_uuid, model_type=DesyncDatas, session=session)
+    result, err = await service_desync_datas_base.get_research_details(desync_uuid=desync_uuid,
+                                                                       session=session)
     if err:
         logger_app_desyncdata_admin.error(f"ERROR: {err}")
         raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
@@ -103,6 +89,52 @@ async def desync_details(
     return result
 
 
+@router.get(
+    '/{desync_uuid}/series',
+    response_model=ResearchSeries | list,
+    summary="Данные исследования для графика",
+    description="Данные исследования за интервал времени по выбранным каналам, сжатые на сервере до заданного "
+                "количества точек: среднее, минимум и максимум по интервалам (minmax) или прореживание LTTB",
+    response_description="Ряды значений по каналам"
+)
+async def desync_series(
+        desync_uuid: UUID,
+        series_params: SeriesParams = Depends(),
+        session: AsyncSession = Depends(get_session)
+) -> ResearchSeries | list:
+    result, err = await service_research_series.get_research_series(desync_uuid=desync_uuid, params=series_params,
+                                                                    session=session)
+    if err:
+        logger_app_desyncdata_admin.error(f"ERROR: {err}")
+        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
+    elif not result:
+        return []
+    return result
+
+
+@router.get(
+    '/{desync_uuid}/export',
+    response_class=StreamingResponse,
+    summary="Выгрузка исследования",
+    description="Потоковая выгрузка данных исследования в CSV или колоночный двоичный формат, "
+                "сырого сигнала ЭЭГ - в EDF, если он сохранялся",
+    response_description="Файл исследования"
+)
+async def desync_export(
+        desync_uuid: UUID,
+        export_format: str = Query("csv", alias="format", regex="^(csv|columnar|edf)$"),
+        session: AsyncSession = Depends(get_session)
+) -> StreamingResponse:
+    result, err = await service_research_export.export_research(desync_uuid=desync_uuid, export_format=export_format,
+                                                                session=session)
+    if err:
+        logger_app_desyncdata_admin.error(f"ERROR: {err}")
+        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
+    elif not result:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Данные исследования не найдены")
+    return result
+
+
 @router.put(
     '/{desync_uuid}',
     response_model=DesyncDatas,
@@ -9,7 +9,8 @@ from db.postgres import get_session, AsyncSession
 from models.device import Device, DeviceRead, DeviceCreate, DeviceUpdate, DeviceFilter
 from service import service_device, service_users, common
 from config.logs_config import logger_app_device_admin
-from service.common import cache_data, get_cached_data
+from service.service_cache import cached
+from models.cursor_page import CursorParams, CursorPage
 
 router = APIRouter(
     prefix='/api/v1/admin_panel/devices',
@@ -20,19 +21,23 @@ router = APIRouter(
 
 @router.get(
     '/',
-    response_model=Page[DeviceRead] | list,
+    response_model=CursorPage[DeviceRead] | Page[DeviceRead] | list,
     summary="Список Устройств",
     description="Список устройств зарегистрированных в системе",
     response_description="Список устройств зарегистрированных в системе"
 )
+@cached(Device, refresh=service_device.refresh_statuses)
 async def devices_list(params: Params = Depends(),
                        device_filter: DeviceFilter = FilterDepends(DeviceFilter),
+                       cursor_params: CursorParams = Depends(),
                        session: AsyncSession = Depends(get_session)
                        ):
-    cache_key = f"admin_devices_list_{device_filter}"
-    cached_results = await get_cached_data(cache_key)
-    if cached_results:
-        return paginate([*cached_results], params)
+    if cursor_params.limit:
+        page, err = await service_device.get_devices_page(device_filter, cursor_params, session)
+        if err:
+            logger_app_device_admin.error(f"ERROR: {err}")
+            raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
+        return page
 
     result, err = await service_device.get_devices_filter(device_filter, session)
     if err:
@@ -40,8 +45,6 @@ async def devices_list(params: Params = Depends(),
         raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
     elif not result:
         return []
-
-    cache_data(cache_key, result)
     return paginate([*result], params)
 
 
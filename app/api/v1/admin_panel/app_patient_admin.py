@@ -3,10 +3,11 @@ from http import HTTPStatus
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi_pagination import Page, Params, paginate
 
-from models.patient import Patient, PatientCreate, PatientRead
+from models.patient import Patient, PatientCreate, PatientRead, PatientFilter
 from service import common, service_users
 from db.postgres import get_session, AsyncSession
 from config.logs_config import logger_app_patient_admin
+from models.cursor_page import CursorParams, CursorPage
 
 router = APIRouter(
     prefix='/api/v1/admin_panel/patient',
@@ -17,7 +18,7 @@ router = APIRouter(
 
 @router.get(
     '/',
-    response_model=Page[Patient] | list,
+    response_model=CursorPage[Patient] | Page[Patient] | list,
     summary="Список пациентов",
     description="Список пациентов зарегистрированных в системе",
     response_description="Список пациентов в системе"
@@ -25,8 +26,18 @@ router = APIRouter(
 # @cache(key_builder=redis_persons_key_by_id)
 async def patient_list(
         params: Params = Depends(),
+        cursor_params: CursorParams = Depends(),
         session: AsyncSession = Depends(get_session)
 ) -> list[Patient] | list:
+    if cursor_params.limit:
+        page, err = await common.search_page(model=Patient, filter_model=PatientFilter(),
+                                             order_columns=[Patient.code, Patient.uuid],
+                                             params=cursor_params, session=session)
+        if err:
+            logger_app_patient_admin.error(f"ERROR: {err}")
+            raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
+        return page
+
     result, err = await common.get_models_list(models_type=Patient, session=session)
     if err:
         logger_app_patient_admin.error(f"ERROR: {err}")
@@ -8,6 +8,7 @@ from models.user import User, UserCreate, UserRecoveryPassword, UserRead, UserUp
 from service import common, service_users
 from db.postgres import get_session, AsyncSession
 from config.logs_config import logger_app_user_admin
+from models.cursor_page import CursorParams, CursorPage
 
 
 router = APIRouter(
@@ -19,7 +20,7 @@ router = APIRouter(
 
 @router.get(
     '/',
-    response_model=Page[UserRead] | list,
+    response_model=CursorPage[UserRead] | Page[UserRead] | list,
     summary="Список пользователей",
     description="Список пользователей зарегистрированных в системе",
     response_description="Список пользователей в системе"
@@ -28,8 +29,17 @@ router = APIRouter(
 async def user_list(
         name_or_surname: str = None,
         params: Params = Depends(),
+        cursor_params: CursorParams = Depends(),
         session: AsyncSession = Depends(get_session)
 ) -> list[UserRead] | list:
+    if cursor_params.limit:
+        page, err = await service_users.search_user_page(name_or_surname=name_or_surname, params=cursor_params,
+                                                         session=session)
+        if err:
+            logger_app_user_admin.error(f"ERROR: {err}")
+            raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
+        return page
+
     result, err = await service_users.search_user(name_or_surname=name_or_surname, session=session)
     if err:
         logger_app_user_admin.error(f"ERROR: {err}")
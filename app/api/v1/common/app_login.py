@@ -12,6 +12,7 @@ from config.settings import settings
 from service.service_settings import reload_env
 from config.logs_config import logger_app_login
 from redis_module.redis_client import redis
+from service.service_session_cache import publish_session_replaced
 
 router = APIRouter(
     prefix='/api/v1/login',
@@ -48,15 +49,13 @@ async def authorization_user(
             expires_delta=access_token_expires
         )
 
-        # Удаляем старую сессию (если есть)
-        previous_session = await redis.get(f"user_session:{user.uuid}")
-        if previous_session:
-            await redis.delete(f"user_token:{user.uuid}")
-            await redis.delete(f"user_session:{user.uuid}")
-
-        # Сохраняем новые данные сессии
-        await redis.set(f"user_token:{user.uuid}", access_token, ex=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
-        await redis.set(f"user_session:{user.uuid}", session_id, ex=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+        # Заменяем старую сессию (если есть) новой одной транзакцией
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.set(f"user_token:{user.uuid}", access_token, ex=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+            pipe.set(f"user_session:{user.uuid}", session_id, ex=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+            await pipe.execute()
+        # Старый токен не должен оставаться в кэше проверенных токенов воркеров
+        await publish_session_replaced(str(user.uuid))
 
     except Exception as err:
         logger_app_login.error(f"ERROR: {err}", exc_info=True)
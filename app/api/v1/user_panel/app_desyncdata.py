@@ -2,17 +2,19 @@ from uuid import UUID
 from http import HTTPStatus
 from typing import List, Union
 from datetime import datetime
-import json
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from fastapi_pagination import Page, Params, paginate
 
 from models.desyncdata import DesyncDatas, DesyncDatasCreate, DesyncDatasRead, DesyncDatasBaseWithoutData
-from service import common, service_desync_datas_base
+from service import common, service_desync_datas_base, service_research_series, service_research_export
 from db.postgres import get_session, AsyncSession
 from service import service_users
 from config.logs_config import logger_app_desyncdata
-from service.common import cache_data, get_cached_data
+from service.service_cache import cached
+from models.cursor_page import CursorParams, CursorPage
+from models.research_series import SeriesParams, ResearchSeries
 
 router = APIRouter(
     prefix='/api/v1/desync_datas',
@@ -45,11 +47,12 @@ async def create_datas(data: DesyncDatasCreate,
 
 @router.get(
     '/desync_user',
-    response_model=Page[DesyncDatasBaseWithoutData] | list,
+    response_model=CursorPage[DesyncDatasBaseWithoutData] | Page[DesyncDatasBaseWithoutData] | list,
     summary="История исследований для пользователя",
     description="История исследований для пользователя с сортировкой",
     response_description="Найденные записи с историей пользователем"
 )
+@cached(DesyncDatas)
 async def desync_users(user_uuid: str = Depends(service_users.get_current_user_uuid),
                        device_uuid: str | None = None,
                        type_research_uuid: str | None = None,
@@ -58,6 +61,7 @@ async def desync_users(user_uuid: str = Depends(service_users.get_current_user_u
                        patient_uuid: str | None = None,
                        research_uuid_part: str | None = None,
                        params: Params = Depends(),
+                       cursor_params: CursorParams = Depends(),
                        session: AsyncSession = Depends(get_session)
                        ) -> list[DesyncDatasBaseWithoutData] | list:
 
@@ -65,14 +69,16 @@ async def desync_users(user_uuid: str = Depends(service_users.get_current_user_u
     type_research_uuid = common.validate_uuid(type_research_uuid)
     patient_uuid = common.validate_uuid(patient_uuid)
 
-    cache_key = f"research_history_user_{user_uuid}_{device_uuid}_{type_research_uuid}_{date_from}_{date_to}_{patient_uuid}"
-    try:
-        cached_results = await get_cached_data(cache_key)
-        if cached_results:
-            unique_results = {item['uuid']: item for item in cached_results}.values()
-            return paginate(list(unique_results), params)
-    except Exception as e:
-        logger_app_desyncdata.debug(f"Ошибка при работе с кэшированными данными: {e}")
+    if cursor_params.limit:
+        page, err = await service_desync_datas_base.view_history_page(user_uuid, session, device_uuid,
+                                                                      type_research_uuid, date_from, date_to,
+                                                                      patient_uuid, research_uuid_part, cursor_params)
+        if err:
+            logger_app_desyncdata.debug(f"Проверьте правильность введенных данных. ERROR: {err}")
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                                detail=f"Проверьте правильность введенных данных. ERROR: {err}")
+        return page
+
     results, err = await service_desync_datas_base.view_history(user_uuid, session, device_uuid,
                                                                 type_research_uuid, date_from,
                                                                 date_to, patient_uuid, research_uuid_part)
@@ -82,12 +88,6 @@ async def desync_users(user_uuid: str = Depends(service_users.get_current_user_u
                             detail=f"Проверьте правильность введенных данных. ERROR: {err}")
     elif not results:
         return []
-    try:
-        results_dicts = [item.dict() for item in results]
-        cache_data(cache_key, results_dicts)
-    except Exception as e:
-        logger_app_desyncdata.debug(f"Ошибка при кэшировании данных: {e}")
-        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail="Ошибка при кэшировании данных")
     return paginate([*results], params)
 
 
@@ -103,10 +103,57 @@ async def desync_details(
         desync_uuid: UUID,
         session: AsyncSession = Depends(get_session)
 ) -> DesyncDatas | list:
-    result, err = await common.get_model_details(model_uuid=desync_uuid, model_type=DesyncDatas, session=session)
+    result, err = await service_desync_datas_base.get_research_details(desync_uuid=desync_uuid,
+                                                                       session=session)
+    if err:
+        logger_app_desyncdata.error(f"ERROR: {err}")
+        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
+    elif not result:
+        return []
+    return result
+
+
+@router.get(
+    '/{desync_uuid}/series',
+    response_model=ResearchSeries | list,
+    summary="Данные исследования для графика",
+    description="Данные исследования за интервал времени по выбранным каналам, сжатые на сервере до заданного "
+                "количества точек: среднее, минимум и максимум по интервалам (minmax) или прореживание LTTB",
+    response_description="Ряды значений по каналам"
+)
+async def desync_series(
+        desync_uuid: UUID,
+        series_params: SeriesParams = Depends(),
+        session: AsyncSession = Depends(get_session)
+) -> ResearchSeries | list:
+    result, err = await service_research_series.get_research_series(desync_uuid=desync_uuid, params=series_params,
+                                                                    session=session)
     if err:
         logger_app_desyncdata.error(f"ERROR: {err}")
         raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
     elif not result:
         return []
     return result
+
+
+@router.get(
+    '/{desync_uuid}/export',
+    response_class=StreamingResponse,
+    summary="Выгрузка исследования",
+    description="Потоковая выгрузка данных исследования в CSV или колоночный двоичный формат, "
+                "сырого сигнала ЭЭГ - в EDF, если он сохранялся",
+    response_description="Файл исследования"
+)
+async def desync_export(
+        desync_uuid: UUID,
+        export_format: str = Query("csv", alias="format", regex="^(csv|columnar|edf)$"),
+        session: AsyncSession = Depends(get_session)
+) -> StreamingResponse:
+    result, err = await service_research_export.export_research(desync_uuid=desync_uuid, export_format=export_format,
+                                                                session=session)
+    if err:
+        logger_app_desyncdata.error(f"ERROR: {err}")
+        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
+    elif not result:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Данные исследования не найдены")
+    return result
@@ -8,7 +8,8 @@ from models.patient import Patient, PatientCreate, PatientFilter, PatientRead
 from service import common, service_users
 from db.postgres import get_session, AsyncSession
 from config.logs_config import logger_app_patient
-from service.common import cache_data, get_cached_data
+from service.service_cache import cached
+from models.cursor_page import CursorParams, CursorPage
 
 router = APIRouter(
     prefix='/api/v1/patient',
@@ -19,20 +20,26 @@ router = APIRouter(
 
 @router.get(
     '/',
-    response_model=Page[Patient] | list,
+    response_model=CursorPage[Patient] | Page[Patient] | list,
     summary="Список пациентов",
     description="Список пациентов зарегистрированных в системе",
     response_description="Список пациентов в системе"
 )
+@cached(Patient)
 async def patient_list(
         params: Params = Depends(),
         patient_filter: PatientFilter = FilterDepends(PatientFilter),  # Здесь используется фильтр
+        cursor_params: CursorParams = Depends(),
         session: AsyncSession = Depends(get_session)
 ) -> list[Patient] | list:
-    cache_key = f"patient_list_{patient_filter}"
-    cached_results = await get_cached_data(cache_key)
-    if cached_results:
-        return paginate([*cached_results], params)
+    if cursor_params.limit:
+        page, err = await common.search_page(model=Patient, filter_model=patient_filter,
+                                             order_columns=[Patient.code, Patient.uuid],
+                                             params=cursor_params, session=session)
+        if err:
+            logger_app_patient.error(f"ERROR: {err}")
+            raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
+        return page
 
     result, err = await common.search(model=Patient, filter_model=patient_filter, session=session)
     if err:
@@ -40,12 +47,6 @@ async def patient_list(
         raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=f"ERROR: {err}")
     elif not result:
         return []
-
-    try:
-        cache_data(cache_key, result)
-    except Exception as e:
-        logger_app_patient.error(f"Ошибка при кэшировании данных: {e}")
-
     return paginate([*result], params)
 
 
@@ -56,7 +57,7 @@ async def patient_list(
     description="Карточка данных о пациенте",
     response_description="Данные о пациенте"
 )
-# @cache(key_builder=redis_persons_key_by_id)
+@cached(Patient)
 async def patient_details(
         patient_uuid: UUID,
         session: AsyncSession = Depends(get_session)
@@ -6,6 +6,7 @@ from fastapi.responses import StreamingResponse
 from fastapi.requests import Request
 
 from service import service_desync_datas_base
+from service.service_sse_hub import hub as sse_hub
 from config.logs_config import logger_app_sse
 
 router = APIRouter(
@@ -25,6 +26,9 @@ async def chart_data(request: Request, status: str = None):
         logger_app_sse.error(f"Недопустимое значение статуса: '{status}'. Допустимые значения: 'open', 'in_process'.")
         raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
                             detail=f"Недопустимое значение статуса: '{status}'. Допустимые значения: 'open', 'in_process'.")
+    if not await sse_hub.wait_ready():
+        logger_app_sse.error("Источник обновлений SSE недоступен")
+        raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail="Источник обновлений недоступен")
     response = StreamingResponse(service_desync_datas_base.get_data_from_rethink(request, status),
                                  media_type="text/event-stream")
     response.headers["Access-Control-Allow-Origin"] = "*"
@@ -42,6 +46,9 @@ async def get_data_by_type_research_uuid(request: Request, desync_data_uuid: UUI
         logger_app_sse.error(f"Недопустимое значение статуса: '{status}'. Допустимые значения: 'open', 'in_process'.")
         raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
                             detail=f"Недопустимое значение статуса: '{status}'. Допустимые значения: 'open', 'in_process'.")
+    if not await sse_hub.wait_ready():
+        logger_app_sse.error("Источник обновлений SSE недоступен")
+        raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail="Источник обновлений недоступен")
     response = StreamingResponse(
         service_desync_datas_base.get_data_from_rethink_by_type_research_uuid(request, desync_data_uuid, status),
         media_type="text/event-stream")
@@ -9,6 +9,7 @@ class Base(BaseSettings):
     rethinkdb_table: str = 'dev_desync'
     rethinkdb_host: str = 'rethink_db'
     rethinkdb_port: int = 28015
+    rethinkdb_pool_size: int = 10
     border_time: int = 1000
 
     # API section
@@ -44,6 +45,24 @@ class Base(BaseSettings):
     redis_db: int
     redis_cache_expire: int
 
+    pagination_estimate_cap: int = 1000
+
+    cpu_executor_kind: str = 'thread'
+    cpu_executor_workers: int = 2
+    cpu_executor_max_pending: int = 32
+
+    session_cache_ttl: float = 10.0
+    session_cache_size: int = 10000
+
+    sse_backend: str = 'redis'
+    telemetry_channel_prefix: str = 'telemetry'
+    sse_queue_size: int = 100
+    sse_keepalive_seconds: float = 15.0
+    sse_ready_timeout: float = 5.0
+
+    export_chunk_rows: int = 1000
+    raw_archive_dir: str = '/data/raw_archive'
+
     class Config:
 
         env_file = f"{pathlib.Path(__file__).resolve().parent.parent.parent}/.env"
@@ -1,4 +1,7 @@
-from rethinkdb import r
+import asyncio
+from contextlib import asynccontextmanager
+
+from rethinkdb import r, RethinkDB, errors as re
 
 from config.settings import settings
 
@@ -8,9 +11,79 @@ port = settings.rethinkdb_port
 db_name = settings.rethinkdb_db
 table = settings.rethinkdb_table
 
-# r.set_loop_type('twуisted')
+# Отдельный экземпляр драйвера с циклом asyncio, глобальный r остаётся синхронным.
+# Запросы можно строить через любой из них, тип подключения определяет run
+r_async = RethinkDB()
+r_async.set_loop_type('asyncio')
 
 
 def get_rethink_session() -> r:
     conn = r.connect(host, port)
     return conn
+
+
+async def connect_rethink():
+    """Новое asyncio подключение к RethinkDB, для долгоживущих курсоров changefeed"""
+    return await r_async.connect(host, port)
+
+
+class AsyncRethinkPool:
+    """
+    Пул asyncio подключений к RethinkDB. Подключения не блокируют цикл событий
+    и переиспользуются между запросами, число одновременно открытых ограничено max_size
+    """
+
+    def __init__(self, max_size: int = settings.rethinkdb_pool_size):
+        self.max_size = max_size
+        self._idle: list = []
+        self._semaphore: asyncio.Semaphore | None = None
+
+    async def acquire(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_size)
+        await self._semaphore.acquire()
+        try:
+            while self._idle:
+                conn = self._idle.pop()
+                if conn.is_open():
+                    return conn
+            return await connect_rethink()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    async def release(self, conn, discard: bool = False):
+        try:
+            if discard or not conn.is_open():
+                await conn.close(noreply_wait=False)
+            else:
+                self._idle.append(conn)
+        finally:
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        """Подключение из пула, при обрыве соединения оно закрывается и в пул не возвращается"""
+        conn = await self.acquire()
+        discard = False
+        try:
+            yield conn
+        except re.ReqlDriverError:
+            discard = True
+            raise
+        finally:
+            await self.release(conn, discard=discard)
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop().close(noreply_wait=False)
+
+
+rethink_pool = AsyncRethinkPool()
+
+
+@asynccontextmanager
+async def get_rethink_connection():
+    """Подключение к RethinkDB из общего пула для async обработчиков"""
+    async with rethink_pool.connection() as conn:
+        yield conn
@@ -8,6 +8,8 @@ from api.v1.admin_panel import app_clinic, app_device_type, app_admin_panel, app
     app_device_admin, app_desyncdata_admin, app_clinic_address, app_type_research_admin, app_settings
 
 from config.settings import settings
+from db.rethink import rethink_pool
+from service.service_executor import cpu_executor
 
 
 app = FastAPI(
@@ -19,6 +21,11 @@ app = FastAPI(
     default_response_class=ORJSONResponse,
 )
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    await rethink_pool.close()
+    cpu_executor.shutdown()
+
 # @app.on_event("startup")
 # async def on_startup():
 #     # Initialize cache
@@ -0,0 +1,30 @@
+from typing import Generic, TypeVar, List
+
+from fastapi import Query
+from pydantic import BaseModel, Extra
+from pydantic.generics import GenericModel
+
+T = TypeVar("T")
+
+
+class CursorParams(BaseModel):
+    """
+    Параметры постраничной выборки на стороне БД. Если limit не передан, эндпоинт работает по-старому
+    """
+    limit: int | None = Query(None, ge=1, le=500, description="Размер страницы, включает выборку по курсору")
+    cursor: str | None = Query(None, description="Курсор следующей страницы из предыдущего ответа")
+    total: str | None = Query(None, regex="^(exact|estimate)$",
+                              description="Подсчёт общего количества: exact или estimate (с ограничением)")
+
+
+class CursorPage(GenericModel, Generic[T]):
+    items: List[T]
+    next_cursor: str | None = None
+    total: int | None = None
+    total_is_estimate: bool = False
+
+    class Config:
+        # В response_model эндпоинтов CursorPage стоит перед Page: pydantic v1 проверяет варианты Union слева
+        # направо, Page принимает ответ CursorPage (page, size и pages необязательны) и теряет next_cursor.
+        # Лишние поля запрещены, чтобы ответ Page, наоборот, не проходил как CursorPage
+        extra = Extra.forbid
@@ -1,14 +1,14 @@
 from typing import Optional
 from uuid import UUID, uuid4
 from datetime import datetime
-from sqlmodel import Field, SQLModel, Relationship, Column, JSON, TIMESTAMP, text
+from sqlmodel import Field, SQLModel, Relationship, Column, JSON, TIMESTAMP, text, ARRAY, Float, String
 
 
 class DesyncDatasBase(SQLModel):
     data: dict = Field(sa_column=Column(JSON), default={})
     date: Optional[datetime] = Field(sa_column=Column(
         TIMESTAMP(timezone=True),
-        nullable=True,
+        nullable=False,
         server_default=text("CURRENT_TIMESTAMP"),
     ))
 
@@ -49,3 +49,13 @@ class DesyncDatasCreate(DesyncDatasBase):
 
 class DesyncDatasRead(DesyncDatas):
     research_status: str|None = Field(nullable=True, default='open')
+
+
+class DesyncSamples(SQLModel, table=True):
+    """Значения десинхронизации исследования, которые пишет ETL, одна строка на запись"""
+    __tablename__ = "desync_samples"
+
+    research_uuid: UUID = Field(foreign_key="desyncdatas.uuid", primary_key=True)
+    ts: datetime = Field(sa_column=Column(TIMESTAMP(timezone=True), primary_key=True))
+    channels: list[str] = Field(sa_column=Column(ARRAY(String), nullable=False))
+    values: list[float] = Field(sa_column=Column(ARRAY(Float), nullable=False))
@@ -0,0 +1,32 @@
+from uuid import UUID
+from datetime import datetime
+from typing import List, Dict
+
+from fastapi import Query
+from pydantic import BaseModel
+
+
+class SeriesParams(BaseModel):
+    """
+    Параметры выборки данных исследования для графика
+    """
+    date_from: datetime | None = Query(None, description="Начало интервала, ISO 8601")
+    date_to: datetime | None = Query(None, description="Конец интервала, ISO 8601")
+    channels: List[str] | None = Query(None, description="Каналы, по умолчанию все")
+    points: int = Query(500, ge=3, le=10000, description="Количество точек на канал в ответе")
+    method: str = Query("minmax", regex="^(minmax|lttb)$",
+                        description="minmax - среднее, минимум и максимум по интервалам, lttb - прореживание LTTB")
+
+
+class ChannelSeries(BaseModel):
+    ts: List[datetime]
+    value: List[float | None]
+    min: List[float | None] | None = None
+    max: List[float | None] | None = None
+
+
+class ResearchSeries(BaseModel):
+    research_uuid: UUID
+    method: str
+    total_samples: int
+    channels: Dict[str, ChannelSeries]
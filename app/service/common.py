@@ -10,7 +10,6 @@ from http import HTTPStatus
 
 from PIL import Image
 from fastapi import HTTPException, Depends, UploadFile
-from redis import Redis
 from requests import RequestException
 from sqlalchemy.future import select
 from sqlalchemy import exc, delete
@@ -19,23 +18,20 @@ from db.postgres import get_session, AsyncSession
 from models.clinicaddress import ClinicAddress
 
 from models.clinic import Clinic
-from service import service_settings
+from service import service_settings, service_cache
+from service.service_executor import cpu_executor
+from service.service_pagination import keyset_page
+from models.cursor_page import CursorParams
 from models.user import User
 from config.settings import settings
-import json
-
-redis_client = Redis(host=settings.redis_host, port=settings.redis_port, db=settings.redis_db)
 
 
 async def cache_data(key: str, value: Any, expire: int = settings.redis_cache_expire):
-    await redis_client.setex(key, expire, json.dumps(value, default=str))
+    await service_cache.cache_set("common", key, value, expire)
 
 
 async def get_cached_data(key: str) -> Any | None:
-    cached_data = redis_client.get(key)
-    if cached_data:
-        return json.loads(cached_data)
-    return None
+    return await service_cache.cache_get("common", key)
 
 
 def custom_serializer(obj):
@@ -58,6 +54,7 @@ async def write_model_to_database(model_to_write, model_type, session: AsyncSess
         session.add(result)
         await session.commit()
         await session.refresh(result)
+        await service_cache.invalidate(model_type)
         return result, None
     except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
         print(f"LOG: {e}")
@@ -129,6 +126,7 @@ async def update_model_in_database(model_uuid: UUID, model_type, model_to_update
             session.add(model)
             await session.commit()
             await session.refresh(model)
+            await service_cache.invalidate(model_type)
             if admin_email_changed:
                 err = service_settings.update_admin_email(new_admin_email)
                 if err:
@@ -160,6 +158,7 @@ async def delete_model_clinic(clinic_uuid: UUID, session: AsyncSession = Depends
         if clinic:
             await session.delete(clinic)
             await session.commit()
+            await service_cache.invalidate(Clinic, ClinicAddress)
         else:
             raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Нет такой клиники")
     except exc.SQLAlchemyError as e:
@@ -184,6 +183,7 @@ async def delete_model_to_database(model_uuid: UUID, model_type,
         try:
             await session.delete(model)
             await session.commit()
+            await service_cache.invalidate(model_type)
         except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
             print(f"LOG: {e}")
             return None, e
@@ -234,6 +234,27 @@ async def search(model, filter_model, session: AsyncSession) -> tuple[Any, None]
         await session.close()
 
 
+async def search_page(model, filter_model, order_columns: list, params: CursorParams,
+                      session: AsyncSession) -> tuple[Any, None] | tuple[None, Any]:
+    """
+    Страница поиска моделей на стороне БД по ключу сортировки
+    :param model: тип модели
+    :param filter_model: фильтр fastapi_filter
+    :param order_columns: колонки ключа сортировки, последняя уникальная
+    :param params: CursorParams
+    :param session: AsyncSession
+    :return: (CursorPage, err)
+    """
+    try:
+        page = await keyset_page(filter_model.filter(select(model)), order_columns, params, session)
+        return page, None
+    except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
+        print(f"LOG: {e}")
+        return None, e
+    finally:
+        await session.close()
+
+
 async def upload_image(model, uuid: UUID, filename: str, session: AsyncSession = Depends(get_session)):
     try:
         result = await session.get(model, uuid)
@@ -282,9 +303,14 @@ async def get_clinic_uuid(session: AsyncSession = Depends(get_session)):
     return clinics[0].uuid
 
 
-async def compress_image(image_file: UploadFile, max_size_mb: float = 0.5) -> Tuple[io.BytesIO, str | None, str]:
+def compress_image_bytes(image_data: bytes) -> Tuple[bytes | None, str | None]:
+    """
+    Конвертация изображения в JPEG. Выполняется в пуле CPU задач, поэтому принимает и возвращает байты
+    :param image_data: исходное изображение
+    :return: (jpeg, err)
+    """
     try:
-        image = Image.open(image_file.file)
+        image = Image.open(io.BytesIO(image_data))
 
         # Проверяем режим изображения и конвертируем в RGB при необходимости
         if image.mode in ("RGBA", "LA", "P", "L"):
@@ -301,14 +327,20 @@ async def compress_image(image_file: UploadFile, max_size_mb: float = 0.5) -> Tu
 
         output_io_stream = io.BytesIO()
         image.save(output_io_stream, format='JPEG', quality=85)
-        output_io_stream.seek(0)
         if output_io_stream.getbuffer().nbytes > 2 * 1024 * 1024:
-            return None, None, "Размер сжатого изображения превышает 2 MB"
-        unique_filename = f"{uuid.uuid4()}.jpg"
-
-        return output_io_stream, unique_filename, None
+            return None, "Размер сжатого изображения превышает 2 MB"
+        return output_io_stream.getvalue(), None
     except Exception as e:
-        return None, None, str(e)
+        return None, str(e)
+
+
+async def compress_image(image_file: UploadFile, max_size_mb: float = 0.5) -> Tuple[io.BytesIO, str | None, str]:
+    image_data = await image_file.read()
+    compressed, err = await cpu_executor.run(compress_image_bytes, image_data)
+    if err:
+        return None, None, err
+    unique_filename = f"{uuid.uuid4()}.jpg"
+    return io.BytesIO(compressed), unique_filename, None
 
 
 def validate_uuid(uuid_str: str | None) -> str | None:
@@ -0,0 +1,139 @@
+import hashlib
+from functools import wraps
+from typing import Any, Awaitable, Callable
+
+import orjson
+from aioredis.exceptions import RedisError
+from fastapi.requests import Request
+from pydantic import BaseModel
+
+from config.settings import settings
+from db.postgres import AsyncSession
+from redis_module.redis_client import redis
+
+# Пространства имён, которые нужно сбрасывать вместе с изменённой моделью:
+# список устройств содержит типы устройств, история исследований - данные пациентов
+DEPENDENT_NAMESPACES = {
+    "devicetype": ("device",),
+    "patient": ("desyncdatas",),
+}
+
+
+def namespace(model) -> str:
+    """
+    Пространство имён ключей кэша для модели
+    :param model: тип модели или строка
+    :return: str
+    """
+    return model if isinstance(model, str) else model.__name__.lower()
+
+
+def _cache_key(name: str, key: str) -> str:
+    return f"cache:{name}:{key}"
+
+
+def _tag_key(name: str) -> str:
+    return f"cache_tag:{name}"
+
+
+def _default(obj):
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+
+def dumps(value: Any) -> str:
+    return orjson.dumps(value, default=_default).decode()
+
+
+async def cache_get(name: str, key: str) -> Any | None:
+    """
+    Получить значение из кэша. Ошибки Redis считаются промахом
+    :param name: пространство имён
+    :param key: ключ внутри пространства имён
+    :return: значение или None
+    """
+    try:
+        cached = await redis.get(_cache_key(name, key))
+    except RedisError as e:
+        print(f"LOG: {e}")
+        return None
+    if cached is None:
+        return None
+    return orjson.loads(cached)
+
+
+async def cache_set(name: str, key: str, value: Any, expire: int = settings.redis_cache_expire):
+    """
+    Записать значение в кэш и привязать ключ к тегу пространства имён для сброса при изменениях
+    :param name: пространство имён
+    :param key: ключ внутри пространства имён
+    :param value: значение, сериализуемое orjson
+    :param expire: время жизни, сек
+    """
+    cache_key = _cache_key(name, key)
+    try:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.set(cache_key, dumps(value), ex=expire)
+            pipe.sadd(_tag_key(name), cache_key)
+            pipe.expire(_tag_key(name), expire)
+            await pipe.execute()
+    except RedisError as e:
+        print(f"LOG: {e}")
+
+
+async def invalidate(*models):
+    """
+    Сбросить все ключи кэша пространств имён моделей и зависящих от них пространств
+    :param models: типы моделей или имена пространств
+    """
+    names = set()
+    for model in models:
+        name = namespace(model)
+        names.add(name)
+        names.update(DEPENDENT_NAMESPACES.get(name, ()))
+    try:
+        for name in names:
+            keys = await redis.smembers(_tag_key(name))
+            await redis.delete(_tag_key(name), *keys)
+    except RedisError as e:
+        print(f"LOG: {e}")
+
+
+def build_key(kwargs: dict) -> str:
+    """
+    Ключ по аргументам обработчика. Сессия и запрос в ключ не входят
+    :param kwargs: аргументы обработчика
+    :return: str
+    """
+    parts = [f"{name}={value!r}" for name, value in sorted(kwargs.items())
+             if not isinstance(value, (AsyncSession, Request))]
+    return hashlib.sha1("&".join(parts).encode()).hexdigest()
+
+
+def cached(model, expire: int = settings.redis_cache_expire,
+           key_builder: Callable[[dict], str] = build_key,
+           refresh: Callable[[Any], Awaitable[Any]] | None = None):
+    """
+    Декоратор кэширования ответа обработчика списка или карточки модели.
+    Ответ хранится до истечения expire или до изменения модели через common
+    :param model: тип модели или имя пространства имён
+    :param expire: время жизни, сек
+    :param key_builder: построение ключа по аргументам обработчика
+    :param refresh: обновление полей ответа из кэша, которые меняются не через API (например статус устройства)
+    """
+    name = namespace(model)
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = key_builder(kwargs)
+            result = await cache_get(name, key)
+            if result is not None:
+                return await refresh(result) if refresh else result
+            result = await func(*args, **kwargs)
+            if result:
+                await cache_set(name, key, result, expire)
+            return result
+        return wrapper
+    return decorator
@@ -1,4 +1,3 @@
-import json
 import socket
 from typing import Iterator, List, Optional, AsyncGenerator
 import asyncio
@@ -14,15 +13,55 @@ from sqlalchemy.future import select
 
 from config.settings import settings
 from db.postgres import get_session, AsyncSession
-from models.desyncdata import DesyncDatas, DesyncDatasCreate
-from db.rethink import get_rethink_session
+from models.desyncdata import DesyncDatas, DesyncDatasCreate, DesyncDatasBaseWithoutData, DesyncSamples
+from db.rethink import get_rethink_connection
+from service.service_sse_hub import hub as sse_hub, publish_device_frame
+from service.service_cache import invalidate
+from service.service_pagination import keyset_page
+from models.cursor_page import CursorParams
 from models.patient import Patient
 from sqlalchemy.future import select
-from sqlalchemy import exc, or_, text
+from sqlalchemy import exc, cast, Text
 
 db = settings.rethinkdb_db
 table = settings.rethinkdb_table
 
+# Колонки истории исследований: data (JSON со всеми отсчётами исследования) в списки не выбирается
+HISTORY_COLUMNS = (DesyncDatas.uuid, DesyncDatas.date, DesyncDatas.device_uuid, DesyncDatas.patient_uuid,
+                   DesyncDatas.type_research_uuid, DesyncDatas.user_uuid)
+
+
+def history_row(row) -> DesyncDatasBaseWithoutData:
+    return DesyncDatasBaseWithoutData(**row._mapping)
+
+
+def history_query(uuid: str, device_uuid: str, type_research_uuid: str, date_from: str, date_to: str,
+                  patient_uuid: str, research_uuid_part: str):
+    """
+    Выборка истории исследований по фильтрам. В запрос попадают только переданные фильтры,
+    значения передаются параметрами, поэтому планировщик может использовать индексы
+    (user_uuid|patient_uuid|device_uuid, date) и триграммный индекс по uuid::text
+    :return: select колонок HISTORY_COLUMNS
+    """
+    conditions = []
+    if uuid is not None:
+        conditions.append(DesyncDatas.user_uuid == uuid)
+    if device_uuid is not None:
+        conditions.append(DesyncDatas.device_uuid == device_uuid)
+    if type_research_uuid is not None:
+        conditions.append(DesyncDatas.type_research_uuid == type_research_uuid)
+    if patient_uuid is not None:
+        conditions.append(DesyncDatas.patient_uuid == patient_uuid)
+    if date_from is not None:
+        conditions.append(DesyncDatas.date >= DT.datetime.strptime(f"{date_from} 00:00:00", '%Y%m%d %H:%M:%S'))
+    if date_to is not None:
+        conditions.append(DesyncDatas.date <= DT.datetime.strptime(f"{date_to} 23:59:59", '%Y%m%d %H:%M:%S'))
+    if research_uuid_part:
+        # Спецсимволы LIKE экранируются, uuid в тексте всегда в нижнем регистре
+        pattern = research_uuid_part.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append(cast(DesyncDatas.uuid, Text).like(f"%{pattern}%", escape="\\"))
+    return select(*HISTORY_COLUMNS).where(*conditions)
+
 
 async def view_history(uuid: str, session: AsyncSession, device_uuid: str,
                        type_research_uuid: str, date_from: str, date_to: str,
@@ -40,18 +79,70 @@ async def view_history(uuid: str, session: AsyncSession, device_uuid: str,
     :param research_uuid_part: str часть uuid исследования для поиска
     :return: model
     """
-    query_result = select(DesyncDatas).where(
-        or_(uuid is None, DesyncDatas.user_uuid == uuid),
-        or_(device_uuid is None, DesyncDatas.device_uuid == device_uuid),
-        or_(type_research_uuid is None, DesyncDatas.type_research_uuid == type_research_uuid),
-        or_(patient_uuid is None, DesyncDatas.patient_uuid == patient_uuid),
-        (date_from is None or DesyncDatas.date >= DT.datetime.strptime(f"{date_from} 00:00:00", '%Y%m%d %H:%M:%S')),
-        (date_to is None or DesyncDatas.date <= DT.datetime.strptime(f"{date_to} 23:59:59", '%Y%m%d %H:%M:%S')),
-        (research_uuid_part is None or text(f"DesyncDatas.uuid::text LIKE '%{research_uuid_part}%'"))
-    )
+    query_result = history_query(uuid, device_uuid, type_research_uuid, date_from, date_to,
+                                 patient_uuid, research_uuid_part)
     try:
         data = await session.execute(query_result)
-        result = data.scalars().all()
+        result = [history_row(row) for row in data.all()]
+        return result, None
+    except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
+        print(f"LOG: {e}")
+        return None, e
+    finally:
+        await session.close()
+
+
+async def view_history_page(uuid: str, session: AsyncSession, device_uuid: str,
+                            type_research_uuid: str, date_from: str, date_to: str,
+                            patient_uuid: str, research_uuid_part: str, params: CursorParams):
+    """
+    Страница истории исследований на стороне БД, новые исследования первыми, ключ (date, uuid)
+    :param params: CursorParams размер страницы, курсор и режим подсчёта
+    :return: (CursorPage, err)
+    """
+    query_result = history_query(uuid, device_uuid, type_research_uuid, date_from, date_to,
+                                 patient_uuid, research_uuid_part)
+    try:
+        page = await keyset_page(query_result, [DesyncDatas.date, DesyncDatas.uuid], params, session,
+                                 descending=True, row_factory=history_row)
+        return page, None
+    except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
+        print(f"LOG: {e}")
+        return None, e
+    finally:
+        await session.close()
+
+
+def sample_key(ts: DT.datetime) -> str:
+    """
+    Ключ отсчёта в data в прежнем формате ETL: время UTC без часового пояса
+    :param ts: время записи отсчёта
+    :return: str
+    """
+    return str(ts.astimezone(DT.timezone.utc).replace(tzinfo=None))
+
+
+async def get_research_details(desync_uuid: UUID, session: AsyncSession):
+    """
+    Карточка исследования. ETL пишет отсчёты в desync_samples, поле data собирается из них в прежнем виде
+    {время: {канал: значение}}. Отсчёты, записанные в JSON data до появления desync_samples, сохраняются
+    :param desync_uuid: uuid исследования
+    :param session: AsyncSession
+    :return: (DesyncDatas, err)
+    """
+    try:
+        result = await session.get(DesyncDatas, desync_uuid)
+        if result is None:
+            return None, None
+        samples = await session.execute(
+            select(DesyncSamples.ts, DesyncSamples.channels, DesyncSamples.values).where(
+                DesyncSamples.research_uuid == desync_uuid).order_by(DesyncSamples.ts))
+        data = dict(result.data or {})
+        for ts, channels, values in samples.all():
+            data[sample_key(ts)] = dict(zip(channels, values))
+        # Собранные данные только для ответа, в desyncdatas они не записываются
+        session.expunge(result)
+        result.data = data
         return result, None
     except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
         print(f"LOG: {e}")
@@ -72,14 +163,11 @@ async def create_research(data: DesyncDatasCreate, duration: int,
     result = DesyncDatas.from_orm(data)
 
     try:
-        with get_rethink_session() as conn:
-            active_research = r.db(db).table(table).filter(
-                (r.row["device_uuid"] == str(result.device_uuid)) &
-                ((r.row["research_status"] == "open") | (r.row["research_status"] == "in_process"))
-            ).run(conn)
-
-            active_research_list = list(active_research)
-            if active_research_list:
+        async with get_rethink_connection() as conn:
+            active_research = await r.db(db).table(table).get_all(str(result.device_uuid), index="device_uuid").filter(
+                (r.row["research_status"] == "open") | (r.row["research_status"] == "in_process")
+            ).is_empty().run(conn)
+            if not active_research:
                 return None, 1
 
         patient = await session.get(Patient, result.patient_uuid)
@@ -87,14 +175,16 @@ async def create_research(data: DesyncDatasCreate, duration: int,
             session.add(result)
             await session.commit()
             await session.refresh(result)
-        with get_rethink_session() as conn:
-            r.db(db).table(table).filter(r.row["device_uuid"] ==
-                                         str(result.device_uuid)).update({
+        await invalidate(DesyncDatas)
+        async with get_rethink_connection() as conn:
+            changes = await r.db(db).table(table).get_all(str(result.device_uuid), index="device_uuid").update({
                                              "patient_code": patient.code,
                                              "desync_data_uuid": str(result.uuid),
                                              "research_status": "open",
                                              "duration": duration
-                                         }).run(conn)
+                                         }, return_changes='always').run(conn)
+        for change in changes.get('changes', []):
+            await publish_device_frame(change['new_val'])
         return result, 0
     except (HTTPException, RequestException, socket.gaierror, exc.SQLAlchemyError) as e:
         print(f"LOG: {e}")
@@ -107,35 +197,18 @@ async def get_data_from_rethink(request: Request, filter_status: str = None) ->
     client_ip = request.client.host
     print(f"Client {client_ip} connected")
 
-    with get_rethink_session() as conn:
-        # Определяем условие фильтрации в зависимости от filter_status
-        if filter_status in ["open", "in_process"]:
-            filter_conditions = {"research_status": filter_status}
-        else:
-            filter_conditions = (r.row["research_status"] == "in_process") | (r.row["research_status"] == "open")
-
-        # Проверяем, есть ли данные по заданному фильтру
-        if r.db("RTDB_desync").table("dev_desync").filter(filter_conditions).is_empty().run(conn):
-            return
-
-        try:
-            while True:
-                device_status = r.db("RTDB_desync").table("dev_desync").filter(filter_conditions).pluck(
-                    'impedance', 'channel_desync', 'device', 'patient_code').run(conn)
-
-                for document in device_status:
-                    json_data = json.dumps({
-                        "impedance": document['impedance'],
-                        "channel_desync": document['channel_desync'],
-                        "device": document['device'],
-                        "patient_code": document['patient_code']
-                    })
-                    yield f"data:{json_data}\n\n"
-                    await asyncio.sleep(3)
-
-        except asyncio.CancelledError as e:
-            print(f"Disconnected from client (via refresh/close) {client_ip}")
-            raise e
+    # Определяем условие фильтрации в зависимости от filter_status
+    if filter_status in ["open", "in_process"]:
+        statuses = (filter_status,)
+    else:
+        statuses = ("in_process", "open")
+
+    try:
+        async for message in sse_hub.subscribe(lambda document: document.get("research_status") in statuses):
+            yield message
+    except asyncio.CancelledError as e:
+        print(f"Disconnected from client (via refresh/close) {client_ip}")
+        raise e
 
 
 async def get_data_from_rethink_by_type_research_uuid(request: Request, desync_data_uuid: UUID,
@@ -143,35 +216,20 @@ async def get_data_from_rethink_by_type_research_uuid(request: Request, desync_d
     client_ip = request.client.host
     print(f"Client {client_ip} connected")
 
-    with get_rethink_session() as conn:
-        if filter_status in ["open", "in_process"]:
-            filter_conditions = ((r.row["research_status"] == filter_status) & (
-                        r.row["desync_data_uuid"] == str(desync_data_uuid)))
-        else:
-            filter_conditions = ((r.row["research_status"] == "in_process") | (r.row["research_status"] == "open")) & (
-                    r.row["desync_data_uuid"] == str(desync_data_uuid))
-
-        if r.db("RTDB_desync").table("dev_desync").filter(filter_conditions).is_empty().run(conn):
-            return
-
-        try:
-            while True:
-                device_status = r.db("RTDB_desync").table("dev_desync").filter(filter_conditions).pluck(
-                    'impedance', 'channel_desync', 'device', 'patient_code').run(conn)
-
-                for document in device_status:
-                    json_data = json.dumps({
-                        "impedance": document['impedance'],
-                        "channel_desync": document['channel_desync'],
-                        "device": document['device'],
-                        "patient_code": document['patient_code']
-                    })
-                    yield f"data:{json_data}\n\n"
-                    await asyncio.sleep(3)
-
-        except asyncio.CancelledError as e:
-            print(f"Disconnected from client (via refresh/close) {client_ip}")
-            raise e
+    if filter_status in ["open", "in_process"]:
+        statuses = (filter_status,)
+    else:
+        statuses = ("in_process", "open")
+
+    def predicate(document: dict) -> bool:
+        return document.get("research_status") in statuses and document.get("desync_data_uuid") == str(desync_data_uuid)
+
+    try:
+        async for message in sse_hub.subscribe(predicate):
+            yield message
+    except asyncio.CancelledError as e:
+        print(f"Disconnected from client (via refresh/close) {client_ip}")
+        raise e
 
 # async def get_research_with_status( session: AsyncSession):
 #     """
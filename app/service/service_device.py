@@ -13,11 +13,14 @@ from sqlalchemy.future import select
 from rethinkdb import r, errors as re
 
 from config.settings import settings
-from db.rethink import get_rethink_session
+from db.rethink import get_rethink_session, get_rethink_connection
 from db.postgres import AsyncSession
 from models.device import Device, DeviceCreate, DeviceUpdate, DeviceFilter
 from models.device_type import DeviceType, DeviceDeviceTypeLink
 from service.common import get_model_details
+from service.service_cache import invalidate
+from service.service_pagination import keyset_page
+from models.cursor_page import CursorParams, CursorPage
 
 db = settings.rethinkdb_db
 table = settings.rethinkdb_table
@@ -44,11 +47,12 @@ async def create_device(clinic_uuid: UUID, data: DeviceCreate, session: AsyncSes
         session.add(result)
         await session.commit()
         await session.refresh(result)
-        with get_rethink_session() as conn:
-            r.db(db).table(table).insert({"device": result.name, "device_uuid": str(result.uuid), "status": False,
-                                          "calibration": False, "time_calibration": 10.0, "baseline": {},
-                                          "channel_desync": {}, "impedance": {}, "desync_data_uuid": {}, "research_status": {},
-                                          "patient_code": {}, "date_start": {}, "duration": {}}).run(conn)
+        await invalidate(Device)
+        async with get_rethink_connection() as conn:
+            await r.db(db).table(table).insert({"device": result.name, "device_uuid": str(result.uuid), "status": False,
+                                                "calibration": False, "time_calibration": 10.0, "baseline": {},
+                                                "channel_desync": {}, "impedance": {}, "desync_data_uuid": {}, "research_status": {},
+                                                "patient_code": {}, "date_start": {}, "duration": {}}).run(conn)
         return result, None
     except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
         print(f"LOG: {e}")
@@ -117,6 +121,7 @@ async def update_device(uuid, session: AsyncSession, data: DeviceUpdate | list[t
             session.add(device)
             await session.commit()
             await session.refresh(device)
+            await invalidate(Device)
         except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
             print(f"LOG: {e}")
             return None, e
@@ -135,8 +140,9 @@ async def delete_device(uuid, session: AsyncSession):
         try:
             await session.delete(device)
             await session.commit()
-            with get_rethink_session() as conn:
-                r.db(db).table(table).filter({"device_uuid": str(uuid)}).delete().run(conn)
+            await invalidate(Device)
+            async with get_rethink_connection() as conn:
+                await r.db(db).table(table).get_all(str(uuid), index="device_uuid").delete().run(conn)
         except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
             print(f"LOG: {e}")
             return None, e
@@ -145,7 +151,6 @@ async def delete_device(uuid, session: AsyncSession):
     return device, None
 
 
-# сделать синхронную функцию
 async def start_stop_process(uuid: UUID, status: bool, session: AsyncSession):
     """
     Запуск и остановка устройства. Передача данных в RethinkDB
@@ -162,10 +167,11 @@ async def start_stop_process(uuid: UUID, status: bool, session: AsyncSession):
             await session.commit()
             await session.refresh(device)
 
-            with get_rethink_session() as conn:
-                r.db(settings.rethinkdb_db).table(settings.rethinkdb_table).filter(
-                    {"device_uuid": str(uuid)}
+            async with get_rethink_connection() as conn:
+                await r.db(settings.rethinkdb_db).table(settings.rethinkdb_table).get_all(
+                    str(uuid), index="device_uuid"
                 ).update({"status": status}).run(conn)
+            await invalidate(Device)
 
             return device, None
         except (re.ReqlError, RequestException, socket.gaierror) as e:
@@ -187,8 +193,8 @@ async def calibration_device(uuid: UUID, calibration: bool, calibration_time: fl
     device = await read_device(uuid=uuid, session=session)
     if device:
         try:
-            with get_rethink_session() as conn:
-                r.db(db).table(table).filter({"device_uuid": str(device.uuid)}).update(
+            async with get_rethink_connection() as conn:
+                await r.db(db).table(table).get_all(str(device.uuid), index="device_uuid").update(
                     {"calibration": calibration, "time_calibration": calibration_time,
                      "date_start": datetime.now(r.make_timezone('04:00'))}).run(conn)
             return device
@@ -211,8 +217,9 @@ async def devices_status():
     Возвращает имя устройства и его состояние. Передача данных из RethinkDB
     """
     try:
-        with get_rethink_session() as conn:
-            device_status = r.db(db).table(table).pluck('device', 'status').run(conn)
+        async with get_rethink_connection() as conn:
+            cursor = await r.db(db).table(table).pluck('device', 'status').run(conn)
+            device_status = [document async for document in cursor]
         return device_status, None
     except (re.ReqlError, RequestException, socket.gaierror) as e:
         print(f"LOG: {e}")
@@ -232,9 +239,9 @@ async def get_device(uuid, session: AsyncSession) -> Device | None:
         )
         device = result.scalar_one_or_none()
         if device:
-            with get_rethink_session() as conn:
-                status = r.db(db).table(table).filter(r.row['device_uuid'] == str(uuid)).get_field('status').run(conn)
-                for s in status:
+            async with get_rethink_connection() as conn:
+                status = await r.db(db).table(table).get_all(str(uuid), index="device_uuid").get_field('status').run(conn)
+                async for s in status:
                     device.status = s
         return device, None
     except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
@@ -247,8 +254,9 @@ async def get_device(uuid, session: AsyncSession) -> Device | None:
 async def filter_status(status):
     if status:
         try:
-            with get_rethink_session() as conn:
-                device = r.db(db).table(table).filter(r.row["status"] == status).pluck('device', 'status').run(conn)
+            async with get_rethink_connection() as conn:
+                cursor = await r.db(db).table(table).filter(r.row["status"] == status).pluck('device', 'status').run(conn)
+                device = [document async for document in cursor]
             return device
         except (re.ReqlError, RequestException, socket.gaierror) as e:
             print(f"LOG: {e}")
@@ -257,6 +265,62 @@ async def filter_status(status):
         return None
 
 
+async def get_rethink_statuses(devices: list) -> dict:
+    """
+    Статусы устройств одним запросом к RethinkDB
+    :param devices: list[Device]
+    :return: dict {device_uuid: status}
+    """
+    return await get_rethink_statuses_by_uuid([str(device.uuid) for device in devices])
+
+
+async def get_rethink_statuses_by_uuid(device_uuids: list[str]) -> dict:
+    """
+    Статусы устройств одним запросом к RethinkDB
+    :param device_uuids: list uuid устройств
+    :return: dict {device_uuid: status}
+    """
+    statuses = {}
+    if device_uuids:
+        async with get_rethink_connection() as conn:
+            cursor = await r.db(db).table(table).get_all(
+                *device_uuids, index="device_uuid").pluck('device_uuid', 'status').run(conn)
+            async for document in cursor:
+                statuses[document['device_uuid']] = document.get('status')
+    return statuses
+
+
+async def refresh_statuses(response: list | dict) -> list | dict:
+    """
+    Актуальные статусы RethinkDB в списке устройств из кэша. Статус меняет и ETL (например, если поток
+    устройства не найден), кэш при этом не сбрасывается, поэтому статусы из кэша заменяются актуальными
+    :param response: список устройств или страница с items
+    :return: response с обновлёнными статусами
+    """
+    items = response.get("items", []) if isinstance(response, dict) else response
+    statuses = await get_rethink_statuses_by_uuid([str(item["uuid"]) for item in items])
+    for item in items:
+        if str(item["uuid"]) in statuses:
+            item["status"] = statuses[str(item["uuid"])]
+    return response
+
+
+def device_with_types(device: Device, statuses: dict) -> dict:
+    device_dict = device.dict()
+    if str(device.uuid) in statuses:
+        device_dict["status"] = statuses[str(device.uuid)]
+
+    device_dict["device_types"] = [
+        {
+            "name": dt.name,
+            "description": dt.description,
+            "uuid": dt.uuid
+        }
+        for dt in device.device_types
+    ]
+    return device_dict
+
+
 async def get_devices_filter(device_filter: DeviceFilter, session: AsyncSession) -> Tuple[List[Any], None] | Tuple[None, Any]:
     try:
         query = select(Device).options(joinedload(Device.device_types))
@@ -273,25 +337,8 @@ async def get_devices_filter(device_filter: DeviceFilter, session: AsyncSession)
                 devices = [device for device in devices if
                            any(device_filter.device_type.name__like in dt.name for dt in device.device_types)]
 
-        devices_with_types = []
-        for device in devices:
-            device_dict = device.dict()
-
-            with get_rethink_session() as conn:
-                status = r.db(db).table(table).filter(r.row['device_uuid'] == str(device.uuid)).get_field('status').run(
-                    conn)
-                for s in status:
-                    device_dict["status"] = s
-
-            device_dict["device_types"] = [
-                {
-                    "name": dt.name,
-                    "description": dt.description,
-                    "uuid": dt.uuid
-                }
-                for dt in device.device_types
-            ]
-            devices_with_types.append(device_dict)
+        statuses = await get_rethink_statuses(devices)
+        devices_with_types = [device_with_types(device, statuses) for device in devices]
 
         return devices_with_types, None
     except (AssertionError, RequestException, socket.gaierror) as e:
@@ -301,12 +348,44 @@ async def get_devices_filter(device_filter: DeviceFilter, session: AsyncSession)
         await session.close()
 
 
+async def get_devices_page(device_filter: DeviceFilter, params: CursorParams,
+                           session: AsyncSession) -> Tuple[CursorPage, None] | Tuple[None, Any]:
+    """
+    Страница устройств на стороне БД, ключ (name, uuid). Фильтр по типу устройства выполняется в SQL,
+    статусы из RethinkDB запрашиваются только для устройств страницы
+    :param device_filter: DeviceFilter | DeviceFilterNoType
+    :param params: CursorParams
+    :param session: AsyncSession
+    :return: (CursorPage, err)
+    """
+    try:
+        query = select(Device).options(selectinload(Device.device_types)).where(
+            Device.uuid.in_(device_filter.filter(select(Device.uuid))))
+
+        if hasattr(device_filter, 'device_type') and device_filter.device_type:
+            if device_filter.device_type.name:
+                query = query.where(Device.device_types.any(DeviceType.name == device_filter.device_type.name))
+            if device_filter.device_type.name__like:
+                query = query.where(Device.device_types.any(
+                    DeviceType.name.contains(device_filter.device_type.name__like)))
+
+        page = await keyset_page(query, [Device.name, Device.uuid], params, session)
+        statuses = await get_rethink_statuses(page.items)
+        page.items = [device_with_types(device, statuses) for device in page.items]
+        return page, None
+    except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
+        print(f"LOG: {e}")
+        return None, e
+    finally:
+        await session.close()
+
+
 def check_status_device(device_uuid: UUID) -> bool | Exception:
     time.sleep(1)
     try:
         with get_rethink_session() as conn:
-            status_rethink = r.db(settings.rethinkdb_db).table(settings.rethinkdb_table).filter(
-                {"device_uuid": str(device_uuid)}).pluck("status").run(conn)
+            status_rethink = r.db(settings.rethinkdb_db).table(settings.rethinkdb_table).get_all(
+                str(device_uuid), index="device_uuid").pluck("status").run(conn)
             for _ in status_rethink:
                 status_rethink = _["status"]
                 return status_rethink
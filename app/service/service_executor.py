@@ -0,0 +1,91 @@
+import time
+import asyncio
+from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable
+
+from config.settings import settings
+
+
+class CPUExecutor:
+    """
+    Пул для CPU-нагруженных операций (хэширование паролей, обработка изображений), чтобы они не блокировали
+    цикл событий. Число одновременно выполняемых и ожидающих задач ограничено, по каждому типу задач
+    собираются метрики: количество, ошибки, суммарное и максимальное время выполнения
+    """
+
+    def __init__(self, kind: str = settings.cpu_executor_kind, max_workers: int = settings.cpu_executor_workers,
+                 max_pending: int = settings.cpu_executor_max_pending):
+        """
+        :param kind: 'thread' или 'process'. pbkdf2 и PIL отпускают GIL, поэтому по умолчанию хватает потоков
+        :param max_workers: количество потоков/процессов пула
+        :param max_pending: сколько задач может одновременно находиться в пуле, остальные ждут в цикле событий
+        """
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: Executor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._waiting = 0
+        self._in_flight = 0
+        self._stats: dict[str, dict] = defaultdict(lambda: {"count": 0, "errors": 0,
+                                                            "total_seconds": 0.0, "max_seconds": 0.0})
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='cpu')
+        return self._executor
+
+    async def run(self, func: Callable, *args, name: str | None = None) -> Any:
+        """
+        Выполнить функцию в пуле
+        :param func: функция, для пула процессов - объявленная на уровне модуля
+        :param args: аргументы функции
+        :param name: имя задачи в метриках, по умолчанию имя функции
+        :return: результат функции
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        name = name or func.__name__
+        stats = self._stats[name]
+
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stats["count"] += 1
+            stats["total_seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    def metrics(self) -> dict:
+        """
+        Текущее состояние пула и метрики по типам задач
+        :return: dict
+        """
+        return {"kind": self.kind, "max_workers": self.max_workers, "max_pending": self.max_pending,
+                "in_flight": self._in_flight, "waiting": self._waiting,
+                "tasks": {name: dict(stats) for name, stats in self._stats.items()}}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+cpu_executor = CPUExecutor()
@@ -0,0 +1,138 @@
+import base64
+from datetime import datetime
+from uuid import UUID
+from typing import Callable
+
+import orjson
+from fastapi import HTTPException
+from http import HTTPStatus
+from sqlalchemy import tuple_, func, select, and_, or_
+
+from config.settings import settings
+from db.postgres import AsyncSession
+from models.cursor_page import CursorParams, CursorPage
+
+def encode_cursor(values: tuple) -> str:
+    """
+    Курсор - значения ключа сортировки последней записи страницы
+    :param values: значения колонок сортировки
+    :return: str
+    """
+    encoded = []
+    for value in values:
+        if isinstance(value, datetime):
+            encoded.append(["dt", value.isoformat()])
+        elif isinstance(value, UUID):
+            encoded.append(["uuid", str(value)])
+        else:
+            encoded.append(["v", value])
+    return base64.urlsafe_b64encode(orjson.dumps(encoded)).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Разбор курсора, неверный курсор - ошибка запроса
+    :param cursor: str
+    :return: tuple значений колонок сортировки
+    """
+    try:
+        values = []
+        for kind, value in orjson.loads(base64.urlsafe_b64decode(cursor.encode())):
+            if kind == "dt":
+                values.append(datetime.fromisoformat(value))
+            elif kind == "uuid":
+                values.append(UUID(value))
+            else:
+                values.append(value)
+        return tuple(values)
+    except (ValueError, TypeError, orjson.JSONDecodeError):
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Некорректный курсор")
+
+
+def is_nullable(column) -> bool:
+    """
+    Может ли колонка ключа сортировки содержать NULL
+    :param column: колонка модели
+    :return: bool
+    """
+    return bool(column.expression.nullable)
+
+
+def after_cursor(order_columns: list, values: tuple, descending: bool):
+    """
+    Условие "после курсора" для ключа сортировки. Колонки сравниваются как есть, без обёрток, чтобы запрос
+    использовал индекс. NULL в первой колонке идут в конце (NULLS LAST) и выбираются отдельным условием
+    :param order_columns: колонки ключа сортировки, NULL допускается только в первой
+    :param values: значения колонок из курсора
+    :param descending: сортировка по убыванию
+    :return: условие для where
+    """
+    def compare(columns, after):
+        key, cursor = tuple_(*columns), tuple_(*after)
+        return key < cursor if descending else key > cursor
+
+    first = order_columns[0]
+    if not is_nullable(first):
+        return compare(order_columns, values)
+    if values[0] is None:
+        return and_(first.is_(None), compare(order_columns[1:], values[1:]))
+    return or_(compare(order_columns, values), first.is_(None))
+
+
+async def count_rows(query, session: AsyncSession, total: str) -> tuple[int | None, bool]:
+    """
+    Количество строк выборки
+    :param query: выборка без сортировки и ограничения
+    :param session: AsyncSession
+    :param total: 'exact' - точный подсчёт, 'estimate' - подсчёт не дальше pagination_estimate_cap строк
+    :return: (total, total_is_estimate)
+    """
+    if total == "exact":
+        result = await session.execute(select(func.count()).select_from(query.order_by(None).subquery()))
+        return result.scalar_one(), False
+    if total == "estimate":
+        cap = settings.pagination_estimate_cap
+        result = await session.execute(
+            select(func.count()).select_from(query.order_by(None).limit(cap + 1).subquery()))
+        count = result.scalar_one()
+        return min(count, cap), count > cap
+    return None, False
+
+
+async def keyset_page(query, order_columns: list, params: CursorParams, session: AsyncSession,
+                      descending: bool = False, row_factory: Callable | None = None) -> CursorPage:
+    """
+    Страница выборки по ключу сортировки (keyset): WHERE (ключ) > (курсор) ORDER BY ключ NULLS LAST LIMIT n.
+    Стоимость запроса не зависит от номера страницы, в отличие от OFFSET
+    :param query: select модели или её колонок с применёнными фильтрами
+    :param order_columns: колонки ключа сортировки, последняя должна быть уникальной (uuid), NULL - только в первой
+    :param params: CursorParams
+    :param session: AsyncSession
+    :param descending: сортировка по убыванию (новые записи первыми)
+    :param row_factory: преобразование строки для выборки отдельных колонок, без него выбирается модель целиком
+    :return: CursorPage
+    """
+    total, total_is_estimate = await count_rows(query, session, params.total)
+
+    if params.cursor:
+        values = decode_cursor(params.cursor)
+        if len(values) != len(order_columns):
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Некорректный курсор")
+        query = query.where(after_cursor(order_columns, values, descending))
+    ordering = []
+    for column in order_columns:
+        expression = column.desc() if descending else column.asc()
+        ordering.append(expression.nulls_last() if is_nullable(column) else expression)
+    query = query.order_by(*ordering)
+    result = await session.execute(query.limit(params.limit + 1))
+    if row_factory is None:
+        items = result.scalars().unique().all()
+    else:
+        items = [row_factory(row) for row in result.all()]
+
+    next_cursor = None
+    if len(items) > params.limit:
+        items = items[:params.limit]
+        last = items[-1]
+        next_cursor = encode_cursor(tuple(getattr(last, column.key) for column in order_columns))
+    return CursorPage(items=items, next_cursor=next_cursor, total=total, total_is_estimate=total_is_estimate)
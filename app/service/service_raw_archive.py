@@ -0,0 +1,102 @@
+import os
+import json
+import zlib
+import struct
+import datetime as DT
+from uuid import UUID
+from typing import Iterator
+
+import numpy as np
+
+from config.settings import settings
+
+# Формат архива сырого сигнала, который пишет ETL (etl/load_data/raw_archive.py):
+# FILE_MAGIC, длина заголовка (uint32), заголовок JSON; далее блоки: CHUNK_MAGIC, CHUNK_HEADER,
+# минимумы и максимумы каналов float32[c], данные - метки времени float64[n] и отсчёты float32[n, c];
+# или метки пропуска: GAP_MAGIC, GAP_HEADER - количество отсчётов, которые ETL не успел записать
+FILE_MAGIC = b"DSRAW001"
+CHUNK_MAGIC = b"CHNK"
+CHUNK_HEADER = struct.Struct("<IIIdd")
+GAP_MAGIC = b"GAP0"
+GAP_HEADER = struct.Struct("<Idd")
+
+
+class RawRecording:
+    """
+    Запись сырого сигнала ЭЭГ исследования из архива ETL. Индекс блоков строится по их заголовкам,
+    данные читаются по блоку при выгрузке. Пропуски заполняются нулями, чтобы время отсчётов после них
+    не сдвигалось
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise ValueError(f"{path} is not a raw archive file")
+            header_size, = struct.unpack("<I", file.read(4))
+            header = json.loads(file.read(header_size))
+            self.channels: list[str] = header["channels"]
+            self.sfreq: int = int(round(header["sfreq"]))
+            self.codec: str = header["codec"]
+            self.start = DT.datetime.fromtimestamp(header["start"], DT.timezone.utc)
+            # Блок: (смещение данных, отсчётов, размер данных), у пропуска смещение None
+            self._chunks: list[tuple[int | None, int, int]] = []
+            self.physical_min = np.full(len(self.channels), np.inf)
+            self.physical_max = np.full(len(self.channels), -np.inf)
+
+            file_size = os.fstat(file.fileno()).st_size
+            bounds_size = 8 * len(self.channels)
+            while file.tell() + len(CHUNK_MAGIC) + GAP_HEADER.size <= file_size:
+                magic = file.read(len(CHUNK_MAGIC))
+                if magic == GAP_MAGIC:
+                    n_samples, _, _ = GAP_HEADER.unpack(file.read(GAP_HEADER.size))
+                    self._chunks.append((None, n_samples, 0))
+                    continue
+                if magic != CHUNK_MAGIC or file.tell() + CHUNK_HEADER.size + bounds_size > file_size:
+                    break
+                n_samples, data_size, _, _, _ = CHUNK_HEADER.unpack(file.read(CHUNK_HEADER.size))
+                bounds = np.frombuffer(file.read(bounds_size), dtype="<f4")
+                if file.tell() + data_size > file_size:
+                    break
+                self._chunks.append((file.tell(), n_samples, data_size))
+                self.physical_min = np.minimum(self.physical_min, bounds[:len(self.channels)])
+                self.physical_max = np.maximum(self.physical_max, bounds[len(self.channels):])
+                file.seek(data_size, os.SEEK_CUR)
+
+    @property
+    def n_samples(self) -> int:
+        return sum(n_samples for _, n_samples, _ in self._chunks)
+
+    @property
+    def dropped_samples(self) -> int:
+        """Количество отсчётов в пропусках"""
+        return sum(n_samples for offset, n_samples, _ in self._chunks if offset is None)
+
+    def chunks(self) -> Iterator[np.ndarray]:
+        """
+        Отсчёты по блокам архива
+        :return: отсчёты float32, отсчёты - строки, каналы - столбцы
+        """
+        with open(self.path, "rb") as file:
+            for offset, n_samples, data_size in self._chunks:
+                if offset is None:
+                    yield np.zeros((n_samples, len(self.channels)), dtype=np.float32)
+                    continue
+                file.seek(offset)
+                data = file.read(data_size)
+                if self.codec == "zlib":
+                    data = zlib.decompress(data)
+                yield np.frombuffer(data, dtype="<f4", offset=8 * n_samples).reshape(n_samples, len(self.channels))
+
+
+def open_raw_recording(desync_uuid: UUID) -> RawRecording | None:
+    """
+    Запись сырого сигнала исследования, если ETL сохранял его в архив
+    :param desync_uuid: uuid исследования
+    :return: RawRecording или None
+    """
+    path = os.path.join(settings.raw_archive_dir, f"{desync_uuid}.draw")
+    if not os.path.exists(path):
+        return None
+    recording = RawRecording(path)
+    return recording if recording.n_samples else None
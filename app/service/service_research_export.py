@@ -0,0 +1,330 @@
+import io
+import csv
+import socket
+import asyncio
+import math
+import json
+import struct
+import datetime as DT
+from uuid import UUID
+from typing import AsyncIterator, Iterable
+
+import numpy as np
+from fastapi.responses import StreamingResponse
+from requests import RequestException
+from sqlalchemy import exc
+from sqlalchemy.future import select
+
+from config.settings import settings
+from db.postgres import AsyncSession
+from models.desyncdata import DesyncDatas, DesyncSamples
+from service.service_research_series import samples_matrix, merge_rows, research_legacy_rows, to_floats
+from service.service_raw_archive import open_raw_recording
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "columnar": ("application/octet-stream", "dcol"),
+    "edf": ("application/octet-stream", "edf"),
+}
+
+# Колоночный формат: COLUMNAR_MAGIC, длина заголовка (uint32) и заголовок JSON, затем группы строк:
+# количество строк n (uint32), время float64[n] (секунды unix time), значения каналов float32[n] по очереди.
+# Группа с n = 0 - конец файла. Все числа little-endian, группа читается numpy.frombuffer без копирования
+COLUMNAR_MAGIC = b"DSYNCOL1"
+# Числа в 8 символах поля заголовка EDF без экспоненциальной записи
+EDF_NUMBER_MIN, EDF_NUMBER_MAX = -9999999.0, 99999999.0
+
+
+async def research_exists(desync_uuid: UUID, session: AsyncSession) -> bool:
+    result = await session.execute(select(DesyncDatas.uuid).where(DesyncDatas.uuid == desync_uuid))
+    return result.first() is not None
+
+
+async def research_channels(desync_uuid: UUID, session: AsyncSession, legacy: list) -> list[str]:
+    """
+    Каналы исследования по всем отсчётам, в порядке первого появления
+    :param desync_uuid: uuid исследования
+    :param session: AsyncSession
+    :param legacy: отсчёты из JSON data, они записаны раньше desync_samples
+    :return: list имён каналов
+    """
+    result = await session.execute(select(DesyncSamples.channels).where(
+        DesyncSamples.research_uuid == desync_uuid).distinct())
+    return list(dict.fromkeys([name for _, channels, _ in legacy for name in channels] +
+                              [name for channels, in result.all() for name in channels]))
+
+
+async def sample_chunks(desync_uuid: UUID, session: AsyncSession, legacy: list,
+                        chunk_rows: int = settings.export_chunk_rows) -> AsyncIterator[list]:
+    """
+    Отсчёты исследования частями через курсор на стороне сервера, всё исследование в памяти не держится.
+    Отсчёты из JSON data, записанные до появления desync_samples, вставляются по времени, как в карточке
+    исследования
+    :param desync_uuid: uuid исследования
+    :param session: AsyncSession
+    :param legacy: отсчёты из JSON data, упорядоченные по времени
+    :param chunk_rows: количество строк в части
+    :return: части - list строк (ts, channels, values)
+    """
+    result = await session.stream(select(DesyncSamples.ts, DesyncSamples.channels, DesyncSamples.values).where(
+        DesyncSamples.research_uuid == desync_uuid).order_by(DesyncSamples.ts))
+    position = 0
+    async for rows in result.partitions(chunk_rows):
+        # Отсчёты из JSON data до конца части идут вместе с ней
+        end = position
+        while end < len(legacy) and legacy[end][0] <= rows[-1][0]:
+            end += 1
+        yield merge_rows(legacy[position:end], rows)
+        position = end
+    for start in range(position, len(legacy), chunk_rows):
+        yield legacy[start:start + chunk_rows]
+
+
+async def export_csv(desync_uuid: UUID, session: AsyncSession) -> AsyncIterator[str]:
+    """
+    Исследование в CSV: ts (ISO 8601, UTC) и столбец на канал, пропуски - пустые ячейки
+    :param desync_uuid: uuid исследования
+    :param session: AsyncSession
+    """
+    try:
+        legacy = await research_legacy_rows(desync_uuid, session) or []
+        channels = await research_channels(desync_uuid, session, legacy)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        header_written = False
+        async for rows in sample_chunks(desync_uuid, session, legacy):
+            if not header_written:
+                channels = channels or list(dict.fromkeys(name for _, row_channels, _ in rows
+                                                          for name in row_channels))
+                writer.writerow(["ts", *channels])
+                header_written = True
+            _, _, values = samples_matrix(rows, channels)
+            for (row_ts, _, _), row_values in zip(rows, values):
+                writer.writerow([row_ts.astimezone(DT.timezone.utc).isoformat(),
+                                 *("" if value is None else value for value in to_floats(row_values))])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if not header_written:
+            yield "ts\n"
+    finally:
+        await session.close()
+
+
+async def export_columnar(desync_uuid: UUID, session: AsyncSession) -> AsyncIterator[bytes]:
+    """
+    Исследование в колоночном двоичном формате, см. COLUMNAR_MAGIC
+    :param desync_uuid: uuid исследования
+    :param session: AsyncSession
+    """
+    try:
+        legacy = await research_legacy_rows(desync_uuid, session) or []
+        channels = await research_channels(desync_uuid, session, legacy)
+        header_written = False
+        async for rows in sample_chunks(desync_uuid, session, legacy):
+            if not header_written:
+                channels = channels or list(dict.fromkeys(name for _, row_channels, _ in rows
+                                                          for name in row_channels))
+                yield columnar_header(desync_uuid, channels)
+                header_written = True
+            ts, _, values = samples_matrix(rows, channels)
+            yield columnar_group(ts, values)
+        if not header_written:
+            yield columnar_header(desync_uuid, channels)
+        yield struct.pack("<I", 0)
+    finally:
+        await session.close()
+
+
+def columnar_header(desync_uuid: UUID, channels: list[str]) -> bytes:
+    header = json.dumps({"version": 1, "research_uuid": str(desync_uuid), "channels": channels,
+                         "ts": "float64 unix seconds", "values": "float32"}).encode()
+    return COLUMNAR_MAGIC + struct.pack("<I", len(header)) + header
+
+
+def columnar_group(ts: np.ndarray, values: np.ndarray) -> bytes:
+    """
+    Группа строк колоночного формата
+    :param ts: время отсчётов, секунды unix time
+    :param values: значения: отсчёты - строки, каналы - столбцы
+    :return: bytes
+    """
+    return (struct.pack("<I", len(ts)) + ts.astype("<f8").tobytes()
+            + np.ascontiguousarray(values.T, dtype="<f4").tobytes())
+
+
+def read_columnar(content: bytes) -> tuple[dict, np.ndarray, np.ndarray]:
+    """
+    Чтение файла колоночного формата
+    :param content: содержимое файла
+    :return: (заголовок, время отсчётов, значения: отсчёты - строки, каналы - столбцы)
+    """
+    if content[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar export file")
+    offset = len(COLUMNAR_MAGIC)
+    header_size, = struct.unpack_from("<I", content, offset)
+    offset += 4
+    header = json.loads(content[offset:offset + header_size])
+    offset += header_size
+    n_channels = len(header["channels"])
+    ts_parts, value_parts = [], []
+    while True:
+        n_rows, = struct.unpack_from("<I", content, offset)
+        offset += 4
+        if not n_rows:
+            break
+        ts_parts.append(np.frombuffer(content, dtype="<f8", count=n_rows, offset=offset))
+        offset += 8 * n_rows
+        value_parts.append(np.frombuffer(content, dtype="<f4", count=n_rows * n_channels,
+                                         offset=offset).reshape(n_channels, n_rows).T)
+        offset += 4 * n_rows * n_channels
+    if not ts_parts:
+        return header, np.empty(0), np.empty((0, n_channels), dtype=np.float32)
+    return header, np.concatenate(ts_parts), np.concatenate(value_parts)
+
+
+def _edf_field(value, width: int) -> bytes:
+    """Поле заголовка EDF: ASCII, дополняется пробелами до ширины"""
+    if isinstance(value, float):
+        # Значения, для которых не хватает цифр поля, ограничиваются; точность понижается, пока число
+        # не поместится. Обрезка строки справа испортила бы число в экспоненциальной записи
+        value = min(max(value, -(10.0 ** (width - 1) - 1)), 10.0 ** width - 1)
+        precision = width
+        text = f"{value:.{precision}g}"
+        while len(text) > width and precision > 1:
+            precision -= 1
+            text = f"{value:.{precision}g}"
+    else:
+        text = str(value)
+    return text.encode("ascii", "replace")[:width].ljust(width)
+
+
+def edf_physical_range(physical_min: Iterable[float], physical_max: Iterable[float]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Физический диапазон каналов для EDF. Минимум и максимум обязаны различаться, читатели делят на разницу,
+    поэтому диапазон постоянного канала расширяется на 1 в обе стороны. Значения ограничены тем, что
+    помещается в 8 символов поля заголовка, чтобы масштаб данных совпадал с заголовком
+    :return: (минимальные значения, максимальные значения)
+    """
+    physical_min = np.clip(np.asarray(physical_min, dtype=np.float64), EDF_NUMBER_MIN, EDF_NUMBER_MAX - 1.0)
+    physical_max = np.clip(np.asarray(physical_max, dtype=np.float64), EDF_NUMBER_MIN + 1.0, EDF_NUMBER_MAX)
+    flat = ~(physical_max > physical_min)
+    return np.where(flat, physical_min - 1.0, physical_min), np.where(flat, physical_min + 1.0, physical_max)
+
+
+def edf_header(channels: list[str], sfreq: int, n_records: int, start: DT.datetime,
+               physical_min: Iterable[float], physical_max: Iterable[float],
+               recording: str = "", dimension: str = "uV") -> bytes:
+    """
+    Заголовок EDF: запись делится на блоки по секунде, в каждом sfreq отсчётов на канал
+    :param channels: имена каналов
+    :param sfreq: частота дискретизации, Гц
+    :param n_records: количество блоков
+    :param start: время начала записи
+    :param physical_min: минимальные значения каналов
+    :param physical_max: максимальные значения каналов
+    :param recording: описание записи
+    :param dimension: единицы измерения
+    :return: bytes
+    """
+    n_signals = len(channels)
+    physical_min, physical_max = edf_physical_range(physical_min, physical_max)
+    header = b"".join([
+        _edf_field("0", 8), _edf_field("X X X X", 80), _edf_field(f"Startdate X X X {recording}", 80),
+        _edf_field(start.strftime("%d.%m.%y"), 8), _edf_field(start.strftime("%H.%M.%S"), 8),
+        _edf_field(256 * (n_signals + 1), 8), _edf_field("", 44),
+        _edf_field(n_records, 8), _edf_field(1, 8), _edf_field(n_signals, 4),
+    ])
+    signal_fields = [
+        [_edf_field(name, 16) for name in channels],
+        [_edf_field("", 80)] * n_signals,
+        [_edf_field(dimension, 8)] * n_signals,
+        [_edf_field(float(value), 8) for value in physical_min],
+        [_edf_field(float(value), 8) for value in physical_max],
+        [_edf_field(-32768, 8)] * n_signals,
+        [_edf_field(32767, 8)] * n_signals,
+        [_edf_field("", 80)] * n_signals,
+        [_edf_field(sfreq, 8)] * n_signals,
+        [_edf_field("", 32)] * n_signals,
+    ]
+    return header + b"".join(field for fields in signal_fields for field in fields)
+
+
+def edf_records(chunks: Iterable[np.ndarray], sfreq: int, physical_min: np.ndarray,
+                physical_max: np.ndarray) -> Iterable[bytes]:
+    """
+    Блоки данных EDF из частей сигнала произвольной длины, неполный последний блок дополняется нулями
+    :param chunks: части сигнала: отсчёты - строки, каналы - столбцы
+    :param sfreq: частота дискретизации, отсчётов в блоке на канал
+    :param physical_min: минимальные значения каналов
+    :param physical_max: максимальные значения каналов
+    :return: блоки EDF
+    """
+    physical_min, physical_max = edf_physical_range(physical_min, physical_max)
+    scale = 65535.0 / (physical_max - physical_min)
+    pending = None
+    for chunk in chunks:
+        pending = chunk if pending is None else np.concatenate([pending, chunk])
+        n_records = len(pending) // sfreq
+        if n_records:
+            yield _edf_digital(pending[:n_records * sfreq], sfreq, physical_min, scale)
+            pending = pending[n_records * sfreq:]
+    if pending is not None and len(pending):
+        tail = np.zeros((sfreq, pending.shape[1]))
+        tail[:len(pending)] = pending
+        yield _edf_digital(tail, sfreq, physical_min, scale)
+
+
+def _edf_digital(samples: np.ndarray, sfreq: int, physical_min: np.ndarray, scale: np.ndarray) -> bytes:
+    digital = np.clip(np.round((samples - physical_min) * scale - 32768.0), -32768, 32767).astype("<i2")
+    # Внутри блока каналы идут друг за другом: (блок, канал, отсчёт)
+    return digital.reshape(-1, sfreq, digital.shape[1]).transpose(0, 2, 1).tobytes()
+
+
+def edf_record_count(n_samples: int, sfreq: int) -> int:
+    return math.ceil(n_samples / sfreq)
+
+
+def export_edf(recording) -> Iterable[bytes]:
+    """
+    Сырой сигнал ЭЭГ исследования в EDF
+    :param recording: запись сырого сигнала: channels, sfreq, n_samples, start, physical_min, physical_max,
+                      dropped_samples и chunks() - части сигнала, отсчёты - строки, каналы - столбцы;
+                      потерянные при записи отсчёты заполнены нулями и отмечаются в описании записи
+    """
+    description = f"dropped {recording.dropped_samples} samples" if recording.dropped_samples else ""
+    yield edf_header(recording.channels, recording.sfreq, edf_record_count(recording.n_samples, recording.sfreq),
+                     recording.start, recording.physical_min, recording.physical_max, recording=description)
+    yield from edf_records(recording.chunks(), recording.sfreq, recording.physical_min, recording.physical_max)
+
+
+async def export_research(desync_uuid: UUID, export_format: str, session: AsyncSession):
+    """
+    Потоковая выгрузка исследования: данные читаются и отдаются частями по мере отправки ответа
+    :param desync_uuid: uuid исследования
+    :param export_format: csv, columnar или edf (сырой сигнал, если он сохранялся)
+    :param session: AsyncSession, закрывается после выгрузки
+    :return: (StreamingResponse, err), (None, None) - нет исследования или сырого сигнала
+    """
+    try:
+        if not await research_exists(desync_uuid, session):
+            await session.close()
+            return None, None
+        if export_format == "edf":
+            await session.close()
+            recording = await asyncio.to_thread(open_raw_recording, desync_uuid)
+            if recording is None:
+                return None, None
+            content = export_edf(recording)
+        elif export_format == "columnar":
+            content = export_columnar(desync_uuid, session)
+        else:
+            content = export_csv(desync_uuid, session)
+    except (exc.SQLAlchemyError, RequestException, socket.gaierror, OSError, ValueError) as e:
+        print(f"LOG: {e}")
+        await session.close()
+        return None, e
+
+    media_type, extension = EXPORT_FORMATS[export_format]
+    return StreamingResponse(content, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{desync_uuid}.{extension}"'}), None
@@ -0,0 +1,228 @@
+import heapq
+import socket
+import datetime as DT
+from uuid import UUID
+
+import numpy as np
+from requests import RequestException
+from sqlalchemy import exc
+from sqlalchemy.future import select
+
+from db.postgres import AsyncSession
+from models.desyncdata import DesyncDatas, DesyncSamples
+from models.research_series import SeriesParams, ChannelSeries, ResearchSeries
+
+
+def samples_matrix(rows: list, channels: list[str] | None) -> tuple[np.ndarray, list[str], np.ndarray]:
+    """
+    Отсчёты исследования в виде массивов NumPy
+    :param rows: строки (ts, channels, values), упорядоченные по времени
+    :param channels: нужные каналы, None - все каналы исследования
+    :return: (время отсчётов в секундах unix time, имена каналов, значения: отсчёты - строки, каналы - столбцы).
+             Значения каналов, которых нет в отсчёте, - NaN
+    """
+    if channels is None:
+        channels = list(dict.fromkeys(name for _, row_channels, _ in rows for name in row_channels))
+    position = {name: column for column, name in enumerate(channels)}
+    ts = np.empty(len(rows))
+    values = np.full((len(rows), len(channels)), np.nan)
+
+    # Состав каналов обычно не меняется за исследование, индексы пересчитываются только при его смене
+    last_channels, source, target = None, None, None
+    for row_number, (row_ts, row_channels, row_values) in enumerate(rows):
+        if row_channels != last_channels:
+            last_channels = row_channels
+            pairs = [(index, position[name]) for index, name in enumerate(row_channels) if name in position]
+            source = np.array([index for index, _ in pairs], dtype=np.intp)
+            target = np.array([column for _, column in pairs], dtype=np.intp)
+        ts[row_number] = row_ts.timestamp()
+        values[row_number, target] = np.asarray(row_values, dtype=np.float64)[source]
+    return ts, channels, values
+
+
+def legacy_rows(data: dict | None, date_from: DT.datetime | None, date_to: DT.datetime | None) -> list:
+    """
+    Отсчёты из JSON data исследований, записанных до появления desync_samples. Ключи - время UTC без пояса
+    :return: list строк (ts, channels, values), упорядоченных по времени
+    """
+    rows = []
+    for key, sample in (data or {}).items():
+        try:
+            ts = DT.datetime.fromisoformat(key).replace(tzinfo=DT.timezone.utc)
+        except (TypeError, ValueError):
+            continue
+        if (date_from and ts < date_from) or (date_to and ts > date_to):
+            continue
+        rows.append((ts, list(sample), list(sample.values())))
+    return sorted(rows, key=lambda row: row[0])
+
+
+def merge_rows(legacy: list, rows: list) -> list:
+    """
+    Отсчёты из JSON data вместе с отсчётами desync_samples, как в карточке исследования:
+    при совпадении времени остаётся отсчёт из desync_samples
+    :param legacy: строки legacy_rows, упорядоченные по времени
+    :param rows: строки desync_samples, упорядоченные по времени
+    :return: list строк (ts, channels, values), упорядоченных по времени
+    """
+    if not legacy:
+        return rows
+    table_ts = {row[0] for row in rows}
+    return list(heapq.merge([row for row in legacy if row[0] not in table_ts], rows, key=lambda row: row[0]))
+
+
+async def research_legacy_rows(desync_uuid: UUID, session: AsyncSession, date_from: DT.datetime | None = None,
+                               date_to: DT.datetime | None = None) -> list | None:
+    """
+    Отсчёты исследования из JSON data
+    :param desync_uuid: uuid исследования
+    :param session: AsyncSession
+    :param date_from: начало интервала
+    :param date_to: конец интервала
+    :return: строки legacy_rows, None - исследования нет
+    """
+    research = await session.execute(select(DesyncDatas.data).where(DesyncDatas.uuid == desync_uuid))
+    research = research.first()
+    if research is None:
+        return None
+    return legacy_rows(research.data, date_from, date_to)
+
+
+def bucket_indices(ts: np.ndarray, points: int) -> np.ndarray:
+    """
+    Начала интервалов равной длительности, пустые интервалы отбрасываются
+    :param ts: время отсчётов, по возрастанию
+    :param points: количество интервалов
+    :return: индексы первых отсчётов интервалов
+    """
+    edges = np.linspace(ts[0], ts[-1], points + 1)[:-1]
+    return np.unique(np.searchsorted(ts, edges, side='left'))
+
+
+def minmax_series(ts: np.ndarray, values: np.ndarray, points: int) -> tuple[np.ndarray, ...]:
+    """
+    Среднее, минимум и максимум каналов по интервалам равной длительности, NaN не учитываются
+    :param ts: время отсчётов, по возрастанию
+    :param values: значения: отсчёты - строки, каналы - столбцы
+    :param points: количество интервалов
+    :return: (среднее время интервала, среднее, минимум, максимум), значения: интервалы - строки, каналы - столбцы
+    """
+    if len(ts) <= points:
+        return ts, values, values, values
+    starts = bucket_indices(ts, points)
+    sizes = np.diff(np.append(starts, len(ts)))
+    present = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(present, values, 0.0), starts, axis=0)
+    counts = np.add.reduceat(present, starts, axis=0)
+    mean = np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+    minimum = np.fmin.reduceat(values, starts, axis=0)
+    maximum = np.fmax.reduceat(values, starts, axis=0)
+    return np.add.reduceat(ts, starts) / sizes, mean, minimum, maximum
+
+
+def lttb_indices(ts: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Прореживание Largest-Triangle-Three-Buckets: из каждого интервала берётся отсчёт, образующий
+    наибольший треугольник с выбранным отсчётом предыдущего интервала и средним следующего
+    :param ts: время отсчётов, по возрастанию
+    :param y: значения канала без NaN
+    :param points: количество точек в результате
+    :return: индексы выбранных отсчётов
+    """
+    n = len(ts)
+    if points >= n or points < 3:
+        return np.arange(n)
+    every = (n - 2) / (points - 2)
+    selected = np.empty(points, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for bucket in range(points - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, n)
+        average_ts = ts[end:next_end].mean() if next_end > end else ts[n - 1]
+        average_y = y[end:next_end].mean() if next_end > end else y[n - 1]
+        area = np.abs((ts[a] - average_ts) * (y[start:end] - y[a]) - (ts[a] - ts[start:end]) * (average_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[bucket + 1] = a
+    return selected
+
+
+def as_utc(value: DT.datetime | None) -> DT.datetime | None:
+    """Время без часового пояса считается временем UTC, как ключи data"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=DT.timezone.utc)
+    return value
+
+
+def to_datetimes(ts: np.ndarray) -> list[DT.datetime]:
+    return [DT.datetime.fromtimestamp(value, DT.timezone.utc) for value in ts.tolist()]
+
+
+def to_floats(values: np.ndarray) -> list[float | None]:
+    """NaN в JSON не допускается, пропуски отдаются как null"""
+    return [None if value != value else value for value in values.tolist()]
+
+
+def build_series(ts: np.ndarray, channels: list[str], values: np.ndarray,
+                 points: int, method: str) -> dict[str, ChannelSeries]:
+    """
+    Ряды каналов для графика
+    :param ts: время отсчётов, по возрастанию
+    :param channels: имена каналов
+    :param values: значения: отсчёты - строки, каналы - столбцы
+    :param points: количество точек на канал
+    :param method: minmax или lttb
+    :return: dict канал -> ChannelSeries
+    """
+    if method == 'lttb':
+        series = {}
+        for column, name in enumerate(channels):
+            present = ~np.isnan(values[:, column])
+            channel_ts, channel_values = ts[present], values[present, column]
+            selected = lttb_indices(channel_ts, channel_values, points)
+            series[name] = ChannelSeries(ts=to_datetimes(channel_ts[selected]),
+                                         value=to_floats(channel_values[selected]))
+        return series
+
+    bucket_ts, mean, minimum, maximum = minmax_series(ts, values, points)
+    bucket_datetimes = to_datetimes(bucket_ts)
+    return {name: ChannelSeries(ts=bucket_datetimes, value=to_floats(mean[:, column]),
+                                min=to_floats(minimum[:, column]), max=to_floats(maximum[:, column]))
+            for column, name in enumerate(channels)}
+
+
+async def get_research_series(desync_uuid: UUID, params: SeriesParams, session: AsyncSession):
+    """
+    Данные исследования за интервал времени по выбранным каналам, сжатые до заданного количества точек.
+    Объём ответа не зависит от длительности исследования
+    :param desync_uuid: uuid исследования
+    :param params: SeriesParams интервал, каналы, количество точек и метод
+    :param session: AsyncSession
+    :return: (ResearchSeries, err)
+    """
+    date_from, date_to = as_utc(params.date_from), as_utc(params.date_to)
+    try:
+        conditions = [DesyncSamples.research_uuid == desync_uuid]
+        if date_from:
+            conditions.append(DesyncSamples.ts >= date_from)
+        if date_to:
+            conditions.append(DesyncSamples.ts <= date_to)
+        query = select(DesyncSamples.ts, DesyncSamples.channels, DesyncSamples.values).where(
+            *conditions).order_by(DesyncSamples.ts)
+        rows = (await session.execute(query)).all()
+
+        legacy = await research_legacy_rows(desync_uuid, session, date_from, date_to)
+        if legacy is None:
+            return None, None
+        rows = merge_rows(legacy, rows)
+
+        ts, channels, values = samples_matrix(rows, params.channels)
+        series = build_series(ts, channels, values, params.points, params.method) if rows else {}
+        return ResearchSeries(research_uuid=desync_uuid, method=params.method, total_samples=len(rows),
+                              channels=series), None
+    except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
+        print(f"LOG: {e}")
+        return None, e
+    finally:
+        await session.close()
@@ -0,0 +1,99 @@
+import time
+import asyncio
+
+from aioredis.exceptions import RedisError
+
+from config.settings import settings
+from redis_module.redis_client import redis
+
+SESSION_EVENTS_CHANNEL = "user_session_events"
+
+
+class SessionCache:
+    """
+    Кэш проверенных токенов в памяти процесса: token -> (uuid, is_admin).
+    Запись живёт не дольше ttl и не дольше срока действия токена. При замене сессии пользователя
+    все воркеры получают uuid через pub/sub Redis и удаляют его записи, не дожидаясь ttl
+    """
+
+    def __init__(self, ttl: float = settings.session_cache_ttl, max_size: int = settings.session_cache_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: dict[str, tuple[float, str, bool]] = {}
+        self._listener: asyncio.Task | None = None
+
+    def _start(self):
+        """Подписка на события сессий при первом обращении к кэшу"""
+        if self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(SESSION_EVENTS_CHANNEL)
+                # Пока подписки не было, события могли потеряться
+                self._entries.clear()
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.invalidate_user(message['data'])
+            except RedisError as e:
+                print(f"LOG: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def get(self, token: str) -> dict | None:
+        """
+        Проверенные данные токена из кэша
+        :param token: токен
+        :return: dict с uuid и is_admin или None
+        """
+        self._start()
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        expires_at, uuid, is_admin = entry
+        if expires_at < time.time():
+            self._entries.pop(token, None)
+            return None
+        return {"uuid": uuid, "is_admin": is_admin}
+
+    def put(self, token: str, uuid: str, is_admin: bool, token_expires_at: float | None = None):
+        """
+        Сохранить проверенный токен
+        :param token: токен
+        :param uuid: uuid пользователя
+        :param is_admin: флаг администратора из токена
+        :param token_expires_at: время окончания действия токена (exp), unix time
+        """
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        if len(self._entries) >= self.max_size:
+            # Вытесняем самую старую запись
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[token] = (expires_at, uuid, is_admin)
+
+    def invalidate_user(self, uuid: str):
+        """
+        Удалить все записи пользователя
+        :param uuid: uuid пользователя
+        """
+        for token in [token for token, entry in self._entries.items() if entry[1] == uuid]:
+            self._entries.pop(token, None)
+
+
+async def publish_session_replaced(uuid: str):
+    """
+    Сообщить всем воркерам, что сессия пользователя заменена
+    :param uuid: uuid пользователя
+    """
+    session_cache.invalidate_user(uuid)
+    try:
+        await redis.publish(SESSION_EVENTS_CHANNEL, uuid)
+    except RedisError as e:
+        print(f"LOG: {e}")
+
+
+session_cache = SessionCache()
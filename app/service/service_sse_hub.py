@@ -0,0 +1,215 @@
+import json
+import asyncio
+from typing import AsyncIterator, Callable
+
+from aioredis.exceptions import RedisError
+from rethinkdb import r, errors as re
+
+from config.settings import settings
+from db.rethink import get_rethink_connection, connect_rethink
+from redis_module.redis_client import redis
+
+ACTIVE_STATUSES = ("open", "in_process")
+SSE_FIELDS = ('impedance', 'channel_desync', 'device', 'patient_code', 'research_status', 'desync_data_uuid')
+
+
+class SSEHub:
+    """
+    Единая на процесс подписка на обновления активных устройств.
+    Источник обновлений - каналы телеметрии ETL в Redis (backend 'redis') или changefeed RethinkDB
+    (backend 'rethink'). Каждое обновление рассылается всем подключённым SSE клиентам через их
+    ограниченные очереди, поэтому нагрузка на базы не зависит от количества клиентов и воркеров API.
+    При потере источника потоки клиентов завершаются, новые клиенты ждут его не дольше sse_ready_timeout
+    """
+
+    def __init__(self, backend: str = settings.sse_backend, queue_size: int = settings.sse_queue_size,
+                 keepalive_seconds: float = settings.sse_keepalive_seconds,
+                 ready_timeout: float = settings.sse_ready_timeout):
+        self.backend = backend
+        self.queue_size = queue_size
+        self.keepalive_seconds = keepalive_seconds
+        self.ready_timeout = ready_timeout
+        self._state: dict[str, dict] = {}
+        self._clients: dict[asyncio.Queue, Callable[[dict], bool]] = {}
+        self._ready: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def _start(self):
+        """Запуск чтения обновлений при подключении первого клиента и перезапуск, если задача чтения завершилась"""
+        if self._task is not None and not self._task.done():
+            return
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        self._ready.clear()
+        reader = self._read_redis() if self.backend == 'redis' else self._read_changefeed()
+        self._task = asyncio.get_running_loop().create_task(reader)
+        self._task.add_done_callback(self._on_reader_done)
+
+    def _on_reader_done(self, task: asyncio.Task):
+        """Задача чтения не должна завершаться, клиенты отключаются, следующий подключившийся перезапустит её"""
+        if not task.cancelled() and task.exception() is not None:
+            print(f"LOG: SSE hub reader stopped: {task.exception()!r}")
+        self._reset()
+
+    async def wait_ready(self) -> bool:
+        """
+        Ожидание первого снимка состояния от источника обновлений
+        :return: False, если источник недоступен дольше ready_timeout
+        """
+        self._start()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=self.ready_timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    @staticmethod
+    def _active_devices():
+        return r.db(settings.rethinkdb_db).table(settings.rethinkdb_table).get_all(
+            *ACTIVE_STATUSES, index="research_status").pluck(*SSE_FIELDS)
+
+    @staticmethod
+    async def _read_snapshot() -> list[dict]:
+        """Текущее состояние активных устройств, одним запросом при подписке на Redis"""
+        async with get_rethink_connection() as conn:
+            cursor = await SSEHub._active_devices().run(conn)
+            return [document async for document in cursor]
+
+    async def _read_redis(self):
+        """Чтение кадров телеметрии из каналов Redis, которые публикует ETL"""
+        while True:
+            pubsub = redis.pubsub()
+            try:
+                # Сначала подписка, затем снимок состояния, чтобы не потерять кадры между ними
+                await pubsub.psubscribe(f"{settings.telemetry_channel_prefix}:*")
+                for document in await self._read_snapshot():
+                    self._update(document)
+                self._ready.set()
+                async for message in pubsub.listen():
+                    if message['type'] == 'pmessage':
+                        self._update(json.loads(message['data']))
+            except (RedisError, re.ReqlDriverError, re.ReqlOpFailedError) as e:
+                print(f"LOG: SSE hub redis error: {e}")
+                self._reset()
+                await asyncio.sleep(1)
+            except Exception as e:
+                print(f"LOG: SSE hub redis reader failed: {e!r}")
+                self._reset()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    async def _read_changefeed(self):
+        """Чтение changefeed на отдельном подключении, курсор живёт всё время работы процесса"""
+        while True:
+            try:
+                async with await connect_rethink() as conn:
+                    cursor = await self._active_devices().changes(include_initial=True, include_states=True).run(conn)
+                    async for change in cursor:
+                        self._dispatch(change)
+            except (re.ReqlDriverError, re.ReqlOpFailedError) as e:
+                print(f"LOG: SSE hub changefeed error: {e}")
+                self._reset()
+                await asyncio.sleep(1)
+            except Exception as e:
+                print(f"LOG: SSE hub changefeed reader failed: {e!r}")
+                self._reset()
+                await asyncio.sleep(1)
+
+    def _reset(self):
+        """
+        Сброс состояния перед переподключением, include_initial заполнит его заново. Потоки подключённых
+        клиентов завершаются: пропущенные за время обрыва обновления им уже не доставить
+        """
+        self._state.clear()
+        self._ready.clear()
+        for client_queue in self._clients:
+            self._put(client_queue, None)
+
+    def _dispatch(self, change: dict):
+        """Разбор события changefeed"""
+        if 'state' in change:
+            if change['state'] == 'ready':
+                self._ready.set()
+            return
+        document = change.get('new_val')
+        if document is None:
+            old_document = change.get('old_val') or {}
+            self._state.pop(old_document.get('device'), None)
+            return
+        self._update(document)
+
+    def _update(self, document: dict):
+        """Обновление состояния устройства и рассылка клиентам"""
+        if document.get('research_status') not in ACTIVE_STATUSES:
+            self._state.pop(document.get('device'), None)
+            return
+        self._state[document['device']] = document
+        for client_queue, predicate in self._clients.items():
+            if predicate(document):
+                self._put(client_queue, document)
+
+    @staticmethod
+    def _put(client_queue: asyncio.Queue, document: dict | None):
+        """Медленный клиент теряет самые старые обновления, а не тормозит остальных"""
+        if client_queue.full():
+            client_queue.get_nowait()
+        client_queue.put_nowait(document)
+
+    @staticmethod
+    def format_event(document: dict) -> str:
+        json_data = json.dumps({
+            "impedance": document['impedance'],
+            "channel_desync": document['channel_desync'],
+            "device": document['device'],
+            "patient_code": document['patient_code']
+        })
+        return f"data:{json_data}\n\n"
+
+    async def subscribe(self, predicate: Callable[[dict], bool]) -> AsyncIterator[str]:
+        """
+        Поток SSE сообщений по устройствам, подходящим под predicate.
+        Сначала отдаётся текущее состояние, затем обновления по мере записи ETL.
+        Если подходящих активных устройств нет или источник обновлений недоступен, поток сразу завершается,
+        при потере источника - завершается после отправленных обновлений
+        :param predicate: фильтр документов устройств
+        """
+        if not await self.wait_ready():
+            return
+        current = [document for document in self._state.values() if predicate(document)]
+        if not current:
+            return
+
+        client_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._clients[client_queue] = predicate
+        try:
+            for document in current:
+                yield self.format_event(document)
+            while True:
+                try:
+                    document = await asyncio.wait_for(client_queue.get(), timeout=self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if document is None:
+                    return
+                yield self.format_event(document)
+        finally:
+            self._clients.pop(client_queue, None)
+
+
+async def publish_device_frame(document: dict):
+    """
+    Публикация состояния устройства в канал телеметрии, для изменений, которые делает API, а не ETL
+    :param document: документ устройства из RethinkDB
+    """
+    if not document:
+        return
+    frame = {field: document.get(field) for field in SSE_FIELDS}
+    try:
+        await redis.publish(f"{settings.telemetry_channel_prefix}:{frame['device']}", json.dumps(frame))
+    except RedisError as e:
+        print(f"LOG: {e}")
+
+
+hub = SSEHub()
@@ -11,7 +11,6 @@ from email.mime.text import MIMEText
 
 from http import HTTPStatus
 from typing import List, Any, Tuple
-from uuid import UUID
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from requests import RequestException
@@ -21,9 +20,13 @@ from sqlalchemy.sql.operators import ilike_op
 
 from db.postgres import get_session, AsyncSession
 from models.user import UserAuthorization, User, UserRecoveryPassword
-from service.common import update_model_in_database, get_model_details, get_models_list
+from service.common import update_model_in_database, get_models_list
+from service.service_pagination import keyset_page
+from models.cursor_page import CursorParams, CursorPage
 from config.settings import settings
 from redis_module.redis_client import redis
+from service.service_session_cache import session_cache
+from service.service_executor import cpu_executor
 
 
 SECRET_KEY = settings.secret_key
@@ -41,7 +44,7 @@ async def write_user_to_database(model_to_write, session: AsyncSession = Depends
     """
 
     salt = get_random_string()
-    hashed_password = hash_password(model_to_write.password, salt)
+    hashed_password = await cpu_executor.run(hash_password, model_to_write.password, salt)
     model_to_write.password = f"{salt}${hashed_password}"
 
     try:
@@ -70,7 +73,7 @@ async def authorization(email: str, password: str,
         stmt = select(User).where(User.email == email)
         result = await session.execute(stmt)
         result_out = result.scalars().first()
-        if not result_out or not validate_password(password=password, hashed_password=result_out.password):
+        if not result_out or not await cpu_executor.run(validate_password, password, result_out.password):
             raise HTTPException(status_code=400, detail="Incorrect email or password")
         return result_out
     except (exc.SQLAlchemyError, RequestException) as e:
@@ -100,7 +103,7 @@ async def recovery_password(user_recovery_password_model: UserRecoveryPassword,
 
         rand_password = generate_password(6)
         salt = get_random_string()
-        hashed_password = hash_password(rand_password, salt)
+        hashed_password = await cpu_executor.run(hash_password, rand_password, salt)
         result_model.password = f"{salt}${hashed_password}"
 
         await session.commit()
@@ -170,9 +173,14 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 async def get_current_uuid_from_token(token: str = Depends(oauth2_scheme)) -> dict:
     """
     Получение uuid пользователя из токена и проверка сессии.
+    Проверенные токены кэшируются в памяти процесса, при промахе сессия и токен читаются из Redis одним MGET
     :param token: токен, в котором хранятся данные
     :return: dict: словарь с uuid пользователя и флагом is_admin
     """
+    cached = session_cache.get(token)
+    if cached is not None:
+        return cached
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Не удалось проверить учетные данные",
@@ -188,8 +196,8 @@ async def get_current_uuid_from_token(token: str = Depends(oauth2_scheme)) -> di
         if uuid is None or token_session_id is None:
             raise credentials_exception
 
-        # Получаем session_id из Redis
-        session_id = await redis.get(f"user_session:{uuid}")
+        # Получаем session_id и токен из Redis за один запрос
+        session_id, saved_token = await redis.mget(f"user_session:{uuid}", f"user_token:{uuid}")
         if session_id is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Сессия истекла или недействительна")
 
@@ -197,11 +205,11 @@ async def get_current_uuid_from_token(token: str = Depends(oauth2_scheme)) -> di
         if session_id != token_session_id:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Несоответствие идентификатора сессии")
 
-        # Получаем токен из Redis и сравниваем его с предоставленным токеном
-        saved_token = await redis.get(f"user_token:{uuid}")
+        # Сравниваем сохранённый токен с предоставленным
         if saved_token is None or saved_token != token:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Недействительная сессия")
 
+        session_cache.put(token, uuid, is_admin, payload.get("exp"))
         return {"uuid": uuid, "is_admin": is_admin}
 
     except JWTError:
@@ -215,42 +223,22 @@ async def get_current_user_uuid(
     return uuid_data['uuid']
 
 
-async def check_admin_status(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)) -> str:
+async def check_admin_status(token: str = Depends(oauth2_scheme)) -> str:
+    """
+    Проверка, что запрос сделан администратором. Признак администратора берётся из подписанного токена,
+    он выставляется при авторизации по admin_email
+    :param token: токен, в котором хранятся данные
+    :return: str uuid администратора
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_403_FORBIDDEN,
         detail="Could not access",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        uuid: str = payload.get("sub")
-        token_session_id: str = payload.get("session_id")
-
-        if uuid is None or token_session_id is None:
-            raise credentials_exception
-
-        # Проверяем сессию
-        session_id = await redis.get(f"user_session:{uuid}")
-        if session_id is None or session_id != token_session_id:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Сессия истекла или недействительна")
-
-        # Проверяем токен
-        saved_token = await redis.get(f"user_token:{uuid}")
-        if saved_token is None or saved_token != token:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Недействительная сессия")
-
-        user, err = await get_model_details(model_uuid=UUID(uuid), model_type=User, session=session)
-        if err:
-            raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR)
-        if user.email == settings.admin_email:
-            return uuid
-        else:
-            raise credentials_exception
-    except JWTError:
+    uuid_data = await get_current_uuid_from_token(token)
+    if not uuid_data['is_admin']:
         raise credentials_exception
-    except AttributeError as e:
-        print(f"LOG: {e} - скорее всего БД легла")
-        raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR)
+    return uuid_data['uuid']
 
 
 def send_email_to_user(new_password: str, user_mail: str):
@@ -349,3 +337,26 @@ async def search_user(name_or_surname: str, session: AsyncSession) -> list[Any]
         return None, e
     finally:
         await session.close()
+
+
+async def search_user_page(name_or_surname: str | None, params: CursorParams,
+                           session: AsyncSession) -> Tuple[CursorPage, None] | Tuple[None, Any]:
+    """
+    Страница поиска пользователей по имени или фамилии на стороне БД, ключ - уникальный email
+    :param name_or_surname: фамилия или имя пользователя, None - все пользователи
+    :param params: CursorParams
+    :param session: сессия бд
+    :return: (CursorPage, err)
+    """
+    try:
+        query = select(User)
+        if name_or_surname is not None:
+            query = query.filter(or_(ilike_op(User.first_name, f"{name_or_surname}%"),
+                                     ilike_op(User.last_name, f"{name_or_surname}%")))
+        page = await keyset_page(query, [User.email], params, session)
+        return page, None
+    except (exc.SQLAlchemyError, RequestException, socket.gaierror) as e:
+        print(f"LOG: {e}")
+        return None, e
+    finally:
+        await session.close()
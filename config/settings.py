@@ -9,6 +9,15 @@ class Base(BaseSettings):
     rethinkdb_host: str
     rethinkdb_port: int
     border_time: int
+    rethinkdb_pool_size: int = 2
+    rethinkdb_health_check_interval: float = 30.0
+
+    # Redis section
+    redis_host: str = 'redis'
+    redis_port: int = 6379
+    redis_db: int = 0
+    publish_telemetry: bool = True
+    telemetry_channel_prefix: str = 'telemetry'
 
     # API section
     project_name: str
@@ -22,12 +31,42 @@ class Base(BaseSettings):
     postgres_port: int
 
     five_minute_sample: int
+    # Сколько записей десинхронизации копить перед одной вставкой в desync_samples. Накопленные записи
+    # вставляются и при остановке процесса устройства (SIGTERM) или записи исследования, но теряются при
+    # SIGKILL/OOM и до вставки не видны в API, поэтому по умолчанию каждая запись вставляется сразу
+    desync_samples_batch_size: int = 1
+    # Не держать записи дольше стольких секунд, даже если пачка не заполнена
+    desync_samples_flush_seconds: float = 60.0
+
+    # Архив сырого сигнала ЭЭГ исследований, см. load_data/raw_archive.py
+    raw_archive: bool = False
+    raw_archive_dir: str = '/data/raw_archive'
+    raw_archive_codec: str = 'zlib'
+    raw_archive_chunk_seconds: float = 10.0
+    # Сколько процесс устройства ждёт места в очереди записи архива при открытии файла исследования, сек
+    raw_archive_put_timeout: float = 5.0
+    # Сколько ждать остановки процесса устройства, пока он дописывает накопленные данные, сек
+    process_stop_timeout: float = 10.0
 
     use_impedance: bool
     data_file_name: str
+    # Источники отсчётов устройств вместо LSL: имя устройства -> строка источника, например
+    # {"MNE2": "file:/data/recordings/Альфа.edf?speed=10", "SIM1": "synthetic?channels=8&seed=1"},
+    # см. interfaces/sample_source.py. Остальные устройства читаются из LSL
+    sample_sources: dict[str, str] = {}
 
     max_samples: int
 
+    use_ring_buffer: bool = True
+    ring_buffer_windows: int = 4
+
+    sliding_window: bool = False
+    window_seconds: float = 3.0
+    hop_seconds: float = 0.25
+
+    incremental_calibration: bool = True
+    calibration_chunk_seconds: float = 0.5
+
     log_level: str
 
     mne_parameter: bool
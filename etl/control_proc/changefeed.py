@@ -1,20 +1,105 @@
 import sys
+import queue
+import threading
 
 import backoff
+from deprecated import deprecated
 from rethinkdb import r, errors as re
 
 from config.settings import settings
+from config.logs_config import logger_processes_control
+
+# Поля управления устройством. Телеметрия (channel_desync, impedance, baseline, calibration_progress)
+# пишется процессами устройств на каждом чанке и не должна будить цикл управления
+CONTROL_FIELDS = ('device', 'status', 'calibration', 'time_calibration', 'desync_data_uuid')
 
 
 def giveup():
     sys.exit(-1)
 
 
+def control_changes(include_initial: bool = False, include_states: bool = False):
+    """
+    Changefeed только по переходам полей управления: изменения, в которых поля управления не поменялись,
+    отбрасываются на стороне RethinkDB и до процесса управления не доходят
+    :param include_initial: сначала отдать текущее состояние всех устройств
+    :param include_states: отдавать служебные документы состояния курсора ('initializing', 'ready')
+    """
+    return r.db('RTDB_desync').table('dev_desync').pluck(*CONTROL_FIELDS).changes(
+        include_initial=include_initial, include_states=include_states).filter(
+        lambda change: change.has_fields('state') | (change['new_val'].ne(None) &
+                                                     change['old_val'].default(None).ne(change['new_val'])))
+
+
+@deprecated("Use ChangeFeedConsumer, every call opens a new connection and cursor")
 @backoff.on_exception(backoff.expo, (re.ReqlDriverError, re.ReqlOpFailedError), max_time=60, on_giveup=giveup)
 def change_feed() -> dict:
     conn = r.connect(settings.rethinkdb_host, settings.rethinkdb_port)
-    cursor = r.db('RTDB_desync').table('dev_desync').pluck('device', 'status',
-                                                           'calibration', 'time_calibration',
-                                                           "desync_data_uuid").changes()['new_val'].run(conn)
+    cursor = control_changes()['new_val'].run(conn)
     for document in cursor:
         return document
+
+
+class ChangeFeedConsumer:
+    """
+    Долгоживущий потребитель changefeed таблицы устройств. Держит одно подключение и один курсор в отдельном
+    потоке и складывает события в очередь. После переподключения курсор открывается с include_initial,
+    поэтому обработчик получает текущее состояние всех устройств и может сверить его со своим
+    """
+
+    def __init__(self, events: queue.Queue | None = None, max_reconnect_delay: float = 30.0):
+        """
+        :param events: очередь событий, элементы - {'initial': bool, 'document': dict}. Если поток чтения
+            завершился не по stop, последним элементом кладётся {'error': str}
+        :param max_reconnect_delay: максимальная пауза между попытками переподключения, сек
+        """
+        self.events: queue.Queue = events if events is not None else queue.Queue()
+        self.max_reconnect_delay = max_reconnect_delay
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """Запуск потока чтения changefeed"""
+        self._thread = threading.Thread(target=self.run, name='changefeed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановка потока чтения changefeed после следующего события"""
+        self._stop.set()
+
+    def run(self):
+        """
+        Чтение changefeed с переподключением при обрыве соединения и любой другой ошибке. Если поток всё же
+        завершается не по stop, в очередь кладётся {'error': ...}, чтобы цикл управления не ждал событий вечно
+        """
+        attempt = 0
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._consume()
+                    attempt = 0
+                    continue
+                except (re.ReqlDriverError, re.ReqlOpFailedError) as e:
+                    logger_processes_control.warning(f'Changefeed connection lost ({e})')
+                except Exception as e:
+                    logger_processes_control.exception(f'Changefeed failed ({e!r})')
+                delay = min(2 ** attempt, self.max_reconnect_delay)
+                attempt += 1
+                logger_processes_control.warning(f'Changefeed reconnecting in {delay} s')
+                self._stop.wait(delay)
+        except BaseException as e:
+            self.events.put({'error': repr(e)})
+            raise
+
+    def _consume(self):
+        with r.connect(settings.rethinkdb_host, settings.rethinkdb_port) as conn:
+            cursor = control_changes(include_initial=True, include_states=True).run(conn)
+            logger_processes_control.info('Changefeed cursor opened')
+            for change in cursor:
+                if self._stop.is_set():
+                    break
+                if 'state' in change:
+                    logger_processes_control.info(f"Changefeed state: {change['state']}")
+                    continue
+                # Начальные документы include_initial приходят без old_val
+                self.events.put({'initial': 'old_val' not in change, 'document': change['new_val']})
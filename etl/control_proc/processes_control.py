@@ -1,13 +1,15 @@
+import sys
+import signal
 from multiprocessing import Process, Event
 
-from pylsl import StreamInlet
-
 from load_data.load_data import RethinkDB, PostgresqlDB
 from config.logs_config import logger_processes_control
 from datatransform.filtration_manager import FiltrationManager
 from interfaces.interface import LslRead
-from control_proc.changefeed import change_feed
+from interfaces.sample_source import SampleSource, LslSource, open_sample_source
+from control_proc.changefeed import ChangeFeedConsumer
 from control_proc.transform_data import TransformData
+from config.settings import settings
 
 
 class ControlProcesses:
@@ -21,36 +23,88 @@ class ControlProcesses:
         """
          Запуск и остановка процессов
          """
+        """ Тут слушаем таблицу dev_desync rethink """
+        consumer = ChangeFeedConsumer()
+        consumer.start()
         while True:
-            """ Тут слушаем таблицу dev_desync rethink """
-            dict_change = change_feed()
-            device_name = dict_change.get('device')
-            calibration = dict_change.get('calibration')
-            desync_data_uuid = dict_change.get('desync_data_uuid')
-            status = dict_change.get('status')
-            self.time_calibration = dict_change.get('time_calibration')
-            if status:
-                if calibration:
-                    RethinkDB.rethink_status_state(device=device_name, research_status='in_process')
-                    if not self.stop_process(device_name):
-                        break
-                # self.time_calibration = time_calibration
-                self.start_process(device_name, calibration, desync_data_uuid)
-            else:
-                if self.stop_process(device_name):
-                    RethinkDB.rethink_calibration_false(device_name)
-                    RethinkDB.rethink_status_state(device=device_name, research_status='close')
+            event = consumer.events.get()
+            if 'error' in event:
+                logger_processes_control.critical(f"Changefeed consumer stopped: {event['error']}")
+                raise RuntimeError(f"Changefeed consumer stopped: {event['error']}")
+            if event['initial']:
+                self.reconcile_process(event['document'])
+            elif not self.handle_change(event['document']):
+                consumer.stop()
+                break
+
+    def handle_change(self, dict_change: dict) -> bool:
+        """
+        Обработка перехода полей управления устройством
+        :param dict_change: dict документ устройства с полями управления
+        :return: False, если цикл управления нужно остановить
+        """
+        device_name = dict_change.get('device')
+        calibration = dict_change.get('calibration')
+        desync_data_uuid = dict_change.get('desync_data_uuid')
+        status = dict_change.get('status')
+        self.time_calibration = dict_change.get('time_calibration')
+        if status:
+            if calibration:
+                RethinkDB.rethink_status_state(device=device_name, research_status='in_process')
+                if not self.stop_process(device_name):
+                    return False
+            # self.time_calibration = time_calibration
+            self.start_process(device_name, calibration, desync_data_uuid)
+        else:
+            if self.stop_process(device_name):
+                RethinkDB.rethink_calibration_false(device_name)
+                RethinkDB.rethink_status_state(device=device_name, research_status='close')
+        return True
 
+    def reconcile_process(self, dict_change: dict):
+        """
+        Сверка запущенных процессов с текущим состоянием устройства после (пере)подключения к changefeed.
+        Уже запущенные процессы не перезапускаются, пропущенные переходы досинхронизируются
+        :param dict_change: dict документ устройства с полями управления
+        """
+        device_name = dict_change.get('device')
+        running = device_name in self.process_list
+        if dict_change.get('status') and not running:
+            self.time_calibration = dict_change.get('time_calibration')
+            if dict_change.get('calibration'):
+                RethinkDB.rethink_status_state(device=device_name, research_status='in_process')
+            self.start_process(device_name, dict_change.get('calibration'), dict_change.get('desync_data_uuid'))
+        elif not dict_change.get('status') and running:
+            if self.stop_process(device_name):
+                RethinkDB.rethink_calibration_false(device_name)
+                RethinkDB.rethink_status_state(device=device_name, research_status='close')
 
     def get_streams_dict(self) -> dict:
         """
-         Получение словаря с именами каналов и значений
-         :return: dict
+         Получение словаря с именами устройств и их потоками LSL
+         :return: dict имя устройства -> LslSource
          """
         streams_list = LslRead().create_inlet_eeg()
-        self.streams_dict = {stream.info().name(): stream for stream in streams_list}
+        self.streams_dict = {stream.info().name(): LslSource(stream) for stream in streams_list}
         return self.streams_dict
 
+    @staticmethod
+    def open_configured_source(device_name: str) -> SampleSource | None:
+        """
+        Источник устройства из settings.sample_sources: запись или синтетический сигнал вместо LSL.
+        Создаётся при каждом запуске процесса, поэтому запись воспроизводится с начала
+        :param device_name: имя устройства
+        :return: SampleSource или None, если источник не задан или не открылся
+        """
+        spec = settings.sample_sources.get(device_name)
+        if not spec:
+            return None
+        try:
+            return open_sample_source(device_name, spec)
+        except (ValueError, OSError) as e:
+            logger_processes_control.error(f'Sample source {spec!r} of {device_name} error: {e}')
+            return None
+
     def start_process(self, device_name: str, calibration: bool, desync_data_uuid: str):
         """
         Старт процесса. Запуск устройства
@@ -58,9 +112,12 @@ class ControlProcesses:
         process = self.process_list.get(device_name)
         if not process:
 
-            stream = self.streams_dict.get(device_name, None)
+            if device_name in settings.sample_sources:
+                stream = self.open_configured_source(device_name)
+            else:
+                stream = self.streams_dict.get(device_name, None)
 
-            if not stream:
+            if not stream and device_name not in settings.sample_sources:
                 # возможность добавить новое устройство, resolved ещё раз
                 self.streams_dict = self.get_streams_dict()
                 stream = self.streams_dict.get(device_name, None)
@@ -83,6 +140,8 @@ class ControlProcesses:
         # if process:
         try:
             process.terminate()
+            # Дожидаемся записи накопленных данных, иначе новый процесс устройства откроет тот же архив
+            process.join(timeout=settings.process_stop_timeout)
             del self.process_list[device_name]
             logger_processes_control.info(f'The process {device_name} is stopped')
             return True
@@ -92,14 +151,28 @@ class ControlProcesses:
         # else:
         #     logger_processes_control.error(f'Process {device_name} not found')
 
-    def transform_load_data(self, inlet_data: StreamInlet, calibration: bool, desync_data_uuid: str) -> None:
+    def transform_load_data(self, source: SampleSource, calibration: bool, desync_data_uuid: str) -> None:
         """
         Вызывается при работе с устройством
         """
+        if source.sfreq:
+            # Фильтры и окна TransformData считаются по частоте дискретизации источника
+            self.filtration.settings.set_sampling_frequency(source.sfreq)
         transform_data = TransformData(self.filtration)
+
+        def stop(signum, frame):
+            # terminate в stop_process посылает SIGTERM, накопленные данные записываются перед выходом
+            transform_data.close()
+            sys.exit(0)
+        signal.signal(signal.SIGTERM, stop)
+
         if calibration:
-            transform_data.get_average_baseline_mne(inlet_data=inlet_data, time_calibration=self.time_calibration)
-        impedance_names = LslRead.get_impedance_name(inlet_data)
+            if settings.incremental_calibration:
+                transform_data.get_average_baseline_incremental(source=source,
+                                                                time_calibration=self.time_calibration)
+            else:
+                transform_data.get_average_baseline_mne(source=source, time_calibration=self.time_calibration)
+        impedance_names = source.impedance_names()
         while True:
-            transform_data.work_constantly(inlet_data=inlet_data, impedance_names=impedance_names,
+            transform_data.work_constantly(source=source, impedance_names=impedance_names,
                                            calibration=calibration, desync_data_uuid=desync_data_uuid)
@@ -0,0 +1,143 @@
+import os
+import csv
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from config.settings import settings
+from config.logs_config import logger_processes_control
+from datatransform.filtration_manager import FiltrationManager
+from control_proc.transform_data import TransformData, CalibrationAccumulator
+from interfaces.sample_source import RecordingSource
+
+
+def reprocess_channels(path: str, picks: list[int], time_calibration: float) -> dict:
+    """
+    Пересчёт десинхронизации группы каналов записи тем же конвейером TransformData, что и при работе
+    с устройством: калибровка по первым time_calibration секундам, затем обработка чанками по hop_samples.
+    Каналы обрабатываются независимо, поэтому группы каналов можно считать в разных процессах
+    :param path: путь к записи
+    :param picks: номера каналов группы
+    :param time_calibration: длительность калибровки, сек
+    :return: dict с временем и значениями десинхронизации по чанкам и записями раз в пять минут
+    """
+    source = RecordingSource(path)
+    sfreq = source.sfreq
+    filtration = FiltrationManager()
+    filtration.settings.set_sampling_frequency(sfreq)
+    transform_data = TransformData(filtration)
+
+    """Калибровка"""
+    calibration_samples = min(int(time_calibration * sfreq), source.n_samples)
+    chunk_samples = min(transform_data.hop_samples, max(1, int(settings.calibration_chunk_seconds * sfreq)))
+    accumulator = CalibrationAccumulator(transform_data.stream_filtration, transform_data.window_samples)
+    for start in range(0, calibration_samples, chunk_samples):
+        accumulator.update(source.read(start, min(start + chunk_samples, calibration_samples), picks), sfreq)
+    if not accumulator.segments_count:
+        raise ValueError(f'{path}: {calibration_samples} calibration samples, '
+                         f'{transform_data.window_samples} needed for one segment')
+    _, transform_data.baseline_min, transform_data.baseline_max = accumulator.result()
+
+    """Обработка"""
+    times, series, record_times, records = [], [], [], []
+    for start in range(calibration_samples, source.n_samples, transform_data.hop_samples):
+        stop = min(start + transform_data.hop_samples, source.n_samples)
+        desync = transform_data.process_chunk(source.read(start, stop, picks), sfreq)
+        if desync is None:
+            continue
+        times.append(stop / sfreq)
+        series.append(desync)
+        desync_average = transform_data.record_average(desync, stop - start)
+        if desync_average is not None:
+            record_times.append(stop / sfreq)
+            records.append(desync_average)
+
+    n_channels = len(picks)
+    return {'times': np.array(times), 'series': np.array(series).reshape(-1, n_channels),
+            'record_times': np.array(record_times), 'records': np.array(records).reshape(-1, n_channels)}
+
+
+def write_series(path: str, channels: list, times: np.ndarray, values: np.ndarray):
+    """
+    Запись ряда десинхронизации в CSV: время от начала записи, сек, и столбец на канал
+    """
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['t', *channels])
+        for row_time, row in zip(times.tolist(), values.tolist()):
+            writer.writerow([round(row_time, 3), *row])
+
+
+def output_paths(path: str, output_dir: str | None) -> tuple[str, str]:
+    """Результаты пишутся рядом с записью или в output_dir: <имя>.desync.csv и <имя>.desync_records.csv"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    directory = output_dir or os.path.dirname(os.path.abspath(path))
+    return os.path.join(directory, f'{stem}.desync.csv'), os.path.join(directory, f'{stem}.desync_records.csv')
+
+
+def reprocess(paths: list[str], time_calibration: float, workers: int | None = None, channel_groups: int = 1,
+              output_dir: str | None = None) -> dict:
+    """
+    Пересчёт записей в пуле процессов: задача пула - группа каналов одной записи
+    :param paths: пути к записям
+    :param time_calibration: длительность калибровки, сек
+    :param workers: количество процессов, по умолчанию по числу ядер
+    :param channel_groups: на сколько групп делить каналы каждой записи
+    :param output_dir: каталог результатов, по умолчанию рядом с записями
+    :return: dict статистики: отсчётов, секунд записи, секунд работы, отсчётов в секунду, ускорение
+    """
+    started = time.perf_counter()
+    stats = {'recordings': 0, 'samples': 0, 'channel_samples': 0, 'recording_seconds': 0.0}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = []
+        for path in paths:
+            source = RecordingSource(path)
+            groups = [group.tolist() for group in np.array_split(np.arange(len(source.channels)),
+                                                                 max(1, min(channel_groups, len(source.channels))))]
+            futures = [executor.submit(reprocess_channels, path, group, time_calibration) for group in groups]
+            jobs.append((source, groups, futures))
+
+        for source, groups, futures in jobs:
+            try:
+                results = [future.result() for future in futures]
+            except (ValueError, OSError) as e:
+                logger_processes_control.error(f'Reprocessing of {source.path} failed: {e}')
+                continue
+            channels = [source.channels[index] for group in groups for index in group]
+            series_path, records_path = output_paths(source.path, output_dir)
+            write_series(series_path, channels, results[0]['times'],
+                         np.hstack([result['series'] for result in results]))
+            write_series(records_path, channels, results[0]['record_times'],
+                         np.hstack([result['records'] for result in results]))
+
+            stats['recordings'] += 1
+            stats['samples'] += source.n_samples
+            stats['channel_samples'] += source.n_samples * len(source.channels)
+            stats['recording_seconds'] += source.n_samples / source.sfreq
+
+    elapsed = time.perf_counter() - started
+    stats['elapsed_seconds'] = elapsed
+    stats['samples_per_second'] = stats['samples'] / elapsed if elapsed else 0.0
+    stats['channel_samples_per_second'] = stats['channel_samples'] / elapsed if elapsed else 0.0
+    stats['realtime_factor'] = stats['recording_seconds'] / elapsed if elapsed else 0.0
+    return stats
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Пересчёт десинхронизации по сохранённым записям')
+    parser.add_argument('paths', nargs='+', help='архивы сырого сигнала (.draw) или EDF файлы')
+    parser.add_argument('--time-calibration', type=float, default=60.0, help='длительность калибровки, сек')
+    parser.add_argument('--workers', type=int, default=None, help='количество процессов')
+    parser.add_argument('--channel-groups', type=int, default=1, help='на сколько групп делить каналы записи')
+    parser.add_argument('--output-dir', default=None, help='каталог результатов, по умолчанию рядом с записями')
+    args = parser.parse_args(argv)
+
+    stats = reprocess(args.paths, args.time_calibration, args.workers, args.channel_groups, args.output_dir)
+    # transform_data без mne_parameter перенаправляет stdout в devnull, отчёт пишется в исходный stdout
+    print(f"Recordings: {stats['recordings']}, samples: {stats['samples']} "
+          f"({stats['recording_seconds']:.1f} s of signal) in {stats['elapsed_seconds']:.2f} s: "
+          f"{stats['samples_per_second']:.0f} samples/s, {stats['channel_samples_per_second']:.0f} channel samples/s, "
+          f"{stats['realtime_factor']:.1f}x real time", file=sys.__stdout__)
@@ -3,16 +3,20 @@ import numpy as np
 import logging
 import os
 import sys
+import time
 import warnings
-from pylsl import StreamInlet
+from uuid import UUID
+from datetime import datetime, timezone
 from deprecated import deprecated
 
 from datatransform.filtration_manager import FiltrationManager
+from datatransform.stream_filtration_manager import StreamFiltrationManager
 from load_data.load_data import RethinkDB, PostgresqlDB
+from load_data.raw_archive import RawArchiveWriter
 from config.logs_config import logger_processes_control
-from datatransform.processing_manager import ProcessingManager
-from interfaces.interface import LslRead
-from database_etl.models import DesyncDatas
+from datatransform.processing_manager import ProcessingManager, SegmentPowerStream
+from interfaces.sample_source import SampleSource
+from interfaces.ring_buffer import RingBuffer
 from config.settings import settings
 
 class DevNullHandler(logging.Handler):
@@ -26,6 +30,49 @@ if not settings.mne_parameter:
     mne_logger = logging.getLogger('mne')
     mne_logger.handlers = [DevNullHandler()]
 
+
+class CalibrationAccumulator:
+    """
+    Базовые значения калибровки по мере поступления данных: минимум, максимум и среднее разницы
+    средних мощностей Альфа и бетта ритмов по сегментам каждого канала
+    """
+
+    def __init__(self, stream_filtration: StreamFiltrationManager, window_samples: int):
+        self.stream_filtration = stream_filtration
+        self.alpha_segments = SegmentPowerStream(window_samples)
+        self.beta_segments = SegmentPowerStream(window_samples)
+        self.difference_min: np.ndarray | None = None
+        self.difference_max: np.ndarray | None = None
+        self.difference_sum: np.ndarray | None = None
+        self.segments_count: int = 0
+
+    def update(self, eeg_data, sfreq: int):
+        """
+        Добавить чанк калибровки
+        :param eeg_data: массив новых сырых ЭЭГ данных (каналы - строки)
+        :param sfreq: частота дискретизации ЭЭГ сигнала
+        """
+        alpha_data, beta_data = self.stream_filtration.filtration(eeg_data, sfreq)
+        difference_average = self.alpha_segments.update(alpha_data) - self.beta_segments.update(beta_data)
+        if not difference_average.shape[1]:
+            return
+        if self.difference_min is None:
+            self.difference_min = np.min(difference_average, axis=1)
+            self.difference_max = np.max(difference_average, axis=1)
+            self.difference_sum = np.sum(difference_average, axis=1)
+        else:
+            self.difference_min = np.minimum(self.difference_min, np.min(difference_average, axis=1))
+            self.difference_max = np.maximum(self.difference_max, np.max(difference_average, axis=1))
+            self.difference_sum += np.sum(difference_average, axis=1)
+        self.segments_count += difference_average.shape[1]
+
+    def result(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: (среднее, минимум, максимум) разницы мощностей по каналам
+        """
+        return self.difference_sum / self.segments_count, self.difference_min, self.difference_max
+
+
 class TransformData:
     def __init__(self, filtration):
         self.table_initialization: bool = True
@@ -33,24 +80,86 @@ class TransformData:
         self.channel_names: list = []
         self.baseline_list: list = []
         self.desync_prev: list = []
+        self.desync_samples: list[dict] = []
+        self.raw_archive: RawArchiveWriter | None = RawArchiveWriter() if settings.raw_archive else None
         self.filtration: FiltrationManager = filtration
-        self.average_baseline = {'Ch_0': {'max': 0, 'min': 0}}
+        self.stream_filtration = StreamFiltrationManager(filtration.settings)
+        # Минимальные и максимальные значения разницы между Альфа и бетта ритмом по каналам при калибровке
+        self.baseline_min: np.ndarray = np.zeros(1)
+        self.baseline_max: np.ndarray = np.zeros(1)
+        self.ring_buffer: RingBuffer | None = None
+        self.alpha_window: RingBuffer | None = None
+        self.beta_window: RingBuffer | None = None
+
+        # Окно анализа и шаг сдвига окна в отсчётах, без скользящего окна окна не перекрываются
+        sfreq = self.filtration.settings.get_sampling_frequency()
+        if settings.sliding_window:
+            self.window_samples: int = int(settings.window_seconds * sfreq)
+            self.hop_samples: int = int(settings.hop_seconds * sfreq)
+            self.chunk_timeout: float = settings.hop_seconds * 2
+        else:
+            self.window_samples: int = settings.max_samples
+            self.hop_samples: int = settings.max_samples
+            self.chunk_timeout: float = 4.0
 
-    def work_constantly(self, inlet_data, impedance_names, calibration, desync_data_uuid):
+    def work_constantly(self, source: SampleSource, impedance_names, calibration, desync_data_uuid):
         """
         Бесконечный метод. Всегда обновляет импеданс в RethinkDB
         """
-        all_data = LslRead().create_chunk_sample(inlet_data)
-        all_data = np.array(all_data)
-        impedance = np.around(all_data[-1, len(all_data[0]) // 2:], 2)
+        if settings.use_ring_buffer or settings.sliding_window:
+            data_from_device, impedance, timestamps = self.read_ring_buffer(source)
+        else:
+            data_from_device, impedance, timestamps = self.read_chunk_sample(source)
+        if data_from_device is None:
+            return
+        impedance = np.around(impedance.astype(np.float64), 2)
         impedance_dict = dict(zip(impedance_names, impedance))
         if calibration:
-            self.calibrate_and_record(all_data=all_data, desync_data_uuid=desync_data_uuid, inlet_data=inlet_data,
-                                      impedance_dict=impedance_dict)
+            self.calibrate_and_record(data_from_device=data_from_device, desync_data_uuid=desync_data_uuid,
+                                      device_name=source.name, impedance_dict=impedance_dict, timestamps=timestamps)
 
         else:
+            if self.raw_archive is not None:
+                self.raw_archive.flush()
+            self.flush_desync_samples()
             RethinkDB.rethink_update_impedance(desync_data_uuid, impedance_dict)
 
+    def close(self):
+        """
+        Запись накопленных данных при остановке процесса устройства: ControlProcesses останавливает процесс
+        через terminate, обработчик SIGTERM вызывает close
+        """
+        self.flush_desync_samples()
+        if self.raw_archive is not None:
+            self.raw_archive.close()
+
+    def read_chunk_sample(self, source: SampleSource):
+        """
+        Чтение chunk массивом без кольцевого буфера
+        :return: (данные ЭЭГ: отсчёты - строки, каналы - столбцы; импеданс последнего отсчёта; метки времени,
+                 при чтении массивом они не передаются - None)
+        """
+        all_data = source.pull_samples()
+        if not len(all_data):
+            return None, None, None
+        return all_data[:, :len(all_data[0]) // 2], all_data[-1, len(all_data[0]) // 2:], None
+
+    def read_ring_buffer(self, source: SampleSource):
+        """
+        Чтение chunk напрямую в предвыделенный кольцевой буфер
+        :return: (view данных ЭЭГ: отсчёты - строки, каналы - столбцы; view импеданса последнего отсчёта;
+                 view меток времени)
+        """
+        if self.ring_buffer is None:
+            self.ring_buffer = source.create_ring_buffer(window_size=self.window_samples,
+                                                         max_samples=self.hop_samples)
+        n_samples = source.pull_chunk(self.ring_buffer, timeout=self.chunk_timeout, max_samples=self.hop_samples)
+        if not n_samples:
+            return None, None, None
+        return (self.ring_buffer.latest_eeg(n_samples), self.ring_buffer.latest_impedance(),
+                self.ring_buffer.latest_timestamps(n_samples))
+
+    @deprecated("Use stream_filtration, MNE objects are rebuilt on every chunk")
     def create_mne_raw(self, data_input, sampling_freq: int):
         """Создание Raw объекта библиотеки MNE, который необходим для дальнейшей фильтрации
         :param data_input: массив сырых ЭЭГ данных
@@ -65,6 +174,7 @@ class TransformData:
         simulated_raw = mne.io.RawArray(data_input, info)
         return simulated_raw
 
+    @deprecated("Use stream_filtration, MNE objects are rebuilt on every chunk")
     def mne_raw_filtration(self, eeg_data, sfreq: int):
         """
         Фильтрация сырых данных ЭЭГ по Альфа и бетта ритму
@@ -86,70 +196,158 @@ class TransformData:
 
         return (alpha_data, beta_data)
 
-    def data_processing(self, eeg_data, average_baseline: dict, sfreq: int):
+    def data_processing(self, eeg_data, baseline_min: np.ndarray, baseline_max: np.ndarray, sfreq: int):
         """Обработка сырых ЭЭГ с выводом % вероятности motor imagery (desync)
         :param eeg_data: массив сырых ЭЭГ данных
-        :param average_baseline: словарь с минимальным и максимальным значением разницы между Альфа и бетта ритмом в каждом канале
+        :param baseline_min: минимальные значения разницы между Альфа и бетта ритмом в каждом канале
+        :param baseline_max: максимальные значения разницы между Альфа и бетта ритмом в каждом канале
         :param sfreq: частота дискретизации ЭЭГ сигнала
         """
 
-        alpha_data, beta_data = self.mne_raw_filtration(eeg_data,sfreq)
+        alpha_data, beta_data = self.stream_filtration.filtration(eeg_data, sfreq)
 
         """Итоговый расчёт"""
-        desync = ProcessingManager.get_average_difference(alpha_data, beta_data, average_baseline)
+        desync = ProcessingManager.get_average_difference_all_channels(alpha_data, beta_data,
+                                                                       baseline_min, baseline_max)
 
         return desync
 
-    def calibrate_and_record(self, all_data, desync_data_uuid, inlet_data, impedance_dict):
+    def sliding_data_processing(self, eeg_data, baseline_min: np.ndarray, baseline_max: np.ndarray, sfreq: int):
+        """Обработка скользящим окном: фильтруются только новые отсчёты, отфильтрованные данные
+        накапливаются в кольцевых буферах, десинхронизация считается по последнему окну
+        :param eeg_data: массив новых сырых ЭЭГ данных (каналы - строки)
+        :param baseline_min: минимальные значения разницы между Альфа и бетта ритмом в каждом канале
+        :param baseline_max: максимальные значения разницы между Альфа и бетта ритмом в каждом канале
+        :param sfreq: частота дискретизации ЭЭГ сигнала
+        :return: desync или None, пока окно не заполнено
+        """
+        alpha_data, beta_data = self.stream_filtration.filtration(eeg_data, sfreq)
+
+        if self.alpha_window is None:
+            n_channels = alpha_data.shape[0]
+            self.alpha_window = RingBuffer(n_channels, n_channels, self.window_samples, self.hop_samples,
+                                           capacity_factor=settings.ring_buffer_windows, dtype=np.float64)
+            self.beta_window = RingBuffer(n_channels, n_channels, self.window_samples, self.hop_samples,
+                                          capacity_factor=settings.ring_buffer_windows, dtype=np.float64)
+        self.alpha_window.append(alpha_data.T)
+        self.beta_window.append(beta_data.T)
+        if len(self.alpha_window) < self.window_samples:
+            return None
+
+        """Итоговый расчёт по последнему окну"""
+        alpha_window = self.alpha_window.latest(self.window_samples).T
+        beta_window = self.beta_window.latest(self.window_samples).T
+        desync = ProcessingManager.get_average_difference_all_channels(alpha_window, beta_window,
+                                                                       baseline_min, baseline_max)
+        return desync
+
+    def calibrate_and_record(self, data_from_device, desync_data_uuid, device_name, impedance_dict, timestamps=None):
         """
         Работает при calibration is True. Обновление данных в RethinkDB и в PostgreSQL
+        :param data_from_device: данные ЭЭГ, отсчёты - строки, каналы - столбцы
+        :param timestamps: метки времени отсчётов от того чтения, которое их вернуло, без них в архив пишется NaN
         """
-        logger_processes_control.debug(all_data[0])
-        data_from_device = all_data[:, :len(all_data[0]) // 2]
+        logger_processes_control.debug(data_from_device[0])
+
+        """Архив сырого сигнала"""
+        if self.raw_archive is not None:
+            self.raw_archive.append(desync_data_uuid, self.channel_names,
+                                    self.filtration.settings.get_sampling_frequency(), data_from_device, timestamps)
 
         """Обработка данных"""
-        desync = self.data_processing(data_from_device.T, self.average_baseline,
-                                      self.filtration.settings.get_sampling_frequency())
+        desync = self.process_chunk(data_from_device.T, self.filtration.settings.get_sampling_frequency())
+        if desync is None:
+            RethinkDB.rethink_update_impedance(desync_data_uuid, impedance_dict)
+            return
 
         """Запись в RethinkDB"""
         desync_dict = dict(zip(self.channel_names, desync))
+        desync_average = self.record_average(desync, len(data_from_device))
+        if desync_average is not None:
+            self.record_desync_sample(desync_data_uuid, desync_average)
+        logger_processes_control.debug(desync_dict)
+        RethinkDB.rethink_update_data(device_name, desync_dict, impedance_dict)
+
+    def process_chunk(self, eeg_data, sfreq: int) -> np.ndarray | None:
+        """
+        Десинхронизация по новому чанку данных с текущими базовыми значениями
+        :param eeg_data: массив новых сырых ЭЭГ данных (каналы - строки)
+        :param sfreq: частота дискретизации ЭЭГ сигнала
+        :return: desync или None, пока окно скользящего окна не заполнено
+        """
+        if settings.sliding_window:
+            return self.sliding_data_processing(eeg_data, self.baseline_min, self.baseline_max, sfreq)
+        return self.data_processing(eeg_data, self.baseline_min, self.baseline_max, sfreq)
+
+    def record_average(self, desync: np.ndarray, n_samples: int) -> np.ndarray | None:
+        """
+        Усреднение десинхронизации для записи в PostgreSQL раз в five_minute_sample * max_samples отсчётов
+        :param desync: десинхронизация по последнему чанку
+        :param n_samples: количество новых отсчётов в чанке
+        :return: среднее значение, если пора записывать, иначе None
+        """
+        desync_average = None
         if len(self.desync_prev):
             # Todo определиться с выбором среднего значения
-            desync_average = np.vstack([self.desync_prev, desync])
-            desync_average = np.around(np.mean(desync_average, axis=0), 2)
-            self.five_minute_sample += 1
-            if self.five_minute_sample == settings.five_minute_sample:
-                desync_dict_average = dict(zip(self.channel_names, desync_average))
-                PostgresqlDB.update_desync_data(desync_data_uuid, desync_dict_average, DesyncDatas)
+            average = np.vstack([self.desync_prev, desync])
+            average = np.around(np.mean(average, axis=0), 2)
+            # Считаем новые отсчёты, а не окна, чтобы период записи не зависел от шага скользящего окна
+            self.five_minute_sample += n_samples
+            if self.five_minute_sample >= settings.five_minute_sample * settings.max_samples:
+                desync_average = average
                 self.five_minute_sample = 0
         self.desync_prev = desync
-        logger_processes_control.debug(desync_dict)
-        RethinkDB.rethink_update_data(inlet_data, desync_dict, impedance_dict)
+        return desync_average
+
+    def record_desync_sample(self, desync_data_uuid, desync_average: np.ndarray):
+        """
+        Запись среднего значения десинхронизации по каналам в desync_samples. Записи копятся
+        до desync_samples_batch_size, но не дольше desync_samples_flush_seconds, и вставляются одним запросом
+        :param desync_data_uuid: uuid исследования
+        :param desync_average: средние значения десинхронизации по каналам
+        """
+        now = datetime.now(timezone.utc)
+        self.desync_samples.append({'research_uuid': UUID(str(desync_data_uuid)),
+                                    'ts': now,
+                                    'channels': list(self.channel_names),
+                                    'values': desync_average.tolist()})
+        oldest = self.desync_samples[0]['ts']
+        if (len(self.desync_samples) >= settings.desync_samples_batch_size
+                or (now - oldest).total_seconds() >= settings.desync_samples_flush_seconds):
+            self.flush_desync_samples()
+
+    def flush_desync_samples(self):
+        """Вставка накопленных записей desync_samples, не дожидаясь заполнения пачки"""
+        if not self.desync_samples:
+            return
+        # Список заменяется до вставки, чтобы close из обработчика SIGTERM не вставил те же записи повторно
+        desync_samples, self.desync_samples = self.desync_samples, []
+        PostgresqlDB.insert_desync_samples(desync_samples)
 
     @deprecated
-    def get_baseline_old(self, inlet_data: StreamInlet, time_calibration: float):
+    def get_baseline_old(self, source: SampleSource, time_calibration: float):
         """
         Поиск baseline для десинхронизации
         """
-        channel_names = LslRead().get_channel_names(inlet_data)
+        channel_names = source.channel_names()
 
-        all_data = LslRead().create_chunk_sample(inlet_data, timeout=time_calibration + 1.0,
-                                                 max_samples=int(time_calibration * 250))
+        all_data = source.pull_samples(timeout=time_calibration + 1.0,
+                                       max_samples=int(time_calibration * 250))
         logger_processes_control.debug(all_data[0])
         all_data = np.array(all_data)
         data_from_device = all_data[:, :len(all_data[0]) // 2]
 
         baseline_list = np.around(np.mean(data_from_device, axis=0), 2)
         baseline = dict(zip(channel_names, baseline_list))
-        RethinkDB.rethink_update_baseline(inlet_data, baseline)
+        RethinkDB.rethink_update_baseline(source.name, baseline)
         self.channel_names, self.baseline_list = channel_names, baseline_list
 
     @deprecated
-    def get_average_baseline(self, inlet_data: StreamInlet, time_calibration: float):
+    def get_average_baseline(self, source: SampleSource, time_calibration: float):
 
-        channel_names = LslRead().get_channel_names(inlet_data)
-        all_data = LslRead().create_chunk_sample(inlet_data, timeout=time_calibration + 1.0,
-                                                 max_samples=int(time_calibration * 250))
+        channel_names = source.channel_names()
+        all_data = source.pull_samples(timeout=time_calibration + 1.0,
+                                       max_samples=int(time_calibration * 250))
 
         logger_processes_control.debug(all_data[0])
 
@@ -171,21 +369,22 @@ class TransformData:
             mean_channel_difference = np.mean(average_difference_channel)
             average_baseline.append(mean_channel_difference)
 
-        self.average_baseline = {'max': np.max(difference_average), 'min': np.min(difference_average)}
+        self.baseline_min, self.baseline_max = np.min(difference_average), np.max(difference_average)
 
         baseline = dict(zip(channel_names, average_baseline))
-        RethinkDB.rethink_update_baseline(inlet_data, baseline)
+        RethinkDB.rethink_update_baseline(source.name, baseline)
         self.channel_names, self.baseline_list = channel_names, average_baseline
 
-    def get_average_baseline_mne(self, inlet_data: StreamInlet, time_calibration: float):
+    def get_average_baseline_mne(self, source: SampleSource, time_calibration: float):
         """
         Расчёт базовых значений минимальных и максимальных разницы между Альфа и бетта ритмом в каждом канале
         :return: float
         """
         """Получение данных"""
-        channel_names = LslRead().get_channel_names(inlet_data)
-        all_data = LslRead().create_chunk_sample(inlet_data, timeout=time_calibration + 1.0,
-                                                 max_samples=int(time_calibration * 250))
+        channel_names = source.channel_names()
+        sfreq = self.filtration.settings.get_sampling_frequency()
+        all_data = source.pull_samples(timeout=time_calibration + 1.0,
+                                       max_samples=int(time_calibration * sfreq))
 
         logger_processes_control.debug(all_data[0])
 
@@ -193,23 +392,66 @@ class TransformData:
         data_from_device = all_data[:, :len(all_data[0]) // 2]
 
         '''Процес фильтрации данных по Альфа и Бета ритму'''
-        alpha_data, beta_data = self.mne_raw_filtration(data_from_device.T, self.filtration.settings.get_sampling_frequency())
+        alpha_data, beta_data = self.stream_filtration.filtration(data_from_device.T,
+                                                                  self.filtration.settings.get_sampling_frequency())
 
         """считаем мощности по разным каналам разных ритмов"""
-        average_a_array = ProcessingManager.get_average_all_channel_segments(alpha_data, settings.max_samples)
-        average_b_array = ProcessingManager.get_average_all_channel_segments(beta_data, settings.max_samples)
+        average_a_array = ProcessingManager.get_average_all_channel_segments(alpha_data, self.window_samples)
+        average_b_array = ProcessingManager.get_average_all_channel_segments(beta_data, self.window_samples)
 
         difference_average = average_a_array - average_b_array
 
         """Ищем минимальные и максимальные значения разниц между Альфа и бета ритмами в каждом канале"""
-        average_baseline = []  # TODO По сути не информативна, можно переделать запись на максимальное и минимальное значение разницы
-        for i in range(len(difference_average)):
-            mean_channel_difference = np.mean(difference_average[i])
-            average_baseline.append(mean_channel_difference)
-            self.average_baseline[f'Ch_{i}'] = {'max': np.max(difference_average[i]),
-                                                'min': np.min(difference_average[i])}
+        average_baseline = np.mean(difference_average, axis=1)  # TODO По сути не информативна, можно переделать запись на максимальное и минимальное значение разницы
+        self.baseline_min = np.min(difference_average, axis=1)
+        self.baseline_max = np.max(difference_average, axis=1)
 
         """Запись данных в RethinkDB"""
         baseline = dict(zip(channel_names, average_baseline))
-        RethinkDB.rethink_update_baseline(inlet_data, baseline)
+        RethinkDB.rethink_update_baseline(source.name, baseline)
+        self.channel_names, self.baseline_list = channel_names, average_baseline
+
+    def get_average_baseline_incremental(self, source: SampleSource, time_calibration: float):
+        """
+        Расчёт базовых значений по мере поступления данных: поток читается небольшими чанками, мощности сегментов
+        сразу сворачиваются в минимум, максимум и среднее по каналам, прогресс калибровки пишется в RethinkDB.
+        Вся запись калибровки в памяти не хранится.
+        """
+        channel_names = source.channel_names()
+        device_name = source.name
+        sfreq = self.filtration.settings.get_sampling_frequency()
+        total_samples = int(time_calibration * sfreq)
+        chunk_samples = min(self.hop_samples, max(1, int(settings.calibration_chunk_seconds * sfreq)))
+
+        if self.ring_buffer is None:
+            self.ring_buffer = source.create_ring_buffer(window_size=self.window_samples,
+                                                         max_samples=self.hop_samples)
+        accumulator = CalibrationAccumulator(self.stream_filtration, self.window_samples)
+        received_samples = 0
+        RethinkDB.rethink_update_calibration_progress(device_name, 0)
+
+        deadline = time.monotonic() + time_calibration + 1.0
+        while received_samples < total_samples and time.monotonic() < deadline:
+            n_samples = source.pull_chunk(self.ring_buffer, timeout=self.chunk_timeout,
+                                          max_samples=min(chunk_samples, total_samples - received_samples))
+            if not n_samples:
+                continue
+            received_samples += n_samples
+
+            """Фильтрация нового чанка и мощности заполненных сегментов"""
+            accumulator.update(self.ring_buffer.latest_eeg(n_samples).T, sfreq)
+
+            RethinkDB.rethink_update_calibration_progress(device_name,
+                                                          round(100 * received_samples / total_samples, 1))
+
+        if not accumulator.segments_count:
+            logger_processes_control.error(f'Calibration of {device_name} failed: {received_samples} samples '
+                                           f'received, {self.window_samples} needed for one segment')
+            return
+
+        """Базовые значения по каналам и запись данных в RethinkDB"""
+        average_baseline, self.baseline_min, self.baseline_max = accumulator.result()
+        baseline = dict(zip(channel_names, average_baseline))
+        RethinkDB.rethink_update_baseline(source.name, baseline)
+        RethinkDB.rethink_update_calibration_progress(device_name, 100)
         self.channel_names, self.baseline_list = channel_names, average_baseline
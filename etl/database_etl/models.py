@@ -2,7 +2,7 @@ from typing import Optional
 from uuid import UUID, uuid4
 
 from pydantic_extra_types.phone_numbers import PhoneNumber
-from sqlalchemy import ForeignKey, Column, String, Boolean, Table, JSON, DateTime
+from sqlalchemy import ForeignKey, Column, String, Boolean, Table, JSON, DateTime, Index, Float, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects import postgresql
@@ -124,10 +124,17 @@ class DeviceType(Base):
 
 class DesyncDatas(Base):
     __tablename__ = 'desyncdatas'
+    # Индексы под фильтры и постраничную выборку истории исследований, см. миграцию 3f9a1c7d2b10
+    __table_args__ = (
+        Index('ix_desyncdatas_user_uuid_date', 'user_uuid', 'date', 'uuid'),
+        Index('ix_desyncdatas_patient_uuid_date', 'patient_uuid', 'date', 'uuid'),
+        Index('ix_desyncdatas_device_uuid_date', 'device_uuid', 'date', 'uuid'),
+        Index('ix_desyncdatas_date_uuid', 'date', 'uuid'),
+    )
     uuid: Optional[UUID] = Column(postgresql.UUID(as_uuid=True), default=uuid4, nullable=False, primary_key=True)
 
     data: dict = Column(JSON, nullable=True)
-    date: DateTime = Column(DateTime(timezone=True), nullable=True)
+    date: DateTime = Column(DateTime(timezone=True), nullable=False, server_default=text('CURRENT_TIMESTAMP'))
 
     device_uuid: UUID = Column(postgresql.UUID(as_uuid=True),
                                ForeignKey(column='device.uuid', ondelete="CASCADE", onupdate="CASCADE"),
@@ -148,6 +155,21 @@ class DesyncDatas(Base):
     type_research = relationship(argument="TypeResearch", back_populates="desyncdatas")
 
 
+class DesyncSamples(Base):
+    """
+    Значения десинхронизации исследования, только добавление: одна строка на запись среднего по каналам.
+    Ключ (research_uuid, ts) служит и индексом для выборки отрезка исследования по времени
+    """
+    __tablename__ = 'desync_samples'
+    research_uuid: UUID = Column(postgresql.UUID(as_uuid=True),
+                                 ForeignKey(column='desyncdatas.uuid', ondelete="CASCADE", onupdate="CASCADE"),
+                                 nullable=False, primary_key=True)
+    ts: DateTime = Column(DateTime(timezone=True), nullable=False, primary_key=True)
+
+    channels: list = Column(postgresql.ARRAY(String), nullable=False)
+    values: list = Column(postgresql.ARRAY(Float), nullable=False)
+
+
 class TypeResearch(Base):
     __tablename__ = 'typeresearch'
     uuid: Optional[UUID] = Column(postgresql.UUID(as_uuid=True), default=uuid4, nullable=False, primary_key=True)
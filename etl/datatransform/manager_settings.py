@@ -6,11 +6,12 @@ class ManagerSettings:
 
     def __init__(self):
         self._sampling_frequency: int = 250
-        self._notch_filter = {'border': 50}
+        self._notch_filter = {'border': 50, 'quality': 30}
         self._alpha_filter_frequency = {'low_border': 7, 'high_border': 12}
         self._beta_filter_frequency = {'low_border': 13, 'high_border': 30}
         self._ppf: float = 20
         self._number_of_electrodes_for_filtration: int = 22
+        self._iir_filter_order: int = 4
 
     def get_sampling_frequency(self):
 
@@ -29,6 +30,22 @@ class ManagerSettings:
         """Получить верхнюю границу частоты."""
         return self._notch_filter['border']
 
+    def get_notch_filter_quality(self):
+        """Получить добротность режекторного фильтра."""
+        return self._notch_filter['quality']
+
+    def get_iir_filter_order(self):
+        """Получить порядок полосовых IIR фильтров."""
+        return self._iir_filter_order
+
+    def set_iir_filter_order(self, value: int = None):
+        """
+        Установить порядок полосовых IIR фильтров
+        """
+        if value is None:
+            raise ValueError("iir_filter_order is None.")
+        self._iir_filter_order = value
+
     def get_alpha_low_border(self):
         """Получить нижнюю границу Альфа-частоты."""
         return self._alpha_filter_frequency['low_border']
@@ -147,31 +147,79 @@ class ProcessingManager:
 
         return average_in_percentages
 
+    # Векторизованный расчёт сразу по всем каналам
+
+    @staticmethod
+    def find_peaks_all_channels(power: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Находит пиковые значения мощности сразу во всех каналах, результат совпадает с
+        scipy.signal.find_peaks без параметров (для плато берётся его середина)
+        :param power: массив мощности, каналы - строки, отсчёты - столбцы
+        :return: (номера каналов пиков, индексы пиков), пики каждого канала идут по возрастанию индекса
+        """
+        slope = np.sign(np.diff(power, axis=1))
+        # Плато (нулевой наклон) пропускаем, пик - это подъём, за которым сразу следует спад
+        rows, cols = np.nonzero(slope)
+        values = slope[rows, cols]
+        is_peak = (values[:-1] == 1) & (values[1:] == -1) & (rows[:-1] == rows[1:])
+        peak_rows = rows[:-1][is_peak]
+        peaks = (cols[:-1][is_peak] + 1 + cols[1:][is_peak]) // 2
+        return peak_rows, peaks
+
+    @staticmethod
+    def get_average_power_all_channels(eeg_data) -> np.ndarray:
+        """
+        Средняя разность между пиками мощности по каждому каналу, аналог get_average_power для всех каналов сразу.
+        Среднее соседних разностей равно (последний пик - первый пик) / (количество пиков - 1)
+        :param eeg_data: массив данных ЭЭГ, каналы - строки, отсчёты - столбцы
+        :return: ndarray, NaN для каналов, где меньше двух пиков
+        """
+        power = np.square(np.asarray(eeg_data, dtype=np.float64))
+        n_channels = power.shape[0]
+        peak_rows, peaks = ProcessingManager.find_peaks_all_channels(power)
+
+        counts = np.bincount(peak_rows, minlength=n_channels)
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        valid = counts > 1
+
+        average = np.full(n_channels, np.nan)
+        average[valid] = (peaks[ends[valid] - 1] - peaks[starts[valid]]) / (counts[valid] - 1)
+        return average
+
+    @staticmethod
+    def get_average_difference_all_channels(eeg_data_a, eeg_data_b, baseline_min: np.ndarray,
+                                            baseline_max: np.ndarray) -> np.ndarray:
+        """
+        Рассчитать разницу средних мощностей и перевести её в проценты относительно baseline сразу по всем каналам
+        :param eeg_data_a: массив данных с отфильтрованных по Альфа-ритму, каналы - строки
+        :param eeg_data_b: массив данных с отфильтрованных по Бета-ритму, каналы - строки
+        :param baseline_min: минимальные значения разности средних мощностей при каллибровке по каналам
+        :param baseline_max: максимальные значения разности средних мощностей при каллибровке по каналам
+        :return: ndarray
+        """
+        average = (ProcessingManager.get_average_power_all_channels(eeg_data_a) -
+                   ProcessingManager.get_average_power_all_channels(eeg_data_b))
+        return 100 * (1 - (average - baseline_min) / (baseline_max - baseline_min))
+
     @staticmethod
     def get_average_all_channel_segments(eeg_data, sample_segment_size):
         """
         Разбиваем входные данные на каналы, каналы делим на сегменты, считаем среднюю мощность по сегментам.
+        Сегменты получаются через reshape без копирования, мощность считается за один проход по всем сегментам.
         :param eeg_data: массив данных ЭЭГ количество каналов -строки, значения биопотенциала канала-столбцы
         :param sample_segment_size: длина сегмента в семплах (см. частоту дискретизации - 250,500,1000 и т.д. и умножай на длительность сегмента - 250Гц * 3сек. = 750 семплов)
+        :return: ndarray (каналы x сегменты)
         """
-        # Получаем сдесь для создания пустого массива подходящего размера
-        num_segments = len(eeg_data[0]) // sample_segment_size
-        average_all_channel = np.zeros((0, num_segments))
-
-        for num_channel in range(len(eeg_data)):
-
-            # разбивает всю запись на массив из N сегментов, каждый с количеством семплов == segment_size
-            segments_array = np.array(
-                [eeg_data[num_channel][i * sample_segment_size:(i + 1) * sample_segment_size] for i in range(num_segments)])
-
-            # Рассчитываем среднюю мощность для каждого сегмента выбранного канала
-            average_channel = np.array([])
-            for segments in segments_array:
-                chunk_average = ProcessingManager.get_average_power(segments)
-                average_channel = np.append(average_channel, chunk_average)
+        eeg_data = np.asarray(eeg_data)
+        n_channels = eeg_data.shape[0]
+        num_segments = eeg_data.shape[1] // sample_segment_size
 
-            average_all_channel = np.vstack([average_all_channel, average_channel])
-        return average_all_channel
+        # (каналы x сегменты x семплы) -> (каналы * сегменты x семплы), каждый сегмент считаем как отдельный канал
+        segments_array = eeg_data[:, :num_segments * sample_segment_size].reshape(n_channels * num_segments,
+                                                                                  sample_segment_size)
+        average_all_channel = ProcessingManager.get_average_power_all_channels(segments_array)
+        return average_all_channel.reshape(n_channels, num_segments)
 
     # Старый расчёт десинхронизации
 
@@ -224,3 +272,27 @@ class ProcessingManager:
                 self.corr_global[f'{self.label_electrodes[e]}'] = (self.get_old_desynch()[e] - new_desynch[e])
         self.set_old_desynch(new_desynch)
         return self.corr_global
+
+
+class SegmentPowerStream:
+    """
+    Потоковый вариант get_average_all_channel_segments: данные подаются чанками произвольной длины,
+    средняя мощность возвращается по мере заполнения сегментов, неполный сегмент ждёт следующего чанка
+    """
+
+    def __init__(self, sample_segment_size: int):
+        self.sample_segment_size = sample_segment_size
+        self._remainder: np.ndarray | None = None
+
+    def update(self, eeg_data) -> np.ndarray:
+        """
+        Добавить чанк данных
+        :param eeg_data: массив данных ЭЭГ, каналы - строки, отсчёты - столбцы
+        :return: ndarray (каналы x заполненные сегменты), может не содержать сегментов
+        """
+        eeg_data = np.asarray(eeg_data)
+        if self._remainder is not None and self._remainder.shape[1]:
+            eeg_data = np.concatenate([self._remainder, eeg_data], axis=1)
+        num_segments = eeg_data.shape[1] // self.sample_segment_size
+        self._remainder = eeg_data[:, num_segments * self.sample_segment_size:].copy()
+        return ProcessingManager.get_average_all_channel_segments(eeg_data, self.sample_segment_size)
@@ -0,0 +1,102 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import butter, iirnotch, tf2sos, sosfilt, sosfilt_zi
+
+from datatransform.manager_settings import ManagerSettings
+from config.logs_config import logger_filtration_manager
+
+# Полосы ритмов как в TransformData.mne_raw_filtration (Альфа 7-13 Гц, Бета 13-30 Гц), чтобы значения
+# десинхронизации не изменились при переходе на потоковую фильтрацию. Альфа полоса ManagerSettings (7-12 Гц)
+# используется только старым расчётом FiltrationManager
+ALPHA_BAND = (7.0, 13.0)
+BETA_BAND = (13.0, 30.0)
+
+
+class StreamFiltrationManager:
+    """
+    Потоковая фильтрация ЭЭГ банком IIR фильтров (режекторный 50 Гц, Альфа и Бета ритм).
+    Фильтры проектируются один раз на пару (частота дискретизации, полоса), состояние фильтров (zi)
+    переносится между чанками, поэтому на границах чанков не возникает переходных процессов.
+    """
+
+    def __init__(self, settings: ManagerSettings):
+        self.settings = settings
+        self._zi: dict = {}
+        self._state_key: tuple | None = None
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def design_notch(sfreq: float, freq: float, quality: float) -> np.ndarray:
+        """
+        Проектирование режекторного фильтра в виде секций второго порядка
+        :param sfreq: частота дискретизации ЭЭГ сигнала
+        :param freq: вырезаемая частота
+        :param quality: добротность фильтра
+        :return: ndarray sos
+        """
+        b, a = iirnotch(freq, quality, fs=sfreq)
+        return tf2sos(b, a)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def design_bandpass(sfreq: float, low_border: float, high_border: float, order: int) -> np.ndarray:
+        """
+        Проектирование полосового фильтра Баттерворта в виде секций второго порядка
+        :param sfreq: частота дискретизации ЭЭГ сигнала
+        :param low_border: нижняя граница полосы
+        :param high_border: верхняя граница полосы
+        :param order: порядок фильтра
+        :return: ndarray sos
+        """
+        return butter(order, [low_border, high_border], btype='bandpass', fs=sfreq, output='sos')
+
+    def reset(self):
+        """Сброс состояния фильтров, следующий чанк начнёт фильтрацию заново"""
+        self._zi = {}
+        self._state_key = None
+
+    def _sos_filtration(self, name: str, sos: np.ndarray, eeg_data: np.ndarray) -> np.ndarray:
+        """
+        Фильтрация чанка с сохранением состояния фильтра
+        :param name: имя фильтра, под которым хранится его состояние
+        :param sos: коэффициенты фильтра
+        :param eeg_data: массив ЭЭГ данных, каналы - строки, отсчёты - столбцы
+        """
+        zi = self._zi.get(name)
+        if zi is None:
+            # Начальное состояние по первому отсчёту каждого канала, чтобы не ловить скачок на старте
+            zi = sosfilt_zi(sos)[:, np.newaxis, :] * eeg_data[np.newaxis, :, 0, np.newaxis]
+        filtered, self._zi[name] = sosfilt(sos, eeg_data, axis=-1, zi=zi)
+        return filtered
+
+    def filtration(self, eeg_data, sfreq: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Фильтрация сырых данных ЭЭГ по Альфа и Бета ритму для всех каналов сразу
+        :param eeg_data: массив сырых ЭЭГ данных, каналы - строки, отсчёты - столбцы
+        :param sfreq: частота дискретизации ЭЭГ сигнала
+        :return: (alpha_data, beta_data)
+        """
+        eeg_data = np.asarray(eeg_data, dtype=np.float64)
+        state_key = (sfreq, eeg_data.shape[0])
+        if state_key != self._state_key:
+            if self._state_key is not None:
+                logger_filtration_manager.warning(f'Stream parameters changed {self._state_key} -> {state_key}, '
+                                                  f'filter state is reset')
+            self.reset()
+            self._state_key = state_key
+
+        if eeg_data.shape[-1] == 0:
+            return eeg_data.copy(), eeg_data.copy()
+
+        order = self.settings.get_iir_filter_order()
+        notch_sos = self.design_notch(sfreq, self.settings.get_notch_filter_border(),
+                                      self.settings.get_notch_filter_quality())
+        alpha_sos = self.design_bandpass(sfreq, *ALPHA_BAND, order)
+        beta_sos = self.design_bandpass(sfreq, *BETA_BAND, order)
+
+        notch_data = self._sos_filtration('notch', notch_sos, eeg_data)  # Вырезаем помехи от электросети
+        alpha_data = self._sos_filtration('alpha', alpha_sos, notch_data)
+        beta_data = self._sos_filtration('beta', beta_sos, notch_data)
+
+        return alpha_data, beta_data
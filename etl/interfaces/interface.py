@@ -3,6 +3,7 @@ from pylsl import StreamInlet, resolve_streams
 from deprecated import deprecated
 
 from config.logs_config import logger_interface
+from interfaces.ring_buffer import RingBuffer
 from config.settings import settings
 
 
@@ -100,6 +101,43 @@ class LslRead:
                 chunk[i].extend([0] * len(chunk[i]))
         return chunk
 
+    @staticmethod
+    def create_ring_buffer(inlet_eeg: StreamInlet, window_size: int = settings.max_samples,
+                           max_samples: int = settings.max_samples,
+                           use_impedance: bool = settings.use_impedance) -> RingBuffer:
+        """
+        Создание кольцевого буфера под формат потока
+        :param inlet_eeg: StreamInlet
+        :param window_size: максимальный размер окна обработки в отсчётах
+        :param max_samples: максимальное количество отсчётов за одно чтение
+        :param use_impedance: bool
+        :return: RingBuffer
+        """
+        channel_count = int(inlet_eeg.info().channel_count())
+        # Без use_impedance вторая половина каналов потока - импеданс
+        n_eeg_channels = channel_count if use_impedance else channel_count // 2
+        return RingBuffer(n_channels=channel_count, n_eeg_channels=n_eeg_channels, window_size=window_size,
+                          max_chunk=max_samples, capacity_factor=settings.ring_buffer_windows,
+                          dtype=np.dtype(inlet_eeg.value_type))
+
+    @staticmethod
+    def create_chunk_buffer(inlet_eeg: StreamInlet, ring_buffer: RingBuffer, timeout: float = 4.0,
+                            max_samples: int = settings.max_samples) -> int:
+        """
+        Чтение chunk сразу в кольцевой буфер без промежуточных списков
+        :param inlet_eeg: StreamInlet
+        :param ring_buffer: RingBuffer
+        :param timeout: float
+        :param max_samples: int
+        :return: количество прочитанных отсчётов
+        """
+        logger_interface.info('Start create chunk buffer')
+        _, timestamps = inlet_eeg.pull_chunk(timeout=timeout, max_samples=max_samples,
+                                             dest_obj=ring_buffer.writable(max_samples))
+        n_samples = len(timestamps)
+        ring_buffer.commit(n_samples, timestamps)
+        return n_samples
+
 
 """ Запуск для тестов """
 if __name__ == '__main__':
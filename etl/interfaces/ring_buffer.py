@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Предвыделенный кольцевой буфер отсчётов (отсчёты - строки, каналы - столбцы).
+    Данные пишутся непосредственно в буфер (pylsl dest_obj), а последние `window_size` отсчётов
+    всегда лежат в памяти непрерывно, поэтому окна для обработки отдаются как view без копирования.
+    """
+
+    def __init__(self, n_channels: int, n_eeg_channels: int, window_size: int, max_chunk: int,
+                 capacity_factor: int = 4, dtype=np.float32):
+        """
+        :param n_channels: количество каналов в потоке
+        :param n_eeg_channels: количество каналов ЭЭГ, остальные каналы потока - импеданс
+        :param window_size: максимальный размер окна, который должен оставаться доступным
+        :param max_chunk: максимальное количество отсчётов за одно чтение
+        :param capacity_factor: во сколько окон выделять буфер, чем больше - тем реже сдвиг хвоста в начало
+        :param dtype: тип данных буфера, должен совпадать с форматом каналов потока
+        """
+        self.n_channels = n_channels
+        self.n_eeg_channels = n_eeg_channels
+        self.window_size = window_size
+        self.max_chunk = max_chunk
+        capacity = window_size * capacity_factor + max_chunk
+        self.buffer = np.zeros((capacity, n_channels), dtype=dtype)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.write_pos: int = 0
+        self.total_samples: int = 0
+        # Если импеданс в потоке не передаётся, отдаём постоянный нулевой вектор
+        self._zero_impedance = np.zeros(n_eeg_channels, dtype=dtype)
+
+    def __len__(self) -> int:
+        return self.write_pos
+
+    def _compact(self):
+        """Перенос последнего окна в начало буфера, чтобы освободить место для записи"""
+        keep = min(self.write_pos, self.window_size)
+        self.buffer[:keep] = self.buffer[self.write_pos - keep:self.write_pos]
+        self.timestamps[:keep] = self.timestamps[self.write_pos - keep:self.write_pos]
+        self.write_pos = keep
+
+    def writable(self, n_samples: int) -> np.ndarray:
+        """
+        Получить непрерывный участок буфера для записи следующих отсчётов
+        :param n_samples: количество отсчётов для записи
+        :return: ndarray view
+        """
+        if n_samples > self.max_chunk:
+            raise ValueError(f"Chunk of {n_samples} samples exceeds max_chunk={self.max_chunk}")
+        if self.write_pos + n_samples > len(self.buffer):
+            self._compact()
+        return self.buffer[self.write_pos:self.write_pos + n_samples]
+
+    def commit(self, n_samples: int, timestamps=None):
+        """
+        Подтвердить запись отсчётов в участок, полученный через writable
+        :param n_samples: количество записанных отсчётов
+        :param timestamps: метки времени записанных отсчётов
+        """
+        if timestamps is not None and n_samples:
+            self.timestamps[self.write_pos:self.write_pos + n_samples] = timestamps[:n_samples]
+        self.write_pos += n_samples
+        self.total_samples += n_samples
+
+    def append(self, chunk, timestamps=None):
+        """
+        Дописать чанк в буфер с копированием, для источников без прямой записи в буфер
+        :param chunk: массив отсчётов (отсчёты - строки, каналы - столбцы)
+        :param timestamps: метки времени отсчётов
+        """
+        chunk = np.asarray(chunk)
+        for start in range(0, len(chunk), self.max_chunk):
+            part = chunk[start:start + self.max_chunk]
+            self.writable(len(part))[:] = part
+            self.commit(len(part), None if timestamps is None else timestamps[start:start + self.max_chunk])
+
+    def latest(self, n_samples: int) -> np.ndarray:
+        """
+        Последние n_samples отсчётов всех каналов потока без копирования
+        :param n_samples: количество отсчётов, не больше window_size
+        :return: ndarray view
+        """
+        n_samples = min(n_samples, self.write_pos)
+        return self.buffer[self.write_pos - n_samples:self.write_pos]
+
+    def latest_eeg(self, n_samples: int) -> np.ndarray:
+        """
+        Последние n_samples отсчётов каналов ЭЭГ без копирования
+        :param n_samples: количество отсчётов, не больше window_size
+        :return: ndarray view
+        """
+        return self.latest(n_samples)[:, :self.n_eeg_channels]
+
+    def latest_timestamps(self, n_samples: int) -> np.ndarray:
+        """
+        Метки времени последних n_samples отсчётов без копирования
+        :param n_samples: количество отсчётов, не больше window_size
+        :return: ndarray view
+        """
+        n_samples = min(n_samples, self.write_pos)
+        return self.timestamps[self.write_pos - n_samples:self.write_pos]
+
+    def latest_impedance(self) -> np.ndarray:
+        """
+        Последние значения импеданса по каждому каналу
+        :return: ndarray view
+        """
+        if self.n_channels == self.n_eeg_channels or not self.write_pos:
+            return self._zero_impedance
+        return self.buffer[self.write_pos - 1, self.n_eeg_channels:]
@@ -0,0 +1,356 @@
+import time
+from abc import ABC, abstractmethod
+from urllib.parse import parse_qsl
+
+import mne
+import numpy as np
+from pylsl import StreamInlet
+
+from config.logs_config import logger_interface
+from config.settings import settings
+from interfaces.interface import LslRead
+from interfaces.ring_buffer import RingBuffer
+from load_data.raw_archive import RawArchiveReader
+
+# Источник устройства задаётся строкой в settings.sample_sources: "<вид>[:<путь>][?<параметр>=<значение>&...]",
+# например "file:/data/recordings/Альфа.edf?speed=10" или "synthetic?channels=8&seed=1&speed=0".
+# Устройства, которых нет в sample_sources, читаются из LSL
+SOURCE_KINDS = ("file", "synthetic")
+
+
+class RecordingSource:
+    """
+    Сырой сигнал сохранённой записи: архив ETL (.draw) или EDF файл (например из data/)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._archive: RawArchiveReader | None = None
+        self._raw = None
+        if path.endswith('.draw'):
+            self._archive = RawArchiveReader(path)
+            self.channels: list = self._archive.channels
+            self.sfreq: float = self._archive.sfreq
+            self.n_samples: int = self._archive.n_samples
+        else:
+            self._raw = mne.io.read_raw_edf(path, preload=False, verbose=False)
+            self.channels: list = self._raw.ch_names
+            self.sfreq: float = self._raw.info['sfreq']
+            self.n_samples: int = self._raw.n_times
+
+    def read(self, start: int, stop: int, picks: list[int]) -> np.ndarray:
+        """
+        Отрезок записи в мкВ, как его отдаёт поток устройства
+        :param start: номер первого отсчёта
+        :param stop: номер отсчёта после последнего
+        :param picks: номера каналов
+        :return: ndarray, каналы - строки, отсчёты - столбцы
+        """
+        if self._archive is not None:
+            return self._archive.read_range(start, stop)[:, picks].T
+        return self._raw.get_data(picks=picks, start=start, stop=stop, units='uV')
+
+
+class SampleSource(ABC):
+    """
+    Источник отсчётов устройства для TransformData. Отсчёты пишутся чанками в кольцевой буфер в формате
+    потока LSL: каналы ЭЭГ, за ними каналы импеданса, если use_impedance выключен
+    """
+    name: str = ''
+    # Частота дискретизации источника, 0 - неизвестна
+    sfreq: float = 0.0
+
+    @abstractmethod
+    def channel_names(self) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def impedance_names(self) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_ring_buffer(self, window_size: int = settings.max_samples,
+                           max_samples: int = settings.max_samples) -> RingBuffer:
+        raise NotImplementedError
+
+    @abstractmethod
+    def pull_chunk(self, ring_buffer: RingBuffer, timeout: float = 4.0, max_samples: int = settings.max_samples) -> int:
+        """
+        Чтение chunk в кольцевой буфер
+        :return: количество прочитанных отсчётов
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def pull_samples(self, timeout: float = 4.0, max_samples: int = settings.max_samples) -> np.ndarray:
+        """
+        Чтение chunk массивом в формате LslRead.create_chunk_sample: каналы ЭЭГ, затем импеданс
+        :return: ndarray, отсчёты - строки, каналы - столбцы
+        """
+        raise NotImplementedError
+
+
+class LslSource(SampleSource):
+    """Поток устройства из LSL"""
+
+    def __init__(self, inlet: StreamInlet):
+        self.inlet = inlet
+        self.name = inlet.info().name()
+        self.sfreq = inlet.info().nominal_srate()
+
+    def channel_names(self) -> list:
+        return LslRead.get_channel_names(self.inlet)
+
+    def impedance_names(self) -> list:
+        return LslRead.get_impedance_name(self.inlet)
+
+    def create_ring_buffer(self, window_size: int = settings.max_samples,
+                           max_samples: int = settings.max_samples) -> RingBuffer:
+        return LslRead.create_ring_buffer(self.inlet, window_size=window_size, max_samples=max_samples)
+
+    def pull_chunk(self, ring_buffer: RingBuffer, timeout: float = 4.0, max_samples: int = settings.max_samples) -> int:
+        return LslRead.create_chunk_buffer(self.inlet, ring_buffer, timeout=timeout, max_samples=max_samples)
+
+    def pull_samples(self, timeout: float = 4.0, max_samples: int = settings.max_samples) -> np.ndarray:
+        return np.array(LslRead.create_chunk_sample(self.inlet, timeout=timeout, max_samples=max_samples))
+
+
+class ReplaySource(SampleSource):
+    """
+    Источник без сети: отсчёты читаются из записи или генерируются. Скорость выдачи задаётся относительно
+    реального времени: 1 - как устройство, 10 - в десять раз быстрее, 0 - без ожидания, как успевает обработка.
+    Метки времени отсчётов идут с шагом 1 / sfreq от момента создания источника независимо от скорости
+    """
+
+    def __init__(self, name: str, sfreq: float, eeg_channels: list, speed: float = 1.0, loop: bool = True,
+                 impedance: float = 0.0, use_impedance: bool = settings.use_impedance):
+        """
+        :param name: имя устройства
+        :param sfreq: частота дискретизации, Гц
+        :param eeg_channels: имена каналов ЭЭГ
+        :param speed: скорость выдачи относительно реального времени, 0 - без ожидания
+        :param loop: по окончании записи начинать её сначала
+        :param impedance: значение каналов импеданса
+        :param use_impedance: bool, как в настройках потока LSL
+        """
+        self.name = name
+        self.sfreq = float(sfreq)
+        self.eeg_channels = list(eeg_channels)
+        self.speed = speed
+        self.loop = loop
+        self.impedance = impedance
+        self.use_impedance = use_impedance
+        n_eeg_channels = len(self.eeg_channels)
+        self.channel_count: int = n_eeg_channels if use_impedance else 2 * n_eeg_channels
+        # Длина записи в отсчётах, None - бесконечный источник
+        self.n_samples: int | None = None
+        # Сколько отсчётов уже выдано
+        self.position: int = 0
+        self.start_time: float = time.time()
+        self._clock_start: float | None = None
+
+    @abstractmethod
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """
+        Отсчёты с start по stop в мкВ
+        :return: ndarray, отсчёты - строки, каналы ЭЭГ - столбцы
+        """
+        raise NotImplementedError
+
+    @property
+    def exhausted(self) -> bool:
+        return not self.loop and self.n_samples is not None and self.position >= self.n_samples
+
+    def channel_names(self) -> list:
+        return list(self.eeg_channels)
+
+    def impedance_names(self) -> list:
+        if self.use_impedance:
+            return ['Ch:' + str(i) for i in range(self.channel_count)]
+        return ['I:' + str(i) for i in range(self.channel_count // 2)]
+
+    def create_ring_buffer(self, window_size: int = settings.max_samples,
+                           max_samples: int = settings.max_samples) -> RingBuffer:
+        return RingBuffer(n_channels=self.channel_count, n_eeg_channels=len(self.eeg_channels),
+                          window_size=window_size, max_chunk=max_samples,
+                          capacity_factor=settings.ring_buffer_windows, dtype=np.float32)
+
+    def pull_chunk(self, ring_buffer: RingBuffer, timeout: float = 4.0, max_samples: int = settings.max_samples) -> int:
+        n_samples = self._wait_samples(timeout, max_samples)
+        if not n_samples:
+            return 0
+        samples, timestamps = self._take(n_samples)
+        n_eeg_channels = len(self.eeg_channels)
+        chunk = ring_buffer.writable(n_samples)
+        chunk[:, :n_eeg_channels] = samples
+        chunk[:, n_eeg_channels:] = self.impedance
+        ring_buffer.commit(n_samples, timestamps)
+        return n_samples
+
+    def pull_samples(self, timeout: float = 4.0, max_samples: int = settings.max_samples) -> np.ndarray:
+        n_samples = self._wait_samples(timeout, max_samples)
+        samples, _ = self._take(n_samples)
+        return np.hstack([samples, np.full(samples.shape, self.impedance, dtype=samples.dtype)])
+
+    def _wait_samples(self, timeout: float, max_samples: int) -> int:
+        """
+        Ожидание отсчётов как у StreamInlet.pull_chunk: до max_samples отсчётов или до истечения timeout
+        :return: сколько отсчётов отдать
+        """
+        if self.exhausted:
+            time.sleep(timeout)
+            return 0
+        if not self.loop and self.n_samples is not None:
+            max_samples = min(max_samples, self.n_samples - self.position)
+        if self.speed <= 0:
+            return max_samples
+
+        now = time.monotonic()
+        if self._clock_start is None:
+            self._clock_start = now - self.position / (self.sfreq * self.speed)
+        wait = self._clock_start + (self.position + max_samples) / (self.sfreq * self.speed) - now
+        if wait <= timeout:
+            if wait > 0:
+                time.sleep(wait)
+            return max_samples
+        time.sleep(timeout)
+        ready = int((time.monotonic() - self._clock_start) * self.sfreq * self.speed) - self.position
+        return min(max(ready, 0), max_samples)
+
+    def _take(self, n_samples: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Следующие n_samples отсчётов, с переходом на начало записи при loop
+        :return: (отсчёты float32: отсчёты - строки, каналы ЭЭГ - столбцы; метки времени)
+        """
+        parts = []
+        start, remaining = self.position, n_samples
+        while remaining:
+            offset = start % self.n_samples if self.n_samples else start
+            count = min(remaining, self.n_samples - offset) if self.n_samples else remaining
+            parts.append(self.read(offset, offset + count))
+            start, remaining = start + count, remaining - count
+        if not parts:
+            samples = np.empty((0, len(self.eeg_channels)), dtype=np.float32)
+        else:
+            samples = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        timestamps = self.start_time + (self.position + np.arange(n_samples)) / self.sfreq
+        self.position += n_samples
+        return samples.astype(np.float32, copy=False), timestamps
+
+
+class FileSource(ReplaySource):
+    """Воспроизведение записи EDF или архива сырого сигнала (.draw) вместо устройства"""
+
+    def __init__(self, name: str, path: str, channels: list | None = None, **kwargs):
+        """
+        :param name: имя устройства
+        :param path: путь к записи
+        :param channels: имена воспроизводимых каналов, None - все каналы записи
+        """
+        self.recording = RecordingSource(path)
+        channels = channels or self.recording.channels
+        self.picks = [self.recording.channels.index(channel) for channel in channels]
+        super().__init__(name, self.recording.sfreq, channels, **kwargs)
+        self.n_samples = self.recording.n_samples
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        return self.recording.read(start, stop, self.picks).T
+
+
+class SyntheticSource(ReplaySource):
+    """
+    Синтетический сигнал: альфа (10 Гц) и бета (20 Гц) ритмы с противофазной медленной модуляцией амплитуды,
+    поэтому десинхронизация меняется с периодом period, и белый шум. При одинаковом seed сигнал повторяется
+    """
+
+    def __init__(self, name: str, channels: int = 8, sfreq: float = 250.0, alpha: float = 20.0, beta: float = 10.0,
+                 noise: float = 5.0, period: float = 30.0, seed: int = 0, **kwargs):
+        """
+        :param name: имя устройства
+        :param channels: количество каналов ЭЭГ
+        :param sfreq: частота дискретизации, Гц
+        :param alpha: амплитуда альфа ритма, мкВ
+        :param beta: амплитуда бета ритма, мкВ
+        :param noise: стандартное отклонение шума, мкВ
+        :param period: период модуляции ритмов, сек
+        :param seed: seed генератора шума
+        """
+        super().__init__(name, sfreq, ['Ch:' + str(i) for i in range(channels)], **kwargs)
+        self.alpha, self.beta, self.noise, self.period = alpha, beta, noise, period
+        self._rng = np.random.default_rng(seed)
+        # Фазы модуляции каналов разнесены, чтобы каналы не совпадали
+        self._phases = np.linspace(0, np.pi, channels, endpoint=False)
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        t = (np.arange(start, stop) / self.sfreq)[:, np.newaxis]
+        modulation = 0.5 + 0.5 * np.sin(2 * np.pi * t / self.period + self._phases)
+        samples = self.alpha * modulation * np.sin(2 * np.pi * 10.0 * t) + \
+            self.beta * (1 - modulation) * np.sin(2 * np.pi * 20.0 * t)
+        if self.noise:
+            samples += self.noise * self._rng.standard_normal(samples.shape)
+        return samples.astype(np.float32)
+
+
+def parse_source_spec(spec: str) -> tuple[str, str, dict]:
+    """
+    Разбор строки источника из settings.sample_sources
+    :param spec: "<вид>[:<путь>][?<параметр>=<значение>&...]"
+    :return: (вид, путь, параметры)
+    """
+    head, _, query = spec.partition('?')
+    kind, _, target = head.partition(':')
+    return kind.strip().lower(), target.strip(), dict(parse_qsl(query))
+
+
+def source_options(options: dict, defaults: dict) -> dict:
+    """Параметры источника, приведённые к типам значений по умолчанию. Неизвестные параметры - ошибка"""
+    unknown = set(options) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown sample source options {sorted(unknown)}, expected {sorted(defaults)}")
+    result = {}
+    for key, value in options.items():
+        default = defaults[key]
+        if isinstance(default, bool):
+            result[key] = value.lower() in ('1', 'true', 'yes')
+        elif isinstance(default, list):
+            result[key] = [item for item in value.split(',') if item]
+        else:
+            result[key] = type(default)(value)
+    return result
+
+
+def open_sample_source(device_name: str, spec: str) -> SampleSource:
+    """
+    Источник отсчётов устройства по строке настроек. LSL поток ищется в ControlProcesses, здесь создаются
+    источники без сети
+    :param device_name: имя устройства
+    :param spec: строка источника
+    :return: SampleSource
+    """
+    kind, target, options = parse_source_spec(spec)
+    replay = {'speed': 1.0, 'loop': True, 'impedance': 0.0}
+    if kind == 'file':
+        if not target:
+            raise ValueError(f"Sample source of {device_name}: file path is not set")
+        source = FileSource(device_name, target, **source_options(options, {**replay, 'channels': []}))
+    elif kind == 'synthetic':
+        source = SyntheticSource(device_name, **source_options(options, {
+            **replay, 'channels': 8, 'sfreq': 250.0, 'alpha': 20.0, 'beta': 10.0, 'noise': 5.0, 'period': 30.0,
+            'seed': 0}))
+    else:
+        raise ValueError(f"Unknown sample source {kind!r} of {device_name}, expected one of {SOURCE_KINDS}")
+    logger_interface.info(f"Device {device_name} reads {kind} source {target} at {source.sfreq} Hz, "
+                          f"speed {source.speed}")
+    return source
+
+
+""" Запуск для тестов: скорость чтения источника без обработки """
+if __name__ == '__main__':
+    import sys
+    test_source = open_sample_source('test', sys.argv[1] if len(sys.argv) > 1 else 'synthetic?speed=0')
+    test_buffer = test_source.create_ring_buffer()
+    started, pulled = time.perf_counter(), 0
+    while pulled < test_source.sfreq * 600 and not test_source.exhausted:
+        pulled += test_source.pull_chunk(test_buffer)
+    elapsed = time.perf_counter() - started
+    print(f'{pulled} samples in {elapsed:.2f} s, {pulled / test_source.sfreq / elapsed:.0f}x real time')
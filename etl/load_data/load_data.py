@@ -1,5 +1,10 @@
+import os
 import sys
+import json
+import time
 import hashlib
+import threading
+from contextlib import contextmanager
 import string
 import random
 from http import HTTPStatus
@@ -13,18 +18,152 @@ import numpy as np
 from pylsl import StreamInlet
 from rethinkdb import r, errors as re
 import backoff
+import redis
 
 from sqlalchemy.orm import sessionmaker, make_transient
-from sqlalchemy import create_engine, exc, inspect
+from sqlalchemy import create_engine, exc, inspect, insert
 from sqlalchemy.future import select
 from sqlalchemy_utils import database_exists, create_database
 
 from config.settings import settings
 from config.logs_config import logger_load_data
-from database_etl.models import Base, Device, Clinic, User, ClinicAddress
+from database_etl.models import Base, Device, Clinic, User, ClinicAddress, DesyncSamples
 from datetime import datetime
 
 
+class RethinkConnectionPool:
+    """
+    Пул подключений к RethinkDB. Пул привязан к процессу: после fork процесс-обработчик устройства
+    не использует сокеты родителя, а открывает собственные подключения
+    """
+
+    def __init__(self, connect, max_size: int, health_check_interval: float):
+        """
+        :param connect: функция открытия нового подключения
+        :param max_size: максимальное количество простаивающих подключений
+        :param health_check_interval: через сколько секунд простоя подключение проверяется запросом перед выдачей
+        """
+        self._connect = connect
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self._pid = os.getpid()
+        self._idle: list = []
+        self._lock = threading.Lock()
+
+    def _check_process(self):
+        """Сброс подключений, унаследованных от родительского процесса"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+            self._lock = threading.Lock()
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        """Проверка подключения перед выдачей из пула"""
+        if not conn.is_open():
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            r.expr(True).run(conn)
+            return True
+        except re.ReqlDriverError:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close(noreply_wait=False)
+        except re.ReqlError:
+            pass
+
+    def acquire(self):
+        """
+        Получить подключение из пула или открыть новое
+        :return: conn
+        """
+        self._check_process()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+            if self._is_healthy(conn, last_used):
+                return conn
+            logger_load_data.info('Drop unhealthy rethinkdb connection')
+            self._close(conn)
+        return self._connect()
+
+    def release(self, conn):
+        """
+        Вернуть подключение в пул
+        :param conn: подключение
+        """
+        if conn.is_open():
+            with self._lock:
+                if len(self._idle) < self.max_size:
+                    self._idle.append((conn, time.monotonic()))
+                    return
+        self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """Подключение из пула на время блока with. Подключение с ошибкой драйвера в пул не возвращается"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except re.ReqlDriverError:
+            self._close(conn)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        self.release(conn)
+
+
+class RedisTelemetry:
+    """
+    Публикация кадров телеметрии устройств в Redis. Каждое устройство публикует в свой канал,
+    API подписывается на каналы и раздаёт кадры SSE клиентам без опроса RethinkDB
+    """
+    FIELDS = ('device', 'impedance', 'channel_desync', 'patient_code', 'research_status', 'desync_data_uuid')
+    _client: redis.Redis | None = None
+
+    @staticmethod
+    def channel(device: str) -> str:
+        """
+        Имя канала устройства
+        :param device: str
+        :return: str
+        """
+        return f"{settings.telemetry_channel_prefix}:{device}"
+
+    @staticmethod
+    def redis_client() -> redis.Redis:
+        """
+        Клиент Redis текущего процесса, пул соединений клиента сам пересоздаётся после fork
+        :return: redis.Redis
+        """
+        if RedisTelemetry._client is None:
+            RedisTelemetry._client = redis.Redis(host=settings.redis_host, port=settings.redis_port,
+                                                 db=settings.redis_db, socket_timeout=1)
+        return RedisTelemetry._client
+
+    @staticmethod
+    def publish(document: dict):
+        """
+        Опубликовать кадр телеметрии по документу устройства из RethinkDB.
+        Ошибки Redis не прерывают обработку, кадр просто теряется
+        :param document: dict документ устройства
+        """
+        if not settings.publish_telemetry or not document:
+            return
+        frame = {field: document.get(field) for field in RedisTelemetry.FIELDS}
+        try:
+            RedisTelemetry.redis_client().publish(RedisTelemetry.channel(frame['device']), json.dumps(frame))
+        except redis.RedisError as e:
+            logger_load_data.warning(f"Publishing telemetry error: {e}")
+
+
 class RethinkDB:
     """
     Класс для работы с базой данных реального времени RethinkDB
@@ -33,6 +172,8 @@ class RethinkDB:
     PORT = settings.rethinkdb_port
     DB = settings.rethinkdb_db
     TABLE = settings.rethinkdb_table
+    INDEXES = ('device', 'device_uuid', 'desync_data_uuid', 'research_status')
+    _pool: RethinkConnectionPool | None = None
 
     @staticmethod
     def giveup():
@@ -53,6 +194,46 @@ class RethinkDB:
         logger_load_data.info('Success connect to rethinkdb')
         return conn
 
+    @staticmethod
+    def rethink_pool() -> RethinkConnectionPool:
+        """
+        Пул подключений к RethinkDB текущего процесса
+        :return: RethinkConnectionPool
+        """
+        if RethinkDB._pool is None:
+            RethinkDB._pool = RethinkConnectionPool(RethinkDB.rethink_connect_to_db,
+                                                    max_size=settings.rethinkdb_pool_size,
+                                                    health_check_interval=settings.rethinkdb_health_check_interval)
+        return RethinkDB._pool
+
+    @staticmethod
+    def rethink_run(query):
+        """
+        Выполнить запрос на подключении из пула. При обрыве соединения подключение открывается заново
+        и запрос повторяется один раз
+        :param query: запрос RethinkDB
+        :return: результат запроса
+        """
+        try:
+            with RethinkDB.rethink_pool().connection() as conn:
+                return query.run(conn)
+        except re.ReqlDriverError as e:
+            logger_load_data.warning("Rethinkdb connection lost, reconnecting: " + e.message)
+            with RethinkDB.rethink_pool().connection() as conn:
+                return query.run(conn)
+
+    @staticmethod
+    def rethink_update_and_publish(query, fields: dict):
+        """
+        Обновить документы устройств и опубликовать их новое состояние в Redis.
+        Новое состояние возвращает само обновление, дополнительного чтения документа нет
+        :param query: выборка документов RethinkDB
+        :param fields: dict обновляемые поля
+        """
+        result = RethinkDB.rethink_run(query.update(fields, return_changes='always'))
+        for change in result.get('changes', []):
+            RedisTelemetry.publish(change.get('new_val'))
+
     @staticmethod
     def rethink_create_db(conn, db=DB):
         """
@@ -72,7 +253,7 @@ class RethinkDB:
         :param db: str
         :param table: str
         """
-        with RethinkDB.rethink_connect_to_db() as conn:
+        with RethinkDB.rethink_pool().connection() as conn:
             if db not in r.db_list().run(conn):
                 RethinkDB.rethink_create_db(conn)
 
@@ -82,6 +263,25 @@ class RethinkDB:
                 except re.ReqlError as e:
                     logger_load_data.error(f"Create table - {table} error: " + e.message)
 
+            RethinkDB.rethink_create_indexes(conn, db=db, table=table)
+
+    @staticmethod
+    def rethink_create_indexes(conn, db=DB, table=TABLE):
+        """
+        Создать вторичные индексы, по которым идут все выборки и обновления документов устройств
+        :param conn:
+        :param db: str
+        :param table: str
+        """
+        try:
+            existing_indexes = r.db(db).table(table).index_list().run(conn)
+            for index in RethinkDB.INDEXES:
+                if index not in existing_indexes:
+                    r.db(db).table(table).index_create(index).run(conn)
+            r.db(db).table(table).index_wait().run(conn)
+        except re.ReqlError as e:
+            logger_load_data.error(f"Create indexes - {table} error: " + e.message)
+
     @staticmethod
     def rethink_delete_table(db=DB, table=TABLE):
         """
@@ -89,8 +289,7 @@ class RethinkDB:
         :param db: str
         :param table: str
         """
-        with RethinkDB.rethink_connect_to_db() as conn:
-            r.db(db).table(table).delete().run(conn)
+        RethinkDB.rethink_run(r.db(db).table(table).delete())
 
     @staticmethod
     def rethink_from_postgresql(devices: list, db=DB, table=TABLE):
@@ -101,12 +300,13 @@ class RethinkDB:
         :param table: str
         """
         RethinkDB.rethink_delete_table()
-        with RethinkDB.rethink_connect_to_db() as conn:
+        with RethinkDB.rethink_pool().connection() as conn:
             # if not devices:
             #     return
             for device in devices:
                 r.db(db).table(table).insert({"device": device.name, "device_uuid": str(device.uuid),
                                               "research_status": {}, "calibration": False, "time_calibration": 10.0,
+                                              "calibration_progress": 0,
                                               "baseline": {}, "channel_desync": {}, "impedance": {},
                                               "desync_data_uuid": {}, "status": False, "patient_code": {},
                                               "date_start": {}, "duration": {}}).run(conn)
@@ -115,8 +315,8 @@ class RethinkDB:
     @deprecated("Insert data. Old method, now use 'rethink_from_postgresql'")
     def rethink_insert_data(inlet_data: StreamInlet, table=TABLE, db=DB):
         try:
-            with RethinkDB.rethink_connect_to_db() as conn:
-                lst = list(r.db(db).table(table).filter(r.row["device"] == inlet_data.info().name()).run(conn))
+            with RethinkDB.rethink_pool().connection() as conn:
+                lst = list(r.db(db).table(table).get_all(inlet_data.info().name(), index="device").run(conn))
                 if len(lst) == 0:
                     r.db(db).table(table).insert({"device": inlet_data.info().name(), "patient": None, "status": 1,
                                                   "channel_desync": {}}).run(conn)
@@ -124,21 +324,35 @@ class RethinkDB:
             logger_load_data.error("Inserting initialization data error: " + e.message)
 
     @staticmethod
-    def rethink_update_baseline(inlet_data: StreamInlet, baseline: dict, table=TABLE, db=DB):
+    def rethink_update_baseline(device: str, baseline: dict, table=TABLE, db=DB):
         """
         Обновление baseline в RethinkDB
-        :param inlet_data: StreamInlet
+        :param device: str
         :param baseline: dict
         :param table: str
         :param db: str
         """
         try:
-            with RethinkDB.rethink_connect_to_db() as conn:
-                r.db(db).table(table).filter(r.row["device"] ==
-                                             inlet_data.info().name()).update({"baseline": baseline}).run(conn)
+            RethinkDB.rethink_run(r.db(db).table(table).get_all(str(device), index="device").update(
+                {"baseline": baseline}))
         except re.ReqlError as e:
             logger_load_data.error("Updating data error: " + e.message)
 
+    @staticmethod
+    def rethink_update_calibration_progress(device: str, progress: float, table=TABLE, db=DB):
+        """
+        Обновление прогресса калибровки в RethinkDB
+        :param device: str
+        :param progress: float процент выполнения калибровки
+        :param table: str
+        :param db: str
+        """
+        try:
+            RethinkDB.rethink_run(r.db(db).table(table).get_all(str(device), index="device").update(
+                {"calibration_progress": progress}))
+        except re.ReqlError as e:
+            logger_load_data.error("Updating calibration_progress error: " + e.message)
+
     @staticmethod
     def rethink_calibration_false(device: str, table=TABLE, db=DB):
         """
@@ -148,8 +362,8 @@ class RethinkDB:
         :param db: str
         """
         try:
-            with RethinkDB.rethink_connect_to_db() as conn:
-                r.db(db).table(table).filter({"device": str(device)}).update({"calibration": bool(False)}).run(conn)
+            RethinkDB.rethink_run(r.db(db).table(table).get_all(str(device), index="device").update(
+                {"calibration": bool(False)}))
         except re.ReqlError as e:
             logger_load_data.error("Updating data error: " + e.message)
 
@@ -162,16 +376,16 @@ class RethinkDB:
         :param db: str
         """
         try:
-            with RethinkDB.rethink_connect_to_db() as conn:
-                r.db(db).table(table).filter({"device": str(device)}).update({"status": bool(False)}).run(conn)
+            RethinkDB.rethink_run(r.db(db).table(table).get_all(str(device), index="device").update(
+                {"status": bool(False)}))
         except re.ReqlError as e:
             logger_load_data.error("Updating data error: " + e.message)
 
     @staticmethod
-    def rethink_update_data(inlet_data: StreamInlet, corr: dict, impedance: dict, table=TABLE, db=DB):
+    def rethink_update_data(device: str, corr: dict, impedance: dict, table=TABLE, db=DB):
         """
         Обновление данных в RethinkDB
-        :param inlet_data: StreamInlet
+        :param device: str
         :param corr: dict
         :param impedance: dict
         :param table: str
@@ -182,11 +396,8 @@ class RethinkDB:
             if np.isnan(cor):
                 corr[key] = 0
         try:
-            with RethinkDB.rethink_connect_to_db() as conn:
-                r.db(db).table(table).filter(r.row["device"] ==
-                                             inlet_data.info().name()).update({"channel_desync": corr}).run(conn)
-                r.db(db).table(table).filter(r.row["device"] ==
-                                             inlet_data.info().name()).update({"impedance": impedance}).run(conn)
+            RethinkDB.rethink_update_and_publish(r.db(db).table(table).get_all(str(device), index="device"),
+                                                 {"channel_desync": corr, "impedance": impedance})
         except re.ReqlError as e:
             logger_load_data.error("Updating data error: " + e.message)
 
@@ -200,9 +411,9 @@ class RethinkDB:
         :param db: str
         """
         try:
-            with RethinkDB.rethink_connect_to_db() as conn:
-                r.db(db).table(table).filter(r.row["desync_data_uuid"] ==
-                                             str(desync_data_uuid)).update({"impedance": impedance}).run(conn)
+            RethinkDB.rethink_update_and_publish(r.db(db).table(table).get_all(str(desync_data_uuid),
+                                                                               index="desync_data_uuid"),
+                                                 {"impedance": impedance})
         except re.ReqlError as e:
             logger_load_data.error("Updating data error: " + e.message)
 
@@ -216,8 +427,8 @@ class RethinkDB:
         :param research_status: str
         """
         try:
-            with RethinkDB.rethink_connect_to_db() as conn:
-                r.db(db).table(table).filter({"device": str(device)}).update({"research_status": research_status}).run(conn)
+            RethinkDB.rethink_update_and_publish(r.db(db).table(table).get_all(str(device), index="device"),
+                                                 {"research_status": research_status})
         except re.ReqlError as e:
             logger_load_data.error("Updating research_status error: " + e.message)
 
@@ -264,6 +475,7 @@ class PostgresqlDB:
         pass
 
     @staticmethod
+    @deprecated("Rewrites the whole data JSON on every sample, use 'insert_desync_samples'")
     def update_desync_data(uuid: str, desync_average: dict, model, session=get_session()):
         """
         Обновление десинхронизации в PostgreSQL
@@ -285,6 +497,26 @@ class PostgresqlDB:
         finally:
             session.close()
 
+    @staticmethod
+    def insert_desync_samples(samples: list[dict], model=DesyncSamples):
+        """
+        Добавление значений десинхронизации в PostgreSQL одним executemany, данные исследования не читаются
+        и не перезаписываются
+        :param samples: list строк {'research_uuid': UUID, 'ts': datetime, 'channels': list, 'values': list}
+        :param model: DesyncSamples
+        """
+        if not samples:
+            return
+        session = PostgresqlDB.get_session()
+        try:
+            session.execute(insert(model), samples)
+            session.commit()
+        except exc.SQLAlchemyError as e:
+            session.rollback()
+            logger_load_data.error(f'Inserting samples error: {e}')
+        finally:
+            session.close()
+
     @staticmethod
     @deprecated
     def insert_data(uuid: str, desync_average: dict, model, session=get_session()):
@@ -0,0 +1,340 @@
+import os
+import json
+import time
+import zlib
+import queue
+import struct
+import bisect
+import threading
+from typing import Iterator
+
+import numpy as np
+
+from config.settings import settings
+from config.logs_config import logger_load_data
+
+# Файл архива сырого сигнала одного исследования:
+#   FILE_MAGIC, длина заголовка (uint32), заголовок JSON (каналы, частота, кодек, время начала);
+#   далее блоки: CHUNK_MAGIC, CHUNK_HEADER (отсчётов n, размер данных, crc32 данных, первая и последняя
+#   метки времени LSL), минимумы и максимумы каналов float32[c], данные блока;
+#   или метка пропуска: GAP_MAGIC, GAP_HEADER (отсчётов n, первая и последняя метки времени LSL) - отсчёты,
+#   которые не попали в архив, потому что фоновый поток не успевал записывать.
+# Данные блока - метки времени float64[n] и отсчёты float32[n, c] (отсчёты - строки, каналы - столбцы),
+# сжатые zlib целиком или без сжатия. Без сжатия блок читается numpy.memmap без копирования.
+# Все числа little-endian
+FILE_MAGIC = b"DSRAW001"
+CHUNK_MAGIC = b"CHNK"
+CHUNK_HEADER = struct.Struct("<IIIdd")
+GAP_MAGIC = b"GAP0"
+GAP_HEADER = struct.Struct("<Idd")
+CODECS = ("zlib", "none")
+# Для float данных ЭЭГ уровни сжатия выше первого почти не уменьшают размер, но заметно медленнее
+ZLIB_LEVEL = 1
+
+
+def archive_path(research_uuid: str, directory: str = settings.raw_archive_dir) -> str:
+    return os.path.join(directory, f"{research_uuid}.draw")
+
+
+class RawArchiveWriter:
+    """
+    Запись сырого сигнала ЭЭГ исследований в архив. Отсчёты копятся в памяти процесса устройства до блока
+    raw_archive_chunk_seconds, сжатие и запись на диск выполняет фоновый поток, поэтому цикл обработки
+    не ждёт диск. Если фоновый поток не успевает, блоки отбрасываются с записью в лог, а перед следующим
+    записанным блоком в архив пишется метка пропуска с количеством потерянных отсчётов
+    """
+
+    def __init__(self, directory: str = settings.raw_archive_dir, codec: str = settings.raw_archive_codec,
+                 chunk_seconds: float = settings.raw_archive_chunk_seconds, max_queue: int = 16,
+                 put_timeout: float = settings.raw_archive_put_timeout):
+        """
+        :param directory: каталог архива
+        :param codec: 'zlib' или 'none'
+        :param chunk_seconds: длительность блока, сек
+        :param max_queue: сколько блоков может ждать записи
+        :param put_timeout: сколько ждать места в очереди для открытия файла и последней метки пропуска, сек
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown raw archive codec {codec!r}, expected one of {CODECS}")
+        self.directory = directory
+        self.codec = codec
+        self.chunk_seconds = chunk_seconds
+        self.put_timeout = put_timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self._research: str | None = None
+        self._chunk_samples: int = 0
+        self._pending: list[tuple[np.ndarray, np.ndarray]] = []
+        self._pending_samples: int = 0
+        # Отброшенные и ещё не отмеченные в архиве отсчёты: (количество, первая и последняя метки времени)
+        self._dropped: tuple[int, float, float] | None = None
+
+    def _start(self):
+        if self._thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name='raw_archive', daemon=True)
+            self._thread.start()
+
+    def append(self, research_uuid: str, channels: list, sfreq: float, samples: np.ndarray,
+               timestamps: np.ndarray | None = None):
+        """
+        Добавить отсчёты исследования. Массивы копируются, можно передавать view кольцевого буфера
+        :param research_uuid: uuid исследования, при смене исследования начинается новый файл
+        :param channels: имена каналов
+        :param sfreq: частота дискретизации, Гц
+        :param samples: отсчёты ЭЭГ, отсчёты - строки, каналы - столбцы
+        :param timestamps: метки времени LSL отсчётов, без них в архив пишется NaN
+        """
+        research_uuid = str(research_uuid)
+        if research_uuid != self._research:
+            self.flush()
+            self._start()
+            self._chunk_samples = max(1, int(self.chunk_seconds * sfreq))
+            # Без открытого файла фоновый поток отбросил бы все блоки исследования, поэтому открытие ждёт
+            # места в очереди, а если не дождалось - повторяется со следующими отсчётами
+            if not self._put(("open", research_uuid, {"channels": list(channels), "sfreq": float(sfreq)}),
+                             timeout=self.put_timeout):
+                self._research = None
+                return
+            self._research = research_uuid
+            self._dropped = None
+        samples = np.array(samples, dtype="<f4")
+        if timestamps is None:
+            timestamps = np.full(len(samples), np.nan)
+        self._pending.append((np.array(timestamps, dtype="<f8"), samples))
+        self._pending_samples += len(samples)
+        if self._pending_samples >= self._chunk_samples:
+            self.flush()
+
+    def flush(self):
+        """Отправить накопленные отсчёты на запись, не дожидаясь заполнения блока"""
+        if not self._pending:
+            return
+        timestamps = np.concatenate([part[0] for part in self._pending])
+        samples = np.concatenate([part[1] for part in self._pending])
+        self._pending, self._pending_samples = [], 0
+        if not self._put(("chunk", self._research, (timestamps, samples, self._dropped))):
+            self._drop(timestamps)
+            return
+        self._dropped = None
+
+    def _drop(self, timestamps: np.ndarray):
+        """Учёт отброшенного блока для метки пропуска"""
+        if not len(timestamps):
+            return
+        if self._dropped is None:
+            self._dropped = (len(timestamps), float(timestamps[0]), float(timestamps[-1]))
+        else:
+            self._dropped = (self._dropped[0] + len(timestamps), self._dropped[1], float(timestamps[-1]))
+
+    def close(self):
+        """Записать накопленные отсчёты и дождаться окончания записи"""
+        self.flush()
+        if self._dropped is not None and self._put(("gap", self._research, self._dropped), timeout=self.put_timeout):
+            self._dropped = None
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._research = None
+
+    def _put(self, item, timeout: float | None = None) -> bool:
+        """
+        Отправка в очередь записи
+        :param item: (вид, uuid исследования, данные)
+        :param timeout: сколько ждать места в очереди, без него - не ждать
+        :return: False, если очередь заполнена и элемент отброшен
+        """
+        try:
+            if timeout is None:
+                self._queue.put_nowait(item)
+            else:
+                self._queue.put(item, timeout=timeout)
+        except queue.Full:
+            logger_load_data.error(f'Raw archive queue is full, {item[0]} for research {item[1]} dropped')
+            return False
+        return True
+
+    def _run(self):
+        file, research_uuid, codec = None, None, self.codec
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, item_research, payload = item
+            try:
+                if kind == "open":
+                    if file is not None:
+                        file.close()
+                        file = None
+                    file, codec = self._open(item_research, payload)
+                    research_uuid = item_research
+                elif file is not None and item_research == research_uuid:
+                    if kind == "chunk":
+                        timestamps, samples, dropped = payload
+                        if dropped is not None:
+                            file.write(encode_gap(*dropped))
+                        file.write(encode_chunk(timestamps, samples, codec))
+                    else:
+                        file.write(encode_gap(*payload))
+                    file.flush()
+            except (OSError, ValueError) as e:
+                logger_load_data.error(f'Raw archive write error: {e}')
+        if file is not None:
+            file.close()
+
+    def _open(self, research_uuid: str, header: dict):
+        """
+        Файл исследования открывается на дозапись, например после перезапуска процесса устройства.
+        Заголовок пишется только в новый файл, в существующий блоки пишутся его кодеком
+        :return: (файл, кодек)
+        """
+        path = archive_path(research_uuid, self.directory)
+        if os.path.exists(path) and os.path.getsize(path):
+            reader = RawArchiveReader(path)
+            file = open(path, "r+b")
+            # Недописанный при остановке процесса блок отбрасывается, иначе за ним не прочитать новые
+            file.truncate(reader.end_offset)
+            file.seek(0, os.SEEK_END)
+            return file, reader.codec
+        file = open(path, "ab")
+        header = json.dumps({"version": 2, "research_uuid": research_uuid, "codec": self.codec,
+                             "dtype": "float32", "start": time.time(), **header}).encode()
+        file.write(FILE_MAGIC + struct.pack("<I", len(header)) + header)
+        return file, self.codec
+
+
+def encode_gap(n_samples: int, first_ts: float, last_ts: float) -> bytes:
+    """
+    Метка пропуска: отсчёты, не попавшие в архив
+    :param n_samples: количество потерянных отсчётов
+    :param first_ts: метка времени первого потерянного отсчёта
+    :param last_ts: метка времени последнего потерянного отсчёта
+    :return: bytes
+    """
+    return GAP_MAGIC + GAP_HEADER.pack(n_samples, first_ts, last_ts)
+
+
+def encode_chunk(timestamps: np.ndarray, samples: np.ndarray, codec: str) -> bytes:
+    """
+    Блок архива
+    :param timestamps: метки времени float64[n]
+    :param samples: отсчёты float32[n, c]
+    :param codec: 'zlib' или 'none'
+    :return: bytes
+    """
+    data = timestamps.astype("<f8").tobytes() + np.ascontiguousarray(samples, dtype="<f4").tobytes()
+    if codec == "zlib":
+        data = zlib.compress(data, ZLIB_LEVEL)
+    first_ts, last_ts = (float(timestamps[0]), float(timestamps[-1])) if len(timestamps) else (np.nan, np.nan)
+    return b"".join([CHUNK_MAGIC, CHUNK_HEADER.pack(len(samples), len(data), zlib.crc32(data), first_ts, last_ts),
+                     samples.min(axis=0).astype("<f4").tobytes(), samples.max(axis=0).astype("<f4").tobytes(),
+                     data])
+
+
+class RawArchiveReader:
+    """
+    Чтение архива сырого сигнала исследования. Индекс блоков строится по их заголовкам без чтения данных.
+    Метки пропуска собираются в gaps, номера отсчётов блоков считаются без потерянных отсчётов
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise ValueError(f"{path} is not a raw archive file")
+            header_size, = struct.unpack("<I", file.read(4))
+            self.header: dict = json.loads(file.read(header_size))
+            self.channels: list = self.header["channels"]
+            self.sfreq: float = self.header["sfreq"]
+            self.codec: str = self.header["codec"]
+            # Блок: (смещение данных, отсчётов, размер данных, crc32, первая метка, последняя метка)
+            self.chunks: list[tuple] = []
+            # Пропуск: (номер отсчёта записи, перед которым он был, потеряно отсчётов, первая и последняя метки)
+            self.gaps: list[tuple[int, int, float, float]] = []
+            n_samples = 0
+            self.physical_min = np.full(len(self.channels), np.inf, dtype=np.float32)
+            self.physical_max = np.full(len(self.channels), -np.inf, dtype=np.float32)
+            file_size = os.fstat(file.fileno()).st_size
+            bounds_size = 8 * len(self.channels)
+            # Конец последнего целого блока, дальше может быть недописанный блок
+            self.end_offset: int = file.tell()
+            while file.tell() + len(CHUNK_MAGIC) + GAP_HEADER.size <= file_size:
+                magic = file.read(len(CHUNK_MAGIC))
+                if magic == GAP_MAGIC:
+                    self.gaps.append((n_samples, *GAP_HEADER.unpack(file.read(GAP_HEADER.size))))
+                    self.end_offset = file.tell()
+                    continue
+                if magic != CHUNK_MAGIC:
+                    raise ValueError(f"{path}: broken chunk at offset {file.tell() - len(CHUNK_MAGIC)}")
+                if file.tell() + CHUNK_HEADER.size + bounds_size > file_size:
+                    break
+                chunk_samples, data_size, crc, first_ts, last_ts = CHUNK_HEADER.unpack(file.read(CHUNK_HEADER.size))
+                bounds = np.frombuffer(file.read(bounds_size), dtype="<f4")
+                offset = file.tell()
+                if offset + data_size > file_size:
+                    # Блок не дописан, например процесс устройства был остановлен во время записи
+                    break
+                self.chunks.append((offset, chunk_samples, data_size, crc, first_ts, last_ts))
+                n_samples += chunk_samples
+                np.minimum(self.physical_min, bounds[:len(self.channels)], out=self.physical_min)
+                np.maximum(self.physical_max, bounds[len(self.channels):], out=self.physical_max)
+                file.seek(data_size, os.SEEK_CUR)
+                self.end_offset = file.tell()
+
+        # Номер первого отсчёта каждого блока, для чтения произвольного отрезка записи
+        self.chunk_starts: list[int] = []
+        n_samples = 0
+        for chunk in self.chunks:
+            self.chunk_starts.append(n_samples)
+            n_samples += chunk[1]
+        self.n_samples: int = n_samples
+        self._last_chunk: tuple[int, np.ndarray] | None = None
+
+    def read_chunk(self, index: int, verify: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Блок архива. Без сжатия массивы - memmap файла, без копирования
+        :param index: номер блока
+        :param verify: проверить crc32 данных блока
+        :return: (метки времени float64[n], отсчёты float32[n, c])
+        """
+        offset, n_samples, data_size, crc, _, _ = self.chunks[index]
+        n_channels = len(self.channels)
+        if self.codec == "none" and not verify:
+            timestamps = np.memmap(self.path, dtype="<f8", mode="r", offset=offset, shape=(n_samples,))
+            samples = np.memmap(self.path, dtype="<f4", mode="r", offset=offset + 8 * n_samples,
+                                shape=(n_samples, n_channels))
+            return timestamps, samples
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            data = file.read(data_size)
+        if verify and zlib.crc32(data) != crc:
+            raise ValueError(f"{self.path}: crc mismatch in chunk {index}")
+        if self.codec == "zlib":
+            data = zlib.decompress(data)
+        timestamps = np.frombuffer(data, dtype="<f8", count=n_samples)
+        samples = np.frombuffer(data, dtype="<f4", offset=8 * n_samples).reshape(n_samples, n_channels)
+        return timestamps, samples
+
+    def read_range(self, start: int, stop: int) -> np.ndarray:
+        """
+        Отсчёты записи с start по stop, последний прочитанный блок не распаковывается повторно
+        :param start: номер первого отсчёта
+        :param stop: номер отсчёта после последнего
+        :return: отсчёты float32, отсчёты - строки, каналы - столбцы
+        """
+        parts = []
+        index = max(bisect.bisect_right(self.chunk_starts, start) - 1, 0)
+        while index < len(self.chunks) and self.chunk_starts[index] < stop:
+            if self._last_chunk is None or self._last_chunk[0] != index:
+                self._last_chunk = (index, self.read_chunk(index)[1])
+            chunk_start = self.chunk_starts[index]
+            parts.append(self._last_chunk[1][max(start - chunk_start, 0):stop - chunk_start])
+            index += 1
+        if not parts:
+            return np.empty((0, len(self.channels)), dtype=np.float32)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def iter_chunks(self) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        for index in range(len(self.chunks)):
+            yield self.read_chunk(index)
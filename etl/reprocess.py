@@ -0,0 +1,4 @@
+from control_proc.reprocess import main
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""desyncdatas search indexes
+
+Revision ID: 3f9a1c7d2b10
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a1c7d2b10'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Составные индексы под фильтры истории исследований. uuid в конце ключа нужен для постраничной
+# выборки по курсору (date, uuid)
+COMPOSITE_INDEXES = {
+    'ix_desyncdatas_user_uuid_date': ('user_uuid', 'date', 'uuid'),
+    'ix_desyncdatas_patient_uuid_date': ('patient_uuid', 'date', 'uuid'),
+    'ix_desyncdatas_device_uuid_date': ('device_uuid', 'date', 'uuid'),
+    'ix_desyncdatas_date_uuid': ('date', 'uuid'),
+}
+
+
+def upgrade() -> None:
+    # Таблицы создаются приложением (create_all), поэтому индексы создаются только если их ещё нет
+    for name, columns in COMPOSITE_INDEXES.items():
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON desyncdatas ({', '.join(columns)})")
+
+    # Поиск по части uuid исследования: LIKE '%...%' по uuid::text использует триграммный индекс
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_desyncdatas_uuid_trgm "
+               "ON desyncdatas USING gin ((CAST(uuid AS TEXT)) gin_trgm_ops)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_desyncdatas_uuid_trgm")
+    for name in COMPOSITE_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
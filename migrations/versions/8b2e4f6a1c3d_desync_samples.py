@@ -0,0 +1,35 @@
+"""desync samples table
+
+Revision ID: 8b2e4f6a1c3d
+Revises: 3f9a1c7d2b10
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4f6a1c3d'
+down_revision: Union[str, None] = '3f9a1c7d2b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Отсчёты десинхронизации исследования, только добавление. Первичный ключ (research_uuid, ts) служит
+    # индексом для выборки отрезка исследования по времени. Таблицу может уже создать ETL (create_all)
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS desync_samples (
+            research_uuid UUID NOT NULL REFERENCES desyncdatas (uuid) ON DELETE CASCADE ON UPDATE CASCADE,
+            ts TIMESTAMP WITH TIME ZONE NOT NULL,
+            channels VARCHAR[] NOT NULL,
+            "values" DOUBLE PRECISION[] NOT NULL,
+            PRIMARY KEY (research_uuid, ts)
+        )
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS desync_samples")
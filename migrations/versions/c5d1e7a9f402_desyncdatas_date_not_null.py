@@ -0,0 +1,35 @@
+"""desyncdatas date not null
+
+Revision ID: c5d1e7a9f402
+Revises: 8b2e4f6a1c3d
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d1e7a9f402'
+down_revision: Union[str, None] = '8b2e4f6a1c3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # date - ключ постраничной выборки истории (date, uuid). С NOT NULL сортировка и сравнение с курсором
+    # идут по самой колонке и обслуживаются индексами (..., date, uuid). Пустая дата заполняется временем
+    # первого отсчёта исследования, если он есть
+    op.execute("""
+        UPDATE desyncdatas SET date = COALESCE(
+            (SELECT min(ts) FROM desync_samples WHERE desync_samples.research_uuid = desyncdatas.uuid),
+            CURRENT_TIMESTAMP)
+        WHERE date IS NULL
+    """)
+    op.execute("ALTER TABLE desyncdatas ALTER COLUMN date SET DEFAULT CURRENT_TIMESTAMP")
+    op.execute("ALTER TABLE desyncdatas ALTER COLUMN date SET NOT NULL")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE desyncdatas ALTER COLUMN date DROP NOT NULL")
@@ -58,4 +58,16 @@ async def test_update_settings():
 
         # Восстанавливаем оригинальные настройки
         response = await ac.put("/api/v1/admin_panel/settings/", json=original_settings, headers=headers)
-        assert response.status_code == status.HTTP_200_OK  # Ожидаем успешный ответ
\ No newline at end of file
+        assert response.status_code == status.HTTP_200_OK  # Ожидаем успешный ответ
+
+@pytest.mark.asyncio
+async def test_get_cpu_executor_metrics():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        token = await get_auth_token(ac)
+        headers = {"Authorization": f"Bearer {token}"}
+        response = await ac.get("/api/v1/admin_panel/cpu_executor", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert {"kind", "max_workers", "max_pending", "in_flight", "waiting", "tasks"} <= data.keys()
+        # Авторизация хэширует пароль в пуле
+        assert data["tasks"]
@@ -239,3 +239,25 @@ async def test_filter_user_by_name_or_surname():
         for item in data['items']:
             assert name_filter in item["first_name"] or name_filter in item["last_name"]
 
+
+
+@pytest.mark.asyncio
+async def test_user_list_cursor_page():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        token = await get_auth_token(ac)
+        headers = {"Authorization": f"Bearer {token}"}
+        params = {"name_or_surname": "John", "limit": 1}
+
+        response = await ac.get("/api/v1/admin_panel/user/", headers=headers, params=params)
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert len(data["items"]) == 1
+        assert "page" not in data
+        assert "John" in data["items"][0]["first_name"] or "John" in data["items"][0]["last_name"]
+
+        # Следующая страница по курсору, если пользователей больше одного
+        if data["next_cursor"]:
+            response = await ac.get("/api/v1/admin_panel/user/", headers=headers,
+                                    params={**params, "cursor": data["next_cursor"]})
+            assert response.status_code == status.HTTP_200_OK
+            assert response.json()["items"][0]["uuid"] != data["items"][0]["uuid"]
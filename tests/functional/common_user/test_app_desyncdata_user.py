@@ -149,6 +149,38 @@ async def test_filter_research_by_partial_uuid():
             assert partial_uuid in item['uuid'], f"UUID {item['uuid']} does not contain partial '{partial_uuid}'"
 
 
+@pytest.mark.asyncio
+async def test_get_research_series():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        token = await get_auth_token(ac)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        research_uuid = await get_existing_research_uuid(ac, headers)
+        params = {"points": 10, "method": "minmax"}
+        response = await ac.get(f"/api/v1/desync_datas/{research_uuid}/series", headers=headers, params=params)
+
+        assert response.status_code == status.HTTP_200_OK, f"Expected 200 but got {response.status_code}"
+        data = response.json()
+        assert data["research_uuid"] == research_uuid
+        for series in data["channels"].values():
+            assert len(series["ts"]) <= params["points"]  # Точек не больше запрошенного количества
+
+
+@pytest.mark.asyncio
+async def test_export_research_csv():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        token = await get_auth_token(ac)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        research_uuid = await get_existing_research_uuid(ac, headers)
+        response = await ac.get(f"/api/v1/desync_datas/{research_uuid}/export", headers=headers,
+                                params={"format": "csv"})
+
+        assert response.status_code == status.HTTP_200_OK, f"Expected 200 but got {response.status_code}"
+        assert response.headers["content-type"].startswith("text/csv")
+        assert response.text.splitlines()[0].startswith("ts")  # Первая строка - заголовок со временем и каналами
+
+
 async def get_existing_research_uuid(ac, headers):
     # Запрос на получение списка исследований
     response = await ac.get("/api/v1/admin_panel/desync_datas/", headers=headers)
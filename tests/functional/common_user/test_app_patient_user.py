@@ -109,3 +109,34 @@ async def test_filter_patients_by_code():
         # Проверяем, что все пациенты имеют код "888"
         for patient in data['items']:
             assert patient["code"] == patient_code
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("total", [None, "exact", "estimate"])
+async def test_patients_cursor_page(total):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        token = await get_auth_token(ac)
+        headers = {"Authorization": f"Bearer {token}"}
+        for _ in range(2):
+            response = await ac.post("/api/v1/patient/registration", headers=headers,
+                                     json={"code": f"P{uuid.uuid4().hex[:6]}", "diagnosis": "Cursor"})
+            assert response.status_code == status.HTTP_200_OK
+
+        params = {"limit": 1}
+        if total:
+            params["total"] = total
+        response = await ac.get("/api/v1/patient/", headers=headers, params=params)
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert len(data["items"]) == 1
+        assert data["next_cursor"]
+        assert "page" not in data
+        assert "total_is_estimate" in data
+        if total:
+            assert data["total"] >= 2
+
+        # Следующая страница по курсору
+        response = await ac.get("/api/v1/patient/", headers=headers,
+                                params={**params, "cursor": data["next_cursor"]})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["items"][0]["uuid"] != data["items"][0]["uuid"]